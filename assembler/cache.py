@@ -0,0 +1,72 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		cache.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	On disk cache of assembled procedures, keyed on content hash.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import hashlib,json,os
+
+# ***************************************************************************************
+#		Each entry holds the code of one procedure (locals, strings and code) with
+#		the relocations needed to put it somewhere else.
+#
+#			"code" 			list of bytes, from the first local to the last instruction.
+#			"entry" 		offset of the procedure's entry point in the code.
+#			"parameters" 	parameter count.
+#			"locals" 		list of [name,offset] of local variables, in the order they
+#							were allocated. Offset is null for locals sharing another
+#							procedure's storage, which are relocated by name.
+#			"procedures" 	procedure name => parameter count, for procedures called.
+#			"relocations" 	list of [offset,name,addend]. Word at offset becomes the
+#							address of name + addend, or the code base + addend if
+#							name is null.
+# ***************************************************************************************
+
+class ProcedureCache(object):
+	VERSION = 14 																# change if code generated changes
+	def __init__(self,directory = ".hlacache"):
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.hits = 0
+		self.misses = 0
+	#
+	#		Create a key from a list of things that affect the procedure's code
+	#
+	def createKey(self,parts):
+		return hashlib.sha1(repr([ProcedureCache.VERSION]+parts).encode()).hexdigest()
+	#
+	#		Load an entry, returns None if not present.
+	#
+	def load(self,key):
+		fileName = self.getFileName(key)
+		if not os.path.exists(fileName):
+			self.misses += 1
+			return None
+		self.hits += 1
+		with open(fileName) as h:
+			return json.load(h)
+	#
+	#		Save an entry. Written to a temporary file first so a half written entry
+	#		is never loaded.
+	#
+	def save(self,key,entry):
+		fileName = self.getFileName(key)
+		with open(fileName+".tmp","w") as h:
+			json.dump(entry,h)
+		os.replace(fileName+".tmp",fileName)
+	#
+	#		Get file name for a key
+	#
+	def getFileName(self,key):
+		return self.directory+os.sep+key+".json"
+	#
+	#		Get hit/miss counts
+	#
+	def getStatistics(self):
+		return { "hits":self.hits,"misses":self.misses }
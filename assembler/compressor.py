@@ -0,0 +1,128 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		compressor.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Boot image block compressor, for the boot loader's Decompress.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#		A compressed image is a list of blocks, each the image for $8000-$BFFF or a
+#		code page, as a 2 byte length and the data. Length $0000 is 16k of raw data,
+#		and $FFFF ends the image. Compressed data is a list of tokens.
+#
+#			$00 			end of block
+#			$01-$7F 		that many literal bytes follow
+#			$80-$BF 		(token & $3F)+2 copies of the byte which follows
+#			$C0-$FF 		copy (token & $3F)+3 bytes from the 2 byte distance back
+#
+#		Matches are within the block, as the one before is paged out.
+#
+#		The boot loader reads a packed block into CompressBuffer at $6000 and unpacks
+#		it. The buffer ends at $7CFF, below the loader's stack, which starts at $7DFF
+#		under its code at $7E00.
+# ***************************************************************************************
+
+class BlockCompressor(object):
+	BUFFERSIZE = 0x1D00 														# $6000-$7CFF, stack above
+	MAXLITERALS = 0x7F
+	MAXRUN = 0x3F+2
+	MAXMATCH = 0x3F+3
+	CHAIN = 16 																	# positions tried for a match
+	#
+	#		Write one block, compressed if it will fit in the boot loader's buffer.
+	#
+	def writeBlock(self,h,data):
+		packed = self.compress(data)
+		if len(packed) > BlockCompressor.BUFFERSIZE:							# store it raw.
+			h.write(bytes([0,0]))
+			h.write(data)
+			h.write(bytes(0x4000-len(data)))
+		else:
+			h.write(bytes([len(packed) & 0xFF,len(packed) >> 8]))
+			h.write(packed)
+	#
+	#		Write the end marker
+	#
+	def writeEnd(self,h):
+		h.write(bytes([0xFF,0xFF]))
+	#
+	#		Compress a block of up to 16k
+	#
+	def compress(self,data):
+		out = bytearray()
+		literals = bytearray()
+		positions = {} 															# 3 bytes => recent positions
+		i = 0
+		while i < len(data):
+			run = 1
+			while i+run < len(data) and data[i+run] == data[i] and run < BlockCompressor.MAXRUN:
+				run += 1
+			length,distance = self.findMatch(data,i,positions)
+			if run >= 3 and run >= length:										# run of one byte
+				self.flushLiterals(out,literals)
+				out += bytes([0x80+run-2,data[i]])
+				step = run
+			elif length >= 4:													# copy from before
+				self.flushLiterals(out,literals)
+				out += bytes([0xC0+length-3,distance & 0xFF,distance >> 8])
+				step = length
+			else:
+				literals.append(data[i])
+				if len(literals) == BlockCompressor.MAXLITERALS:
+					self.flushLiterals(out,literals)
+				step = 1
+			for n in range(i,i+step):											# remember where things were
+				key = bytes(data[n:n+3])
+				chain = positions.setdefault(key,[])
+				chain.append(n)
+				if len(chain) > BlockCompressor.CHAIN:
+					del chain[0]
+			i += step
+		self.flushLiterals(out,literals)
+		out.append(0x00)
+		return out
+	#
+	#		Find the longest match for data[i:] earlier in the block, (length,distance)
+	#
+	def findMatch(self,data,i,positions):
+		best = (0,0)
+		limit = min(len(data)-i,BlockCompressor.MAXMATCH)
+		for p in reversed(positions.get(bytes(data[i:i+3]),[])):
+			length = 0
+			while length < limit and data[p+length] == data[i+length]:
+				length += 1
+			if length > best[0]:
+				best = (length,i-p)
+		return best
+	#
+	#		Write out any literals waiting
+	#
+	def flushLiterals(self,out,literals):
+		if len(literals) > 0:
+			out.append(len(literals))
+			out += literals
+			del literals[:]
+	#
+	#		Decompress a block, as the boot loader does.
+	#
+	def decompress(self,packed):
+		data = bytearray()
+		i = 0
+		while packed[i] != 0:
+			token = packed[i]
+			if token < 0x80:
+				data += packed[i+1:i+1+token]
+				i += 1+token
+			elif token < 0xC0:
+				data += bytes([packed[i+1]]) * ((token & 0x3F)+2)
+				i += 2
+			else:
+				start = len(data) - (packed[i+1] + packed[i+2] * 256)
+				for n in range(0,(token & 0x3F)+3):
+					data.append(data[start+n])
+				i += 3
+		return data
@@ -9,15 +9,29 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+from listing import *
+
 # ***************************************************************************************
 #					This is a code generator for an idealised CPU
 #
 # ***************************************************************************************
 
 class DemoCodeGenerator(object):
-	def __init__(self):
+	def __init__(self,listing = None):
 		self.pc = 0x1000
 		self.ops = { "+":"add","-":"sub","*":"mul","/":"div","%":"mod","&":"and","|":"ora","^":"xor" }
+		self.listing = NullListing() if listing is None else listing
+	#
+	#		Get the listing sink
+	#
+	def getListing(self):
+		return self.listing
+	#
+	#		Send an instruction to the listing.
+	#
+	def emit(self,address,text):
+		if self.listing.enabled:
+			self.listing.code(0,address,[],text)
 	#
 	#		Load any external proc/func
 	#
@@ -38,7 +52,7 @@ class DemoCodeGenerator(object):
 	#
 	def loadDirect(self,isConstant,value):
 		src = ("#${0:04x}" if isConstant else "(${0:04x})").format(value)
-		print("${0:06x}  lda   {1}".format(self.pc,src))
+		self.emit(self.pc,"lda   {0}".format(src))
 		self.pc += 1
 	#
 	#		Do a binary operation on a constant or variable on the accumulator
@@ -46,51 +60,69 @@ class DemoCodeGenerator(object):
 	def binaryOperation(self,operator,isConstant,value):
 		if operator == "!" or operator == "?":
 			self.binaryOperation("+",isConstant,value)
-			print("${0:06x}  lda.{1} [a]".format(self.pc,"b" if operator == "?" else "w"))
+			self.emit(self.pc,"lda.{0} [a]".format("b" if operator == "?" else "w"))
 			self.pc += 1
 		else:					
 			src = ("#${0:04x}" if isConstant else "(${0:04x})").format(value)
-			print("${0:06x}  {1}   {2}".format(self.pc,self.ops[operator],src))
+			self.emit(self.pc,"{0}   {1}".format(self.ops[operator],src))
 			self.pc += 1
 	#
 	#		Store direct
 	#
 	def storeDirect(self,value):
-		print("${0:06x}  sta   (${1:04x})".format(self.pc,value))
+		self.emit(self.pc,"sta   (${0:04x})".format(value))
 		self.pc += 1
 	#
 	#		Store A indirect to address [variable] + offset/[offset]
 	#		
 	def storeIndirect(self,dataSize,baseVariable,offsetIsConstant,offset):
-		print("${0:06x}  tab".format(self.pc))
+		self.emit(self.pc,"tab")
 		self.pc += 1
 		self.loadDirect(False,baseVariable)
 		self.binaryOperation("+",offsetIsConstant,offset)
-		print("${0:06x}  stb.{1} [a]".format(self.pc,"b" if dataSize == "?" else "w"))
+		self.emit(self.pc,"stb.{0} [a]".format("b" if dataSize == "?" else "w"))
 		self.pc += 1
 	#
-	#		Generate for code.
+	#		Generate for code. The count is a constant, or None if it is in A.
 	#
-	def forCode(self):
-		print("${0:06x}  dec   a".format(self.pc))
-		print("${0:06x}  push  a".format(self.pc+1))
+	def forCode(self,count = None,bodyCalls = True):
+		if count is not None:
+			self.loadDirect(True,count)
+		loopAddress = self.pc
+		self.emit(self.pc,"dec   a")
+		self.emit(self.pc+1,"push  a")
 		self.pc += 2
+		return loopAddress
+	#
+	#		Store the loop index
+	#
+	def forIndexCode(self,loopAddress,address):
+		self.storeDirect(address)
 	#
 	#		Gemerate endfor code.
 	#
 	def endForCode(self,loopAddress):
-		print("${0:06x}  pop   a".format(self.pc))
+		self.emit(self.pc,"pop   a")
 		self.pc += 1
 		self.jumpInstruction("nz",loopAddress)
 	#
-	#	Compile a loop instruction. Test are z, nz, p or "" (unconditional). The compilation
-	#	address can be overridden to patch forward jumps.
+	#		Compare the accumulator with a constant or variable
+	#
+	def compareCode(self,test,isConstant,value):
+		src = ("#${0:04x}" if isConstant else "(${0:04x})").format(value)
+		self.emit(self.pc,"{0}   {1}".format("cmp" if test == "=" or test == "#" else "cps",src))
+		self.pc += 1
+	#
+	#	Compile a loop instruction. Test are z, nz, p, m, < >= = # after a compare or ""
+	#	(unconditional). Returns the compilation address, which can be given as the
+	#	override to patch forward jumps.
 	#
 	def jumpInstruction(self,test,target,override = None):
 		if override is None:
 			override = self.pc
 			self.pc += 1
-		print("${0:06x}  jmp   {1}${2:06x}".format(override,test+"," if test != "" else "",target))
+		self.emit(override,"jmp   {0}${1:06x}".format(test+"," if test != "" else "",target))
+		return override
 	#
 	#		Allocate count bytes of meory, default is word size
 	#
@@ -98,44 +130,60 @@ class DemoCodeGenerator(object):
 		addr = self.pc
 		count = self.getWordSize() if count is None else count
 		self.pc += count
-		print("${0:06x}  ds    ${1:04x} ; {2}".format(addr,count,"" if reason is None else reason))
+		self.emit(addr,"ds    ${0:04x} ; {1}".format(count,"" if reason is None else reason))
 		return addr
 	#
 	#		Load constant/variable to a temporary area
 	#
 	def loadParamRegister(self,regNumber,isConstant,value):
 		toLoad = "#${0:04x}" if isConstant else "(${0:04x})" 
-		print("${0:06x}  ldr   r{1},{2}".format(self.pc,regNumber,toLoad.format(value)))
+		self.emit(self.pc,"ldr   r{0},{1}".format(regNumber,toLoad.format(value)))
 		self.pc += 1
 	#
 	#		Copy parameter to a temporary area
 	#
 	def storeParamRegister(self,regNumber,address):
-		print("${0:06x}  str   r{1},(${2:04x})".format(self.pc,regNumber,address))
+		self.emit(self.pc,"str   r{0},(${1:04x})".format(regNumber,address))
 		self.pc += 1
 	#
+	#		Parameter arriving in a register, which is read reads times. It is always stored.
+	#
+	def receiveParamRegister(self,regNumber,address,reads):
+		self.storeParamRegister(regNumber,address)
+	#
 	#		Create a string constant (done outside procedures)
 	#
 	def createStringConstant(self,string):
 		sAddr = self.pc
-		print("${0:06x}  db    \"{1}\",0".format(self.pc,string))
+		self.emit(self.pc,"db    \"{0}\",0".format(string))
 		self.pc += len(string)+1
 		return sAddr
 	#
 	#		Call a subroutine
 	#
 	def callSubroutine(self,address):
-		print("${0:06x}  jsr   ${1:06x}".format(self.pc,address))
+		self.emit(self.pc,"jsr   ${0:06x}".format(address))
+		self.pc += 1
+	#
+	#		Call a subroutine as the last thing done, so its return is ours.
+	#
+	def tailCallSubroutine(self,address):
+		self.emit(self.pc,"jmp   ${0:06x}".format(address))
 		self.pc += 1
 	#
 	#		Return from subroutine.
 	#
 	def returnSubroutine(self):
-		print("${0:06x}  rts".format(self.pc))
+		self.emit(self.pc,"rts")
 		self.pc += 1
+	#
+	#		End of a procedure.
+	#
+	def endProcedure(self):
+		pass
 
 if __name__ == "__main__":
-	cg = DemoCodeGenerator()
+	cg = DemoCodeGenerator(ConsoleListing())
 	cg.loadDirect(True,42)
 	cg.loadDirect(False,42)	
 	print("------------------")
@@ -9,11 +9,27 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+from errors import *
+
+# ***************************************************************************************
+#		An address which remembers the name of what it is the address of, so code
+#		using it can be relocated. The name is None for anonymous addresses.
+# ***************************************************************************************
+
+class Address(int):
+	def __new__(cls,value,name):
+		address = int.__new__(cls,value)
+		address.name = name
+		return address
+	def getName(self):
+		return self.name
+
 # ***************************************************************************************
 #						Identifiers to store in the dictionary
 # ***************************************************************************************
 
 class Identifier(object):
+	__slots__ = ("name","value")
 	def __init__(self,name,value):
 		self.name = name.strip().lower()
 		self.value = value
@@ -21,13 +37,16 @@ class Identifier(object):
 		return self.name
 	def getValue(self):
 		return self.value
+	def getAddress(self):
+		return Address(self.value,self.name)
 	def isGlobal(self):
 		return self.name.startswith("$")
 
 class VariableIdentifier(Identifier):
-	pass
+	__slots__ = ()
 
 class ProcedureIdentifier(Identifier):
+	__slots__ = ("paramCount",)
 	def __init__(self,name,value,paramCount):
 		Identifier.__init__(self,name,value)
 		self.paramCount = paramCount
@@ -35,6 +54,7 @@ class ProcedureIdentifier(Identifier):
 		return self.paramCount
 
 class ExternalProcedureIdentifier(ProcedureIdentifier):
+	__slots__ = ()
 	def isGlobal(self):
 		return True
 
@@ -44,50 +64,74 @@ class ExternalProcedureIdentifier(ProcedureIdentifier):
 
 class Dictionary(object):
 	def __init__(self):
-		self.identifiers = {}
+		self.globalScope = {} 													# global procedures, externals, $return
+		self.moduleScope = {} 													# global variables, local procedures
+		self.procedureScope = {} 												# local variables
+		self.externals = None 													# finds external words by name
+	#
+	#		Set the function finding external words, which are only added when used.
+	#
+	def setExternals(self,find):
+		self.externals = find
+	#
+	#		Get the scope an identifier belongs in.
+	#
+	def getScope(self,ident):
+		if isinstance(ident,ProcedureIdentifier):
+			return self.globalScope if ident.isGlobal() else self.moduleScope
+		if ident.getName() == "$return":
+			return self.globalScope
+		return self.moduleScope if ident.isGlobal() else self.procedureScope
 	#
 	#		Add an identifier to the dictionary, testing for collision.
 	#
 	def addIdentifier(self,ident):
 		name = ident.getName()
-		if name in self.identifiers:											# check doesn't already exist
+		if self.find(name) is not None:											# check doesn't already exist
 			raise AssemblerException("Duplicate identifier "+name)
-		self.identifiers[name] = ident											# update dictionary.
+		self.getScope(ident)[name] = ident										# update dictionary.
 	#
-	#		Find an identifier
+	#		Find an identifier, innermost scope first, then the external words.
 	#
 	def find(self,key):
 		key = key.strip().lower()
-		return None if key not in self.identifiers else self.identifiers[key]
+		if key in self.procedureScope:
+			return self.procedureScope[key]
+		if key in self.moduleScope:
+			return self.moduleScope[key]
+		if key in self.globalScope or self.externals is None:
+			return self.globalScope.get(key)
+		ident = self.externals(key)
+		if ident is not None:
+			self.globalScope[key] = ident
+		return ident
+	#
+	#		Get all identifiers
+	#
+	def getIdentifiers(self):
+		return list(self.globalScope.values())+list(self.moduleScope.values())+list(self.procedureScope.values())
+	#
+	#		Get the local variables, in the order they were added.
+	#
+	def getLocalVariables(self):
+		return list(self.procedureScope.values())
 	#
 	#		Remove local variables
 	#
 	def removeLocalVariables(self):
-		oldDictionary = self.identifiers										# remove all local variables.
-		self.identifiers = {}													# from the dictionary. 
-		for name in oldDictionary.keys():
-			if oldDictionary[name].isGlobal() or isinstance(oldDictionary[name],ProcedureIdentifier):
-				self.identifiers[name] = oldDictionary[name]
-
+		self.procedureScope = {}
 	#
 	#		Remove everything except global procedures and $return.
 	#
 	def endModule(self):
-		oldDictionary = self.identifiers 										# remove all that aren't $<name>(
-		self.identifiers = {}													# leave $return in also.
-		for name in oldDictionary.keys():
-			if oldDictionary[name].isGlobal() and isinstance(oldDictionary[name],ProcedureIdentifier):		# do we keep it ?
-				self.identifiers[name] = oldDictionary[name]
-		self.identifiers["$return"] = oldDictionary["$return"]
+		self.moduleScope = {}
+		self.procedureScope = {}
 	#
 	#		Get all boot procedures.
 	#
 	def getBootProcedures(self):
-		bootList = []
 		self.endModule()
-		for k in self.identifiers.keys():
-			if isinstance(self.identifiers[k],ProcedureIdentifier):
-				if self.identifiers[k].getName().endswith(".boot"):
-					bootList.append(self.identifiers[k].getValue())
+		bootList = [ident.getValue() for ident in self.globalScope.values() \
+								if isinstance(ident,ProcedureIdentifier) and ident.getName().endswith(".boot")]
 		bootList.sort()
 		return bootList
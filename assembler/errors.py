@@ -14,8 +14,9 @@
 # ***************************************************************************************
 
 class AssemblerException(Exception):
+	LINE = 0
 	def __init__(self,message):
-		Exception.__init__(self)
+		Exception.__init__(self,message)
 		self.message = message
 		print(message,AssemblerException.LINE)
 
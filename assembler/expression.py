@@ -0,0 +1,211 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		expression.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Expression representation and constant folding.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from errors import *
+from dictionary import *
+
+# ***************************************************************************************
+#		An expression is a list of steps, each a tuple
+#
+#			("load",term) 				load the accumulator with a term
+#			("op",operator,term) 		accumulator = accumulator <operator> term
+#			("store",term) 				store the accumulator in a term
+#
+#		Terms are (isConstant,value) or (isConstant,value,[!?],isConstant,value) as
+#		returned by Assembler.parseTerm. Evaluation is strictly left to right and all
+#		arithmetic is 16 bit unsigned.
+# ***************************************************************************************
+
+class Expression(object):
+	def __init__(self,terms):
+		self.steps = [ ("load",terms[0]) ]										# terms alternate with operators
+		for i in range(1,len(terms),2):
+			if terms[i] == ">":
+				self.steps.append(("store",terms[i+1]))
+			else:
+				self.steps.append(("op",terms[i],terms[i+1]))
+	#
+	#		Get the steps.
+	#
+	def getSteps(self):
+		return self.steps
+	#
+	#		Fold constants. While the accumulator is a known constant it is not loaded
+	#		until something needs it, and operations on it with constants are done now.
+	#		Operations which leave it unchanged are removed, and operations which make it
+	#		zero make it a known constant.
+	#
+	def simplify(self):
+		steps = []
+		constant = None 														# known accumulator value.
+		loaded = False 															# has it been loaded ?
+		for step in self.steps:
+			term = step[1] if step[0] != "op" else step[2]
+			isConstant = len(term) == 2 and term[0]
+			if step[0] == "load":
+				constant = term[1] if isConstant else None
+				loaded = not isConstant
+				if not isConstant:
+					steps.append(step)
+			elif step[0] == "store":
+				if constant is not None and not loaded:							# needs to be in the accumulator
+					steps.append(("load",(True,constant)))
+					loaded = True
+				steps.append(step)
+			elif isConstant and constant is not None and self.fold(step[1],constant,term[1]) is not None:
+				constant = self.fold(step[1],constant,term[1])					# constant op constant
+				loaded = False
+			elif isConstant and self.isIdentity(step[1],term[1]):				# does nothing
+				pass
+			elif isConstant and self.isZero(step[1],term[1]):					# makes it zero
+				while len(steps) > 0 and steps[-1][0] != "store":				# so what came before is unused
+					steps.pop()
+				constant = 0
+				loaded = False
+			else:
+				if constant is not None and not loaded:
+					steps.append(("load",(True,constant)))
+				steps.append(step)
+				constant = None
+				loaded = True
+		if constant is not None and not loaded:									# value is left in the accumulator
+			steps.append(("load",(True,constant)))
+		self.steps = steps
+		return self
+	#
+	#		Work out a op b, or None if it can't be done at compile time. Addresses
+	#		can have constants added or subtracted, keeping their relocation name.
+	#
+	def fold(self,operator,a,b):
+		if isinstance(a,Address) or isinstance(b,Address):
+			if isinstance(a,Address) and isinstance(b,Address):
+				return None
+			address = a if isinstance(a,Address) else b
+			if operator == "+":
+				return Address((a + b) & 0xFFFF,address.getName())
+			if operator == "-" and isinstance(a,Address):
+				return Address((a - b) & 0xFFFF,address.getName())
+			return None
+		a = a & 0xFFFF
+		b = b & 0xFFFF
+		if operator == "+":
+			return (a + b) & 0xFFFF
+		if operator == "-":
+			return (a - b) & 0xFFFF
+		if operator == "*":
+			return (a * b) & 0xFFFF
+		if operator == "&":
+			return a & b
+		if operator == "|":
+			return a | b
+		if operator == "^":
+			return a ^ b
+		if (operator == "/" or operator == "%") and b != 0:						# divide by zero is left as is.
+			return a // b if operator == "/" else a % b
+		return None
+	#
+	#		Check if operator n leaves the accumulator unchanged
+	#
+	def isIdentity(self,operator,n):
+		if isinstance(n,Address):
+			return False
+		n = n & 0xFFFF
+		return (n == 0 and operator in "+-|^") or (n == 1 and operator in "*/") or (n == 0xFFFF and operator == "&")
+	#
+	#		Check if operator n makes the accumulator zero
+	#
+	def isZero(self,operator,n):
+		if isinstance(n,Address):
+			return False
+		n = n & 0xFFFF
+		return (n == 0 and operator in "*&") or (n == 1 and operator == "%")
+
+# ***************************************************************************************
+#		A condition compares an expression (a list of terms) with a term, using one of
+#		< >= = #. < and >= are signed, so (expr<0) is the sign test it always has
+#		been whatever is on the right. Simplifying picks the cheapest test of the
+#		expression in the accumulator, which is
+#
+#			z nz p m 					tested on its own, zero or its sign bit
+#			< >= = # 					compared with the right hand term
+#
+#		or the result, if both sides are constants.
+# ***************************************************************************************
+
+class Condition(object):
+	INVERSE = { "z":"nz","nz":"z","p":"m","m":"p","<":">=",">=":"<","=":"#","#":"=" }
+	SINGLE = { ("=",0):"z",("#",0):"nz",("<",0):"m",(">=",0):"p" }
+	def __init__(self,left,operator,right):
+		self.steps = Expression(left).simplify().getSteps()
+		self.test = operator
+		self.right = right
+		self.result = None
+	#
+	#		Get the steps to put the expression in the accumulator, the test on it, the
+	#		term it is compared with (None if it is tested on its own), and the result
+	#		if it is known (None if it isn't). When the result is known the steps are
+	#		only there for their stores, and are empty if there are none.
+	#
+	def getSteps(self):
+		return self.steps
+	def getTest(self):
+		return self.test
+	def getRight(self):
+		return self.right
+	def getResult(self):
+		return self.result
+	#
+	#		Fold constants, put a constant on the right, and use the tests on the
+	#		expression alone where possible.
+	#
+	def simplify(self):
+		left = self.getConstant(self.steps[0][1]) if len(self.steps) == 1 and self.steps[0][0] == "load" else None
+		right = self.getConstant(self.right)
+		if left is not None and right is not None:								# both known
+			return self.setResult(self.compare(left,self.test,right))
+		if left is not None:													# swap sides
+			self.steps = [ ("load",self.right) ]
+			if self.test == "=" or self.test == "#":
+				self.right = (True,left)
+			elif left == 0x7FFF:												# c < v never, c >= v always
+				return self.setResult(self.test == ">=")
+			else:																# c < v is v >= c+1 and so on
+				self.test = ">=" if self.test == "<" else "<"
+				self.right = (True,(left+1) & 0xFFFF)
+			right = self.right[1]
+		if right == 0x8000 and (self.test == "<" or self.test == ">="):			# v < -32768 never
+			return self.setResult(self.test == ">=")
+		if (self.test,right) in Condition.SINGLE:
+			self.test = Condition.SINGLE[(self.test,right)]
+			self.right = None
+		return self
+	#
+	#		The result is known, so the expression is only needed if it stores something.
+	#
+	def setResult(self,result):
+		self.result = result
+		if not any([step[0] == "store" for step in self.steps]):
+			self.steps = []
+		return self
+	#
+	#		Get the value of a term if it is a constant which is known now.
+	#
+	def getConstant(self,term):
+		if len(term) != 2 or not term[0] or isinstance(term[1],Address):
+			return None
+		return term[1] & 0xFFFF
+	#
+	#		Work out a comparison of two constants.
+	#
+	def compare(self,a,operator,b):
+		if operator == "<" or operator == ">=":									# signed, so flip the
+			a,b = a ^ 0x8000,b ^ 0x8000											# sign bits to compare
+		return { "<":a < b,">=":a >= b,"=":a == b,"#":a != b }[operator]
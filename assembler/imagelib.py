@@ -1,137 +1,284 @@
-# ***************************************************************************************
-# ***************************************************************************************
-#
-#		Name : 		imagelib.py
-#		Author :	Paul Robson (paul@robsons.org.uk)
-#		Date : 		29th December 2018
-#		Purpose :	Binary Image Library
-#
-# ***************************************************************************************
-# ***************************************************************************************
-
-class BootImage(object):
-	def __init__(self,fileName = "boot.img"):
-		self.fileName = fileName
-		h = open(fileName,"rb")
-		self.image = [x for x in h.read(-1)]
-		h.close()
-		self.sysInfo = self.read(0,0x8004)+self.read(0,0x8005)*256
-		self.currentPage = 	self.read(0,self.sysInfo+2)
-		self.currentAddress = self.read(0,self.sysInfo+0)+self.read(0,self.sysInfo+1)*256
-		self.echo = True
-		self.loadDictionary(self.read(0,0x8008)+self.read(0,0x8009)*256)
-	#
-	#		Return sys.info address
-	#
-	def getSysInfo(self):
-		return self.sysInfo 
-	#
-	#		Return current page and address for next free code.
-	#
-	def getCodePage(self):
-		return self.currentPage
-	def getCodeAddress(self):
-		return self.currentAddress
-	#
-	#		Convert a page/z80 address to an address in the image
-	#
-	def address(self,page,address):
-		assert address >= 0x8000 and address <= 0xFFFF
-		if address < 0xC000:
-			return address & 0x3FFF
-		else:
-			return (page - 0x20) * 0x2000 + 0x4000 + (address & 0x3FFF)
-	#
-	#		Read byte from image
-	#
-	def read(self,page,address):
-		self.expandImage(page,address)
-		return self.image[self.address(page,address)]
-	#
-	#		Write byte to image
-	#
-	def write(self,page,address,data,dataType = 2):
-		self.expandImage(page,address)
-		assert data >= 0 and data < 256
-		self.image[self.address(page,address)] = data
-		if page >= self.read(0x20,self.sysInfo+4):
-			self.write(0x20,self.sysInfo+4,page+2)
-	#
-	#		Compile byte
-	#
-	def cByte(self,data):
-		if self.echo:
-			print("{0:02x}:{1:04x}  {2:02x}".format(self.currentPage,self.currentAddress,data))
-		self.write(self.currentPage,self.currentAddress,data)
-		self.currentAddress += 1
-	#
-	#		Compile word
-	#
-	def cWord(self,data):
-		if self.echo:
-			print("{0:02x}:{1:04x}  {2:04x}".format(self.currentPage,self.currentAddress,data))
-		self.write(self.currentPage,self.currentAddress,data & 0xFF)
-		self.write(self.currentPage,self.currentAddress+1,data >> 8)
-		self.currentAddress += 2
-	#
-	#		Expand physical size of image to include given address
-	#
-	def expandImage(self,page,address):
-		required = self.address(page,address)
-		while len(self.image) <= required:
-			self.image.append(0x00)
-	#
-	#		Set boot address
-	#
-	def setBootAddress(self,page,address):
-		self.write(0,self.getSysInfo()+12,address & 0xFF)
-		self.write(0,self.getSysInfo()+13,address >> 8)
-		self.write(0,self.getSysInfo()+14,page)
-	#
-	#		Allocate page of memory to a specific purpose.
-	#
-	def findFreePage(self):
-		page = self.read(0,self.getSysInfo()+4)
-		self.write(0,self.getSysInfo()+4,page+2)
-		self.write(page,0xFFFF,0x00)
-		return page	
-	#
-	#		Load the dictionary in the image
-	#
-	def loadDictionary(self,start):
-		self.dictionary = {}
-		while self.read(0,start) != 0 or self.read(0,start+1) != 0:
-			name = ""
-			p = start+2
-			while self.read(0,p) >= 32:
-				name = name + chr(self.read(0,p))
-				p = p + 1
-			record = { "name":name,"address":p+1,"parameters":self.read(0,p) }
-			assert name not in self.dictionary
-			self.dictionary[name] = record
-			start = start + self.read(0,start+0)+self.read(0,start+1)*256
-		#print(self.dictionary)			
-	#
-	#		Access the dictionary
-	#
-	def getDictionary(self):
-		return self.dictionary
-	#
-	#		Write the image file out.
-	#
-	def save(self,fileName = None):
-		self.write(0,self.sysInfo+0,self.currentAddress & 0xFF)
-		self.write(0,self.sysInfo+1,self.currentAddress >> 8)
-		self.write(0,self.sysInfo+2,self.currentPage)
-
-		fileName = self.fileName if fileName is None else fileName
-		h = open(fileName,"wb")
-		h.write(bytes(self.image))		
-		h.close()
-
-if __name__ == "__main__":
-	z = BootImage("standard.lib")
-	print(z.findFreePage())
-	print(len(z.image))
-	print(z.find("sys.modulus"))
-	z.save("boot.img")
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		imagelib.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		29th December 2018
+#		Purpose :	Binary Image Library
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import hashlib,json,os
+from compressor import *
+
+# ***************************************************************************************
+#		The library dictionary is only read when first wanted. It is indexed in one
+#		pass over the image, and the index kept in a file next to the image, which is
+#		used instead if it was made from the same image.
+# ***************************************************************************************
+
+class BootImage(object):
+	PAGESIZE = 0x4000 															# image grows a 16k page at a time
+	def __init__(self,fileName = "boot.img"):
+		self.fileName = fileName
+		h = open(fileName,"rb")
+		self.image = bytearray(h.read(-1))
+		h.close()
+		self.hash = hashlib.sha1(self.image).hexdigest() 						# identifies the library
+		self.length = len(self.image) 											# bytes in use, the rest is spare
+		self.sysInfo = self.read(0,0x8004)+self.read(0,0x8005)*256
+		self.freePageOffset = self.address(0,self.sysInfo+4)
+		self.nextFreePage = self.read(0,self.sysInfo+4)
+		self.currentPage = 	self.read(0,self.sysInfo+2)
+		self.currentAddress = self.read(0,self.sysInfo+0)+self.read(0,self.sysInfo+1)*256
+		self.dictionary = None 													# loaded when needed.
+	#
+	#		Return sys.info address
+	#
+	def getSysInfo(self):
+		return self.sysInfo 
+	#
+	#		Return current page and address for next free code.
+	#
+	def getCodePage(self):
+		return self.currentPage
+	def getCodeAddress(self):
+		return self.currentAddress
+	#
+	#		Convert a page/z80 address to an address in the image
+	#
+	def address(self,page,address):
+		assert address >= 0x8000 and address <= 0xFFFF
+		if address < 0xC000:
+			return address & 0x3FFF
+		else:
+			return (page - 0x20) * 0x2000 + 0x4000 + (address & 0x3FFF)
+	#
+	#		Read byte from image
+	#
+	def read(self,page,address):
+		offset = self.address(page,address)
+		self.expandImage(offset+1)
+		return self.image[offset]
+	#
+	#		Write byte to image
+	#
+	def write(self,page,address,data,dataType = 2):
+		assert data >= 0 and data < 256
+		offset = self.address(page,address)
+		self.expandImage(offset+1)
+		self.image[offset] = data
+		if offset == self.freePageOffset:										# written the next free page
+			self.nextFreePage = data
+		self.usePage(page)
+	#
+	#		Write a block of bytes to the image, a slice for each 16k it is in.
+	#
+	def writeBlock(self,page,address,data):
+		while len(data) > 0:
+			size = min(len(data),0x4000 - (address & 0x3FFF))
+			offset = self.address(page,address)
+			self.expandImage(offset+size)
+			self.image[offset:offset+size] = bytes(data[:size])
+			if offset <= self.freePageOffset and offset+size > self.freePageOffset:
+				self.nextFreePage = self.image[self.freePageOffset]
+			self.usePage(page)
+			data = data[size:]
+			address += size
+	#
+	#		Note a page is in use, updating the next free page if required.
+	#
+	def usePage(self,page):
+		if page >= self.nextFreePage:
+			self.nextFreePage = page+2
+			self.image[self.freePageOffset] = self.nextFreePage
+	#
+	#		Compile byte
+	#
+	def cByte(self,data):
+		self.write(self.currentPage,self.currentAddress,data)
+		self.currentAddress += 1
+	#
+	#		Compile word
+	#
+	def cWord(self,data):
+		self.writeBlock(self.currentPage,self.currentAddress,[data & 0xFF,data >> 8])
+		self.currentAddress += 2
+	#
+	#		Compile several bytes
+	#
+	def cBytes(self,data):
+		self.writeBlock(self.currentPage,self.currentAddress,data)
+		self.currentAddress += len(data)
+	#
+	#		Make sure the image holds the first size bytes, growing it a page at a time.
+	#
+	def expandImage(self,size):
+		if size > self.length:
+			if size > len(self.image):
+				pages = (size - len(self.image) + BootImage.PAGESIZE - 1) // BootImage.PAGESIZE
+				self.image.extend(bytes(pages * BootImage.PAGESIZE))
+			self.length = size
+	#
+	#		Get the bytes in use, without copying them.
+	#
+	def getBytes(self):
+		return memoryview(self.image)[:self.length]
+	#
+	#		Set boot address
+	#
+	def setBootAddress(self,page,address):
+		self.write(0,self.getSysInfo()+12,address & 0xFF)
+		self.write(0,self.getSysInfo()+13,address >> 8)
+		self.write(0,self.getSysInfo()+14,page)
+	#
+	#		Allocate page of memory to a specific purpose.
+	#
+	def findFreePage(self):
+		page = self.read(0,self.getSysInfo()+4)
+		self.write(0,self.getSysInfo()+4,page+2)
+		self.write(page,0xFFFF,0x00)
+		return page	
+	#
+	#		Load the dictionary, from the index file if it is for this image.
+	#
+	def loadDictionary(self):
+		indexFile = self.fileName+".index"
+		if os.path.exists(indexFile):
+			with open(indexFile) as h:
+				index = json.load(h)
+			if index.get("hash") == self.hash:
+				self.dictionary = {}
+				for name,address,parameters in index["words"]:
+					self.dictionary[name] = { "name":name,"address":address,"parameters":parameters }
+				return
+		self.dictionary = self.indexDictionary(self.read(0,0x8008)+self.read(0,0x8009)*256)
+		words = [[r["name"],r["address"],r["parameters"]] for r in self.dictionary.values()]
+		try:
+			with open(indexFile+".tmp","w") as h:									# index may not be writeable
+				json.dump({ "hash":self.hash,"words":words },h)
+			os.replace(indexFile+".tmp",indexFile)
+		except OSError:
+			pass
+	#
+	#		Index the dictionary in the image, a linked list in $8000-$BFFF starting at
+	#		start. Each entry is offset to next (0 ends), name, parameter count, code.
+	#
+	def indexDictionary(self,start):
+		dictionary = {}
+		image = memoryview(self.image)[:self.length]
+		p = start & 0x3FFF
+		while image[p] != 0 or image[p+1] != 0:
+			n = p + 2
+			while image[n] >= 32:
+				n += 1
+			name = image[p+2:n].tobytes().decode()
+			assert name not in dictionary
+			dictionary[name] = { "name":name,"address":(n+1) | 0x8000,"parameters":image[n] }
+			p += image[p] + image[p+1] * 256
+		image.release()
+		return dictionary
+	#
+	#		Find a word, returns its dictionary record or None. This uses the kernel's
+	#		word table, a perfect hash of the names, if it has one.
+	#
+	def findWord(self,name):
+		table = self.read(0,self.sysInfo+16)+self.read(0,self.sysInfo+17)*256
+		if table == 0 or self.dictionary is not None:							# no table, or already loaded
+			return self.getDictionary().get(name)
+		seed = self.read(0,table)
+		slot = table + 2 + (self.hashWord(seed,name) & self.read(0,table+1)) * 2
+		p = self.read(0,slot)+self.read(0,slot+1)*256							# link record
+		if p == 0:
+			return None
+		p += 2
+		for c in name:
+			if self.read(0,p) != ord(c):
+				return None
+			p += 1
+		if self.read(0,p) >= 32:
+			return None
+		return { "name":name,"address":p+1,"parameters":self.read(0,p) }
+	#
+	#		Hash of a word name, the same as makekernel.py and KernelFindWord
+	#
+	def hashWord(self,seed,name):
+		hash = seed
+		for c in name:
+			hash = (((hash << 3) | (hash >> 5)) + (ord(c) ^ seed)) & 0xFF 		# rotate left 3, add char xor seed
+		return hash
+	#
+	#		Access the dictionary
+	#
+	def getDictionary(self):
+		if self.dictionary is None:
+			self.loadDictionary()
+		return self.dictionary
+	#
+	#		Write the image file out.
+	#
+	def save(self,fileName = None):
+		self.updateSysInfo()
+		fileName = self.fileName if fileName is None else fileName
+		h = open(fileName,"wb")
+		h.write(self.getBytes())
+		h.close()
+	#
+	#		Write the next free code address into sys.info, and the page the code pages
+	#		in the image end at, so the boot loader only reads those.
+	#
+	def updateSysInfo(self):
+		self.write(0,self.sysInfo+0,self.currentAddress & 0xFF)
+		self.write(0,self.sysInfo+1,self.currentAddress >> 8)
+		self.write(0,self.sysInfo+2,self.currentPage)
+		codePages = max(0,(self.length - 0x4000 + BootImage.PAGESIZE - 1) // BootImage.PAGESIZE)
+		self.write(0,self.sysInfo+6,0x20 + codePages * 2)
+	#
+	#		Write the image out compressed, a 16k block at a time, for the boot loader to
+	#		read as boot.imz
+	#
+	def saveCompressed(self,fileName):
+		h = open(fileName,"wb")
+		self.writeCompressed(h)
+		h.close()
+	def writeCompressed(self,h):
+		self.updateSysInfo()
+		data = self.getBytes()
+		compressor = BlockCompressor()
+		for start in range(0,len(data),0x4000):
+			compressor.writeBlock(h,data[start:start+0x4000])
+		compressor.writeEnd(h)
+	#
+	#		Write the image out as a ZX Next .nex file, which runs without the boot
+	#		loader. $8000-$BFFF is 16k bank 2, and each 16k of code pages from $20 is a
+	#		bank from $10. It starts at $8000, with the start page from sys.info +14 in
+	#		$C000-$FFFF, and the kernel then runs the start address.
+	#
+	def saveNex(self,fileName):
+		self.updateSysInfo()
+		data = self.getBytes()
+		banks = [2] + [0x10 + n for n in range(0,(len(data) - 1) // 0x4000)]	# bank 2, then code banks
+		header = bytearray(512)
+		header[0:8] = "NextV1.2".encode()
+		header[8] = 1 if banks[-1] >= 48 else 0 								# 2MB needed ?
+		header[9] = len(banks)
+		header[12:14] = [0xFE,0x5F] 											# SP $5FFE, as the kernel
+		header[14:16] = [0x00,0x80] 											# PC $8000
+		for b in banks:
+			header[18+b] = 1
+		header[139] = self.read(0,self.sysInfo+14) // 2 						# start page in $C000
+		h = open(fileName,"wb")
+		h.write(header)
+		for n in range(0,len(banks)): 											# banks in 2,16,17 ... order
+			block = data[n*0x4000:(n+1)*0x4000]
+			h.write(block)
+			h.write(bytes(0x4000-len(block)))
+		h.close()
+
+if __name__ == "__main__":
+	z = BootImage("standard.lib")
+	print(z.findFreePage())
+	print(z.length)
+	print(z.getDictionary()["sys.modulus"])
+	z.save("boot.img")
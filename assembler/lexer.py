@@ -0,0 +1,89 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		lexer.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Single pass tokeniser for the Next High Level Assembler.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import re
+from errors import *
+
+# ***************************************************************************************
+#							A single token, with its source position
+# ***************************************************************************************
+
+class Token(object):
+	def __init__(self,type,value,line,column):
+		self.type = type 														# identifier,number,string,punctuation,separator
+		self.value = value 														# text, or integer for numbers
+		self.line = line 														# position in source (1 based)
+		self.column = column
+	def getType(self):
+		return self.type
+	def getValue(self):
+		return self.value
+	def getText(self):
+		return str(self.value) if self.type != "string" else '"'+self.value+'"'
+	def getLine(self):
+		return self.line
+	def getColumn(self):
+		return self.column
+	def isPunctuation(self,text):
+		return self.type == "punctuation" and self.value == text
+	def __repr__(self):
+		return "{0}:{1}:{2}".format(self.line,self.column,self.getText())
+
+# ***************************************************************************************
+#												Lexer
+# ***************************************************************************************
+
+class Lexer(object):
+	def __init__(self):
+		self.rxToken = re.compile("\s*(?:(//.*)|(\"[^\"]*\"?)|0x([0-9a-f]+)|(\d+)|([\$\_a-z][a-z0-9\.\_]*)|(\S))",re.IGNORECASE)
+	#
+	#		Convert a list of source lines to a list of tokens. Statements are ended by
+	#		a separator token, which is either a colon or the end of a line.
+	#
+	def tokenise(self,source):
+		tokens = []
+		for lineNumber in range(0,len(source)):									# scan each line once.
+			line = source[lineNumber].rstrip()
+			pos = 0
+			while pos < len(line):
+				m = self.rxToken.match(line,pos)
+				pos = m.end()
+				if m.group(1) is not None:										# comment, rest of line ignored
+					break
+				tokens.append(self.createToken(m,lineNumber+1,m.start(m.lastindex)+1))
+			if len(tokens) > 0 and tokens[-1].getType() != "separator":			# end of line ends a statement
+				tokens.append(Token("separator",":",lineNumber+1,len(line)+1))
+		return tokens
+	#
+	#		Create a token from a match
+	#
+	def createToken(self,m,line,column):
+		if m.group(2) is not None:												# quoted string
+			if len(m.group(2)) < 2 or not m.group(2).endswith('"'):
+				AssemblerException.LINE = line
+				raise AssemblerException("Bad quoted string")
+			return Token("string",m.group(2)[1:-1],line,column)
+		if m.group(3) is not None:												# hexadecimal constant
+			return Token("number",int(m.group(3),16),line,column)
+		if m.group(4) is not None:												# decimal constant
+			return Token("number",int(m.group(4)),line,column)
+		if m.group(5) is not None:												# identifier or keyword
+			return Token("identifier",m.group(5).lower(),line,column)
+		if m.group(6) == ":":													# statement separator
+			return Token("separator",":",line,column)
+		return Token("punctuation",m.group(6),line,column)
+
+if __name__ == "__main__":
+	src = """
+	proc $demo.boot(a,b) // comment
+	0x7FFE>a:"Hello, world":@$return+1>b!4
+	""".split("\n")
+	print(Lexer().tokenise(src))
@@ -0,0 +1,133 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		linker.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Links object modules into a boot image. Modules can be assembled
+#					in parallel.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import multiprocessing
+from errors import *
+from imagelib import *
+from z80codegen import *
+from objectmodule import *
+from cache import *
+
+# ***************************************************************************************
+#										Linker class
+# ***************************************************************************************
+
+class Linker(object):
+	def __init__(self,image):
+		self.image = image
+		self.codeGen = Z80CodeGenerator(image)
+		self.libraryWords = set() 												# library words referred to
+	#
+	#		Link a list of modules into the image, returns the main address
+	#
+	def link(self,modules):
+		self.globals = {} 														# allocate globals once each
+		for m in modules:
+			for name in m.getGlobals():
+				if name not in self.globals:
+					self.globals[name] = self.codeGen.allocSpace(None,name)
+		self.procedures = {} 													# lay out modules.
+		bases = []
+		address = self.codeGen.getAddress()
+		for m in modules:
+			bases.append(address)
+			for name in m.getSymbols().keys():
+				if name in self.procedures or self.image.findWord(name) is not None:
+					raise AssemblerException("Duplicate procedure "+name+" in "+m.getName())
+				symbol = m.getSymbols()[name]
+				self.procedures[name] = { "address":address+symbol["offset"],"parameters":symbol["parameters"] }
+			address += len(m.getCode())
+		for i in range(0,len(modules)):											# relocate and copy in.
+			self.checkImports(modules[i])
+			self.codeGen.copyCode(self.relocate(modules[i],bases[i]))
+		return self.createMain()
+	#
+	#		Check procedures imported exist with the same number of parameters
+	#
+	def checkImports(self,module):
+		imports = module.getImports()
+		for name in imports.keys():
+			if name not in self.procedures:
+				raise AssemblerException("Unknown procedure "+name+" in "+module.getName())
+			if self.procedures[name]["parameters"] != imports[name]:
+				raise AssemblerException("Wrong number of parameters for "+name+" in "+module.getName())
+	#
+	#		Relocate a module's code to a base address
+	#
+	def relocate(self,module,base):
+		code = list(module.getCode())
+		for offset,name,addend in module.getRelocations():
+			if name is None:
+				value = base
+			elif name in self.globals:
+				value = self.globals[name]
+			elif name in self.procedures:
+				value = self.procedures[name]["address"]
+			elif self.image.findWord(name) is not None:
+				value = self.image.findWord(name)["address"]
+				self.libraryWords.add(name)
+			else:
+				raise AssemblerException("Unresolved reference to "+name+" in "+module.getName())
+			value = (value + addend) & 0xFFFF
+			code[offset] = value & 0xFF
+			code[offset+1] = value >> 8
+		return code
+	#
+	#		Get the library words the modules refer to.
+	#
+	def getLibraryWords(self):
+		return sorted(self.libraryWords)
+	#
+	#		Create the main procedure, calling all the .boot procedures, and make it
+	#		the boot address.
+	#
+	def createMain(self):
+		main = self.codeGen.getAddress()
+		booters = [self.procedures[p]["address"] for p in self.procedures.keys() if p.endswith(".boot")]
+		for boot in sorted(booters):											# compile a call to each
+			self.codeGen.callSubroutine(boot)
+		self.codeGen.jumpInstruction("",self.codeGen.getAddress())				# ending in an infinite loop.
+		self.codeGen.endProcedure()
+		self.image.setBootAddress(self.image.getCodePage(),main)
+		return main
+
+# ***************************************************************************************
+#			Assemble source files into object modules, in parallel processes
+# ***************************************************************************************
+
+def assembleModule(job):
+	fileName,libraryFile,cacheDirectory = job
+	library = BootImage(libraryFile).getDictionary()
+	cache = ProcedureCache(cacheDirectory) if cacheDirectory is not None else None
+	assembler = ModuleAssembler(library,cache)
+	with open(fileName) as h:
+		assembler.assemble(h.readlines())
+	return assembler.createObject(fileName)
+
+def assembleModules(fileNames,libraryFile,processes = None,cacheDirectory = None):
+	jobs = [(f,libraryFile,cacheDirectory) for f in fileNames]
+	if processes == 1 or len(jobs) < 2:											# not worth starting processes
+		return [assembleModule(j) for j in jobs]
+	with multiprocessing.Pool(processes) as pool:
+		return pool.map(assembleModule,jobs)
+
+if __name__ == "__main__":
+	import sys
+	image = BootImage("../libraries/standard.lib")
+	modules = assembleModules(sys.argv[1:],"../libraries/standard.lib")
+	linker = Linker(image)
+	print("Main at {0:04x}".format(linker.link(modules)))
+	image.save("boot.img")
+	image.saveNex("boot.nex")
+	image.saveCompressed("boot.imz")
+	with open("boot.words","w") as h:											# for makekernel.py -w
+		h.write("".join([w+"\n" for w in linker.getLibraryWords()]))
@@ -0,0 +1,77 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		listing.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Listing sinks, which are sent source lines and generated code.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#		A listing sink is sent source lines as they are assembled, and code as it is
+#		generated, as page, address, bytes and optional text (for code generators that
+#		produce text rather than bytes). Producers check enabled before building
+#		anything to send, so the null sink costs nothing.
+# ***************************************************************************************
+
+class NullListing(object):
+	enabled = False
+	def source(self,lineNumber,text):
+		pass
+	def code(self,page,address,data,text = None):
+		pass
+	def close(self):
+		pass
+
+# ***************************************************************************************
+#								Listing in .lst format
+# ***************************************************************************************
+
+class Listing(NullListing):
+	enabled = True
+	BYTESPERLINE = 8
+	def __init__(self):
+		self.lines = []
+	#
+	#		Source line
+	#
+	def source(self,lineNumber,text):
+		self.lines.append("{0:<32}; {1:5} {2}".format("",lineNumber,text))
+	#
+	#		Generated code, with up to 8 bytes per line.
+	#
+	def code(self,page,address,data,text = None):
+		if text is not None and len(data) == 0:
+			self.lines.append("{0:02x}:{1:04x}  {2:<24}{3}".format(page,address,"",text))
+		for i in range(0,len(data),Listing.BYTESPERLINE):
+			block = " ".join(["{0:02x}".format(b) for b in data[i:i+Listing.BYTESPERLINE]])
+			self.lines.append("{0:02x}:{1:04x}  {2:<24}{3}".format(page,address+i,block,text if text is not None and i == 0 else ""))
+		self.write()
+	#
+	#		Write out any lines, done in bulk.
+	#
+	def write(self):
+		pass
+	def close(self):
+		self.write()
+
+class ConsoleListing(Listing):
+	def write(self):
+		if len(self.lines) > 0:
+			print("\n".join([l.rstrip() for l in self.lines]))
+			self.lines = []
+
+class FileListing(Listing):
+	BUFFERLINES = 1024
+	def __init__(self,fileName):
+		Listing.__init__(self)
+		self.handle = open(fileName,"w")
+	def write(self,force = False):
+		if len(self.lines) >= FileListing.BUFFERLINES or (force and len(self.lines) > 0):
+			self.handle.write("\n".join([l.rstrip() for l in self.lines])+"\n")
+			self.lines = []
+	def close(self):
+		self.write(True)
+		self.handle.close()
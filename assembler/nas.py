@@ -1,5 +1,6 @@
 from democodegen import *
 from nexthla import *
+from listing import *
 
 source = """
 proc $demo.boot():endproc
@@ -25,8 +26,8 @@ proc $test3.boot(a,b)
 	@$return > a
 endproc
 """.split("\n")
-asm = Assembler(DemoCodeGenerator())
+asm = Assembler(DemoCodeGenerator(ConsoleListing()))
 asm.assemble(source)
 #print(asm.dictionary.getBootProcedures())
 print("Main at {0:06x}".format(asm.createMain()))
-print(asm.dictionary.identifiers)
\ No newline at end of file
+print(asm.dictionary.getIdentifiers())
\ No newline at end of file
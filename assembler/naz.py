@@ -1,6 +1,7 @@
 from imagelib import *
 from z80codegen import *
 from nexthla import *
+from listing import *
 
 source = """
 proc $demo.boot():endproc
@@ -27,9 +28,8 @@ proc $demo.boot():endproc
 //endproc
 """.split("\n")
 img = BootImage("../libraries/standard.lib")
-img.echo = True
-asm = Assembler(Z80CodeGenerator(img))
+asm = Assembler(Z80CodeGenerator(img,ConsoleListing()))
 asm.assemble(source)
 #print(asm.dictionary.getBootProcedures())
 print("Main at {0:06x}".format(asm.createMain()))
-print(asm.dictionary.identifiers)
+print(asm.dictionary.getIdentifiers())
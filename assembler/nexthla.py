@@ -10,130 +10,406 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
-import re
 from errors import *
 from dictionary import *
+from lexer import *
+from expression import *
+from overlay import *
 
 # ***************************************************************************************
 #									Main Assembler class
 # ***************************************************************************************
 
 class Assembler(object):
-	def __init__(self,codeGenerator):
+	def __init__(self,codeGenerator,cache = None):
 		self.codeGen = codeGenerator 											# save the code generator
+		self.listing = codeGenerator.getListing() 								# where source lines are listed.
+		self.cache = cache 														# procedure cache, if any
 		self.dictionary = Dictionary() 											# dictionary, ident to address mapping.
+		self.procedures = [] 													# every procedure assembled.
+		self.tailCalls = 0 														# calls made into jumps.
+		self.dropped = [] 														# procedures never called.
+		self.bytesSaved = 0 													# and the space they would use.
+		self.overlay = None 													# shares locals, whole programs only
+		self.procedureKey = None 												# procedure being assembled
+		self.isTailCall = False
 		self.codeGen.loadExternals(self.dictionary)								# add any external words.
-		result = self.codeGen.allocSpace(None,"$return")						# $return global
-		self.dictionary.addIdentifier(VariableIdentifier("$return",result))
-		self.keywords = "if,endif,while,endwhile,for,endfor,endproc".split(",")
-		self.rxIdentifier = "[\$\_a-z][a-z0-9\.\_]*"							# rx matching identifier
+		self.findVariable("$return")											# $return global
+		self.keywords = "if,endif,while,endwhile,for,endfor,endproc,proc".split(",")
+		self.operators = "+-*/%&|^>"											# binary operators and store
+		self.lexer = Lexer()
 	#
-	#		Assemble a list of strings.
+	#		Assemble a list of strings. Global procedures may be called from other modules
+	#		so are always kept.
 	#
 	def assemble(self,source):
-		#
-		#		Source pre process, also removes quoted strings
-		#
-		source = [x if x.find("//") < 0 else x[:x.find("//")] for x in source]	# remove comments
-		source = [x.replace("\t"," ").strip() for x in source]					# remove tabs, indent, trailing space
-		source = self.processQuotedString(source)								# remove quoted strings.
-		#
-		#		Join together as one long string, fix hexadecimals
-		#
-		source = (":~:").join(source)											# one long string
-		source = source.replace(" ","").lower() 								# make it all lowercase and no spaces.
-		source = self.processHexConstants(source)								# convert hex constants
-		source = self.processIdentifiers(source,True)							# convert all globals.
-		#
-		#		Subdivide into procedures.
-		#
-		source = re.split("(proc"+self.rxIdentifier+"\(.*?\))",source)			# split up by procedures.	
-		assert not source[0].startswith("proc") and len(source) % 2 != 0		# should be preamble and odd # parts
-		AssemblerException.LINE = source[0].count("~")							# start line.
-		for i in range(1,len(source),2):										# for each pair.
-			self.processProcedure(source[i],source[i+1])						# process the header.
-		self.dictionary.endModule()												# only leave global procs.
+		self.assembleModules([source],False)
+	#
+	#		Assemble a list of modules, each a list of strings, which are the whole
+	#		program, so only procedures reachable from the .boot ones are kept, and
+	#		procedures which can't be running at the same time share local storage.
+	#
+	def assembleProgram(self,sources):
+		self.assembleModules(sources,True)
+	#
+	#		Assemble modules, leaving out procedures which can't be reached. These are
+	#		not assembled at all, the space they would have used is estimated.
+	#
+	def assembleModules(self,sources,wholeProgram):
+		modules = []
+		for source in sources:
+			tokens = self.lexer.tokenise(source)								# convert to tokens in one pass
+			modules.append((tokens,self.splitProcedures(tokens)))
+		calls,addressTaken = self.createCallGraph([m[1] for m in modules])
+		reachable = self.findReachable([m[1] for m in modules],calls,addressTaken,wholeProgram)
+		self.overlay = OverlayAllocator(calls,addressTaken) if wholeProgram else None
+		self.procedureNames = {}
+		for m in range(0,len(modules)):
+			tokens,procedures = modules[m]
+			self.allocateGlobals(tokens)										# allocate all globals.
+			for n in range(0,len(procedures)):									# for each procedure
+				header,body = procedures[n]
+				if (m,n) in reachable:
+					self.procedureKey = (m,n)
+					self.procedureNames[(m,n)] = self.getProcedureName(header)
+					self.processProcedure(header,body)							# assemble it.
+				else:
+					self.dropped.append(header[1].getValue() if len(header) > 1 else "")
+					self.bytesSaved += self.estimateSize(header,body)
+			self.procedureKey = None
+			self.dictionary.endModule()											# only leave global procs.
+	#
+	#		Create the call graph of procedures in modules, each (module,number). Returns
+	#		procedure => procedures it refers to, and the procedures whose address is
+	#		used rather than being called.
+	#
+	def createCallGraph(self,modules):
+		defined = {} 															# global name or (module,name)
+		for m in range(0,len(modules)):
+			for n in range(0,len(modules[m])):
+				name = self.getProcedureName(modules[m][n][0])
+				defined[name if name.startswith("$") else (m,name)] = (m,n)
+		calls = {}
+		addressTaken = set()
+		for m in range(0,len(modules)):
+			for n in range(0,len(modules[m])):
+				calls[(m,n)] = []
+				for statement in modules[m][n][1]:
+					for i in range(0,len(statement)):
+						if statement[i].getType() == "identifier":
+							name = statement[i].getValue().lower()
+							procedure = defined.get((m,name),defined.get(name))
+							if procedure is not None:
+								calls[(m,n)].append(procedure)
+								if i+1 == len(statement) or not statement[i+1].isPunctuation("("):
+									addressTaken.add(procedure)
+		return calls,addressTaken
+	#
+	#		Find the procedures reachable from the roots, returns a set of (module,number)
+	#		Roots are .boot procedures, procedures whose address is used rather than
+	#		being called and, if this isn't the whole program, global procedures.
+	#
+	def findReachable(self,modules,calls,addressTaken,wholeProgram):
+		roots = list(addressTaken)
+		for m,n in calls.keys():
+			name = self.getProcedureName(modules[m][n][0])
+			if name.endswith(".boot") or (name.startswith("$") and not wholeProgram):
+				roots.append((m,n))
+		reachable = set()
+		while len(roots) > 0:
+			procedure = roots.pop()
+			if procedure not in reachable:
+				reachable.add(procedure)
+				roots += calls[procedure]
+		return reachable
+	#
+	#		Get a procedure's name from its header, checked when it is assembled.
+	#
+	def getProcedureName(self,header):
+		return header[1].getValue().lower() if len(header) > 1 and header[1].getType() == "identifier" else ""
+	#
+	#		Estimate the size of a procedure from its source. Strings and locals are
+	#		exact, code is taken as three bytes for each operand and structure word,
+	#		roughly a load, store, call or jump, and a return.
+	#
+	def estimateSize(self,header,body):
+		size = 1
+		localVariables = set()
+		for statement in [header[2:]]+body:
+			for i in range(0,len(statement)):
+				t = statement[i]
+				if t.getType() == "string":
+					size += len(t.getValue()) + 1
+				if self.isVariable(statement,i) and not t.getValue().startswith("$"):
+					localVariables.add(t.getValue().lower())
+				if t.getType() != "punctuation":
+					size += 3
+		return size + len(localVariables) * self.codeGen.getWordSize()
+	#
+	#		Get the names of procedures left out, and an estimate of the bytes saved.
+	#
+	def getDroppedProcedures(self):
+		return self.dropped
+	def getBytesSaved(self):
+		return self.bytesSaved
 	#
-	#		Process procedure header (e.g. proc<identifier>(<params>)
-	#		then assemble the body.
+	#		Get the bytes saved by sharing local storage, and the procedures which
+	#		could not share theirs.
+	#
+	def getLocalBytesSaved(self):
+		return 0 if self.overlay is None else self.overlay.getBytesSaved(self.codeGen.getWordSize())
+	def getDistinctProcedures(self):
+		if self.overlay is None:
+			return []
+		return sorted([self.procedureNames[p] for p in self.overlay.getDistinctProcedures() if p in self.procedureNames])
+	#
+	#		Allocate space for all globals not already known.
+	#
+	def allocateGlobals(self,tokens):
+		for i in range(0,len(tokens)):
+			if self.isVariable(tokens,i) and tokens[i].getValue().startswith("$"):
+				self.findVariable(tokens[i].getValue())
+	#
+	#		Split token stream into statements, then group those into procedures, each
+	#		being a header statement and a list of body statements.
+	#
+	def splitProcedures(self,tokens):
+		procedures = []
+		statement = []
+		for t in tokens:
+			if t.getType() != "separator":										# build up a statement
+				statement.append(t)
+			elif len(statement) > 0:											# statement complete
+				if statement[0].getValue() == "proc":							# new procedure ?
+					procedures.append([statement,[]])
+				elif len(procedures) == 0:										# code outside procedure.
+					AssemblerException.LINE = statement[0].getLine()
+					raise AssemblerException("Code outside procedure")
+				else:
+					procedures[-1][1].append(statement)							# add to current procedure.
+				statement = []
+		return procedures
+	#
+	#		Process procedure header (e.g. proc <identifier>(<params>) then assemble the body.
 	#
 	def processProcedure(self,header,body):
-		m = re.match("proc("+self.rxIdentifier+")\((.*)\)",header)				# split into name and parameters.
-		if m is None:
+		AssemblerException.LINE = header[0].getLine()
+		if len(header) < 4 or header[1].getType() != "identifier" or not header[2].isPunctuation("(") \
+															or not header[-1].isPunctuation(")"):
 			raise AssemblerException("Bad procedure definition")
+		params = self.splitParameters(header[3:-1])								# parameter tokens
 
 		self.dictionary.removeLocalVariables()									# remove all locals.
-		params = self.processIdentifiers(m.group(2),False)						# Allocate local variables/params
-		body = self.processIdentifiers(body,False)								# Allocate other loca.s
+		cacheKey = None
+		if self.cache is not None:												# already assembled this ?
+			cacheKey = self.createCacheKey(header,body)
+			entry = self.cache.load(cacheKey)
+			if entry is not None:
+				self.copyProcedure(header[1].getValue(),entry)
+				return
+		blockStart = self.codeGen.getAddress()									# start of locals and code.
+		firstReference = len(self.codeGen.getReferences()) if cacheKey is not None else 0
+
+		paramAddresses = []
+		for p in params:														# allocate parameters
+			if len(p) != 1 or p[0].getType() != "identifier":					# check parameters
+				raise AssemblerException("Bad parameter")
+			paramAddresses.append(self.findVariable(p[0].getValue()).getAddress())
+		for statement in body:													# allocate strings and locals
+			for i in range(0,len(statement)):
+				if statement[i].getType() == "string":							# replace strings with address
+					address = Address(self.codeGen.createStringConstant(statement[i].getValue()),None)
+					statement[i] = Token("number",address,statement[i].getLine(),statement[i].getColumn())
+				elif self.isVariable(statement,i):
+					self.findVariable(statement[i].getValue())
 
-		params = [x for x in params.split(",") if x != ""]						# split into a list.
-		procID = ProcedureIdentifier(m.group(1),self.codeGen.getAddress(),len(params))
+		procID = ProcedureIdentifier(header[1].getValue(),self.codeGen.getAddress(),len(params))
 		self.dictionary.addIdentifier(procID)									# save procedure getAddress
+		self.procedures.append(procID)
 		for i in range(0,len(params)):											# for each parameter.
-			if not params[i].startswith("@"):									# check parameters
-				raise AssemblerException("Bad parameter")
-			self.codeGen.storeParamRegister(i,int(params[i][1:]))				# write parameter to local variable.
+			reads = self.countReads(params[i][0].getValue(),body)
+			if reads is None:													# address used, must be stored
+				self.codeGen.storeParamRegister(i,paramAddresses[i])
+			else:																# kept in register if possible
+				self.codeGen.receiveParamRegister(i,paramAddresses[i],reads)
 	#			
 		self.structureStack = [ "Marker" ]										# In case over popping.
-		for line in [x for x in body.split(":") if x != ""]:
-			if line == "~":														# is it a line marker ?
-				AssemblerException.LINE += 1
-			else:																# it's an instruction.
-				self.assembleInstruction(line)
+		for i in range(0,len(body)):
+			AssemblerException.LINE = body[i][0].getLine()
+			self.isTailCall = self.isTailPosition(body,i)
+			self.body,self.statementNumber = body,i								# for looking ahead
+			self.assembleInstruction(body[i])
 		if len(self.structureStack) != 1:
 			raise AssemblerException("Structure imbalance")
+		self.codeGen.endProcedure()												# finish off procedure code
+		if cacheKey is not None:												# save in the cache
+			entry = self.createCacheEntry(header,body,procID,blockStart,firstReference)
+			if entry is not None:
+				self.cache.save(cacheKey,entry)
+	#
+	#		Count the times a variable is read in a procedure body, or None if its address
+	#		is used. Reads are any use except being stored to directly.
+	#
+	def countReads(self,name,body):
+		reads = 0
+		name = name.lower()
+		for statement in body:
+			for i in range(0,len(statement)):
+				if self.isVariable(statement,i) and statement[i].getValue().lower() == name:
+					if i > 0 and statement[i-1].isPunctuation("@"):
+						return None
+					stored = i > 0 and statement[i-1].isPunctuation(">")
+					indirect = i+1 < len(statement) and (statement[i+1].isPunctuation("!") or statement[i+1].isPunctuation("?"))
+					reads += 0 if stored and not indirect else 1
+		return reads
+	#
+	#		Create the cache key for a procedure. This is the procedure's tokens, and what
+	#		its identifiers refer to outside the procedure. Must be called before strings
+	#		are replaced and locals allocated.
+	#
+	def createCacheKey(self,header,body):
+		tokens = [(t.getType(),t.getValue()) for statement in [header]+body for t in statement]
+		identifiers = set([t.getValue() for statement in [header]+body for t in statement if t.getType() == "identifier"])
+		externals = []
+		for name in sorted(identifiers):										# what each one is now.
+			info = self.dictionary.find(name)
+			if info is not None:
+				count = info.getParameterCount() if isinstance(info,ProcedureIdentifier) else None
+				externals.append((name,info.__class__.__name__,count))
+		return self.cache.createKey([self.codeGen.__class__.__name__,tokens,externals])
+	#
+	#		Create a cache entry for the procedure just assembled, None if it can't be.
+	#
+	def createCacheEntry(self,header,body,procID,blockStart,firstReference):
+		blockEnd = self.codeGen.getAddress()
+		code = self.codeGen.readCode(blockStart,blockEnd)
+		relocations = []
+		procedures = {}
+		for address,name in self.codeGen.getReferences()[firstReference:]:		# every address operand
+			offset = address - blockStart
+			value = code[offset] + code[offset+1] * 256
+			if value >= blockStart and value < blockEnd:						# in this procedure
+				relocations.append([offset,None,value-blockStart])
+			else:																# somewhere else, by name
+				info = self.dictionary.find(name) if name is not None else None
+				if info is None:
+					return None
+				relocations.append([offset,name,value-info.getValue()])
+				if isinstance(info,ProcedureIdentifier):
+					procedures[name] = info.getParameterCount()
+		localVariables = []
+		for info in self.dictionary.getLocalVariables():						# in the block or shared
+			inBlock = info.getValue() >= blockStart and info.getValue() < blockEnd
+			localVariables.append([info.getName(),info.getValue() - blockStart if inBlock else None])
+		return { "code":code,"entry":procID.getValue()-blockStart,"parameters":procID.getParameterCount(),
+							"locals":localVariables,"procedures":procedures,"relocations":relocations }
+	#
+	#		Copy a procedure from the cache, relocating it to the current address.
+	#
+	def copyProcedure(self,name,entry):
+		for procName in entry["procedures"].keys():								# procedures called
+			self.findProcedure(procName,entry["procedures"][procName])
+		for local,offset in entry["locals"]:									# shared ones, referred to by name
+			if offset is None:
+				self.dictionary.addIdentifier(VariableIdentifier(local,self.allocateLocal(local)))
+		base = self.codeGen.getAddress()
+		code = list(entry["code"])
+		for offset,refName,addend in entry["relocations"]:
+			value = (base if refName is None else self.dictionary.find(refName).getValue()) + addend
+			code[offset] = value & 0xFF
+			code[offset+1] = (value >> 8) & 0xFF
+		self.codeGen.copyCode(code)
+		for local,offset in entry["locals"]:
+			if offset is not None:
+				if self.overlay is not None:									# others may share it
+					self.overlay.adopt(self.procedureKey,base+offset)
+				self.dictionary.addIdentifier(VariableIdentifier(local,base+offset))
+		procID = ProcedureIdentifier(name,base+entry["entry"],entry["parameters"])
+		self.dictionary.addIdentifier(procID)
+		self.procedures.append(procID)
+		for offset,refName,addend in entry["relocations"]:						# remember the copied references
+			self.codeGen.getReferences().append((base+offset,refName))
+	#
+	#		Get every procedure assembled, local ones included.
+	#
+	def getProcedures(self):
+		return self.procedures
 	#
 	#		Assemble a single intruction
 	#
 	def assembleInstruction(self,line):
-		print("\t\t ------ "+line+" ------")
-		if line == "endproc":													# endproc
+		if self.listing.enabled:
+			self.listing.source(line[0].getLine(),"".join([t.getText() for t in line]))
+		first = line[0].getValue()
+		if first == "endproc" and len(line) == 1:								# endproc
 			self.codeGen.returnSubroutine()
-		elif line.startswith("if") or line.startswith("while"):					# if and while are very similar
+		elif first == "if" or first == "while":									# if and while are very similar
 			self.startIfWhile(line)												# there's just a jump back in while
-		elif line == "endif" or line == "endwhile":
-			self.endIfWhile(line)
-		elif line.startswith("for"):											# for
+		elif (first == "endif" or first == "endwhile") and len(line) == 1:
+			self.endIfWhile(first)
+		elif first == "for":													# for
 			self.startFor(line)
-		elif line == "endfor":													# endfor
-			self.endFor(line)
-		elif re.match("^"+self.rxIdentifier+"\(",line) is not None:				# <procedure>(parameters)
-			self.procedureCall(line)
+		elif first == "endfor" and len(line) == 1:								# endfor
+			self.endFor(first)
+		elif line[0].getType() == "identifier" and len(line) > 1 and line[1].isPunctuation("("):
+			self.procedureCall(line)											# <procedure>(parameters)
 		else:
 			self.assembleExpression(line)										# try it as a straight expression.
 	#
 	#		Assemble a procedure invocation
 	#
 	def procedureCall(self,line):
-		m = re.match("^("+self.rxIdentifier+")\((.*)\)$",line)					# split it up
-		if m is None:
+		if not line[-1].isPunctuation(")"):										# check it is name(....)
 			raise AssemblerException("Syntax error in procedure call")
-		parameters = [x for x in m.group(2).split(",") if x != ""]				# work through parameters
+		parameters = self.splitParameters(line[2:-1])							# work through parameters
 		for i in range(0,len(parameters)):
-			mp = re.match("^(\@?)(\d+)$",parameters[i]) 						# simple. var/int only supported.
-			if mp is None:														# not matched
+			term = self.parseTerm(parameters[i],0)								# simple. var/int only supported.
+			if term is None or len(term[0]) != 2 or term[1] != len(parameters[i]):
 				raise AssemblerException("Bad parameter")
-			self.codeGen.loadParamRegister(i,mp.group(1) == "",int(mp.group(2)))
-		procInfo = self.dictionary.find(m.group(1))								# get proc info
-		if procInfo is None:													# check we know the procedure
-			raise AssemblerException("Unknown procedure "+m.group(1)+")")
-		self.codeGen.callSubroutine(procInfo.getValue())						# compile call.
+			self.codeGen.loadParamRegister(i,term[0][0],term[0][1])
+		procInfo = self.findProcedure(line[0].getValue(),len(parameters))		# get proc info
+		if procInfo is None or not isinstance(procInfo,ProcedureIdentifier):	# check we know the procedure
+			raise AssemblerException("Unknown procedure "+line[0].getValue()+")")
+		if self.isTailCall:														# nothing else to do, so jump
+			self.codeGen.tailCallSubroutine(procInfo.getAddress())
+			self.tailCalls += 1
+		else:
+			self.codeGen.callSubroutine(procInfo.getAddress())					# compile call.
 		if procInfo.getParameterCount() != len(parameters):
 			raise AssemblerException("Wrong number of parameters")
 	#
+	#		Check if body[i] is followed by endproc, possibly after endifs, so it is the
+	#		last thing the procedure does.
+	#
+	def isTailPosition(self,body,i):
+		i += 1
+		while i < len(body) and len(body[i]) == 1 and body[i][0].getValue() == "endif":
+			i += 1
+		return i < len(body) and len(body[i]) == 1 and body[i][0].getValue() == "endproc"
+	#
+	#		Get number of calls compiled as jumps
+	#
+	def getTailCallCount(self):
+		return self.tailCalls
+	#
 	#		Assemble code for if/while structure. While is an If which loops to the test :)
 	#
 	def startIfWhile(self,line):
-		m = re.match("^(while|if)\((.*)([\#\=\<])0\)$",line)					# decode it.
-		if m is None:															# couldn't
+		if len(line) < 6 or not line[1].isPunctuation("(") or not line[-1].isPunctuation(")"):
 			raise AssemblerException("Structure syntax error")
-		info = [ m.group(1), self.codeGen.getAddress() ]						# structure, loop address
-		test = { "#":"z","=":"nz","<":"p" }[m.group(3)]							# this is the *fail* test
+		condition = self.parseCondition(line[2:-1])
+		loop = self.codeGen.getAddress() if line[0].getValue() == "while" else None
+		info = [ line[0].getValue(), loop ]										# structure, loop address
+		self.assembleSteps(condition.getSteps())								# only stores if result known
+		if condition.getResult() is None:										# test it
+			if condition.getRight() is not None:
+				self.codeGen.compareCode(condition.getTest(),condition.getRight()[0],condition.getRight()[1])
+			test = Condition.INVERSE[condition.getTest()]						# this is the *fail* test
+		else:																	# always or never run
+			test = None if condition.getResult() else ""
 		info.append(test)
-		self.assembleExpression(m.group(2))										# do the expression part
-		info.append(self.codeGen.getAddress())									# struct,loop,toptest,testaddr
-		self.codeGen.jumpInstruction(test,0)									# jump to afterwards on fail.
-		self.structureStack.append(info)										# put on stack
+		info.append(self.codeGen.jumpInstruction(test,0) if test is not None else None)	# jump to afterwards on fail.
+		self.structureStack.append(info)										# struct,loop,test,jump
 
 	def endIfWhile(self,line):
 		info = self.structureStack.pop()										# get top structure.
@@ -141,97 +417,223 @@ class Assembler(object):
 			raise AssemblerException("Structure imbalance")
 		if line == "endwhile":													# if while loop back before test.
 			self.codeGen.jumpInstruction("",info[1])
-		self.codeGen.jumpInstruction(info[2],self.codeGen.getAddress(),info[3])	# overwrite the jump.
+		if info[3] is not None:
+			self.codeGen.jumpInstruction(info[2],self.codeGen.getAddress(),info[3])	# overwrite the jump.
 	#
 	#		Assemble code for for/endfor
 	#
 	def startFor(self,line):
-		m = re.match("^for\((.*)\)$",line)										# split it up
-		if m is None:															# check format.
+		if len(line) < 4 or not line[1].isPunctuation("(") or not line[-1].isPunctuation(")"):
 			raise AssemblerException("Poorly formatted for")
-		self.assembleExpression(m.group(1))										# compile the loop count value
-		self.structureStack.append(["for",self.codeGen.getAddress()])			# push on the stack.
-		self.codeGen.forCode()													# generate the for code.
+		count = None
+		steps = self.parseExpression(line[2:-1]).getSteps()
+		if len(steps) == 1 and steps[0][1][0] and not isinstance(steps[0][1][1],Address):
+			count = steps[0][1][1] & 0xFFFF										# constant, left to the loop code
+		else:
+			self.assembleExpression(line[2:-1])									# compile the loop count value
+		body = self.body[self.statementNumber+1:self.findEndFor(self.body,self.statementNumber)]
+		loop = self.codeGen.forCode(count,self.makesCalls(body))				# generate the for code.
+		self.structureStack.append(["for",loop])								# push on the stack.
 		indexInfo = self.dictionary.find("index")								# index defined ?
-		if indexInfo is not None:												# save index if it exists
-			self.codeGen.storeDirect(indexInfo.getValue())
+		if indexInfo is not None and self.isIndexRead():						# save index if it may be read
+			self.codeGen.forIndexCode(loop,indexInfo.getAddress())
 	#
 	def endFor(self,line):
 		info = self.structureStack.pop()										# get the element off the stack
 		if info[0] != "for":													# check it is correct.
 			raise AssemblerException("endfor without for")
-		self.codeGen.endForCode(info[1])		#
+		self.codeGen.endForCode(info[1])
+	#
+	#		Find the endfor matching the for at body[i], or the end of the body.
+	#
+	def findEndFor(self,body,i):
+		depth = 0
+		for n in range(i,len(body)):
+			if body[n][0].getValue() == "for":
+				depth += 1
+			elif body[n][0].getValue() == "endfor" and len(body[n]) == 1:
+				depth -= 1
+				if depth == 0:
+					return n
+		return len(body)
+	#
+	#		Check if statements call anything. Operators which may be library calls, and
+	#		loops, which may use the same registers, count as calls.
+	#
+	def makesCalls(self,statements):
+		for statement in statements:
+			for i in range(0,len(statement)):
+				if statement[i].getType() == "identifier" and not self.isVariable(statement,i) \
+												and statement[i].getValue() not in self.keywords:
+					return True
+				if statement[i].getType() == "punctuation" and statement[i].getValue() in "*/%":
+					return True
+			if statement[0].getValue() == "for":
+				return True
+		return False
+	#
+	#		Check if the index set by the for being assembled may be read. This is anywhere
+	#		after it, or anywhere in a loop it is in as that runs again, except in other
+	#		for loops, which set it themselves.
+	#
+	def isIndexRead(self):
+		if self.countReads("index",self.body) is None:							# address used
+			return True
+		loops = []																# structures this is in
+		for n in range(0,self.statementNumber):
+			first = self.body[n][0].getValue()
+			if first == "if" or first == "while" or first == "for":
+				loops.append(n if first != "if" else None)
+			elif len(self.body[n]) == 1 and first in ["endif","endwhile","endfor"] and len(loops) > 0:
+				loops.pop()
+		loops = [n for n in loops if n is not None]
+		n = loops[0] if len(loops) > 0 else self.statementNumber
+		while n < len(self.body):
+			if self.countReads("index",[self.body[n]]) > 0:
+				return True
+			if self.body[n][0].getValue() == "for" and n != self.statementNumber and n not in loops:
+				n = self.findEndFor(self.body,n)								# skip its body
+			n += 1
+		return False
+	#
 	#		Assemble an expression. Convert the terms to information groups, then compile it.
 	#
-	def assembleExpression(self,line):		
-		line = [x for x in re.split("([\+\-\*\/\%\&\|\^\>])",line) if x!=""]	# split into operators and terms.
-		#
-		if len(line) % 2 == 0:													# must be an odd number ; n operators
-			raise AssemblerException("Bad expression form")						# means n_1 terms.
-		for i in range(0,len(line),2):											# parse for terms.
-			term = line[i]
-			m = re.match("^(\@?)(\d+)$",term) 									# simple. var/int
-			if m is None:
-				m = re.match("^(\@?)(\d+)([\!\?])(\@?)(\d+)$",term) 			# complex. var/int[?!]var/int
-			if m is None:
-				raise AssemblerException("Can't understand term "+term)
-			line[i] = m.groups()												# put it back in the list.
-		#
-		self.codeGen.loadDirect(line[0][0] == "",int(line[0][1]))				# the first term.
+	def assembleExpression(self,line):
+		self.assembleSteps(self.parseExpression(line).getSteps())				# fold constants and compile
+	#
+	#		Compile the steps of an expression.
+	#
+	def assembleSteps(self,steps):
+		for step in steps:
+			term = step[-1]
+			if step[0] == "load":
+				self.codeGen.loadDirect(term[0],term[1])
+				if len(term) != 2:												# indirect first term, read it
+					self.codeGen.binaryOperation(term[2],term[3],term[4])
+			elif step[0] == "store":
+				if len(term) == 2:												# simple store term ?
+					self.codeGen.storeDirect(term[1])
+				else:
+					self.codeGen.storeIndirect(term[2],term[1],term[3],term[4])
+			else:
+				self.codeGen.binaryOperation(step[1],term[0],term[1])
+	#
+	#		Convert an expression to terms, and those to an Expression with constants folded.
+	#
+	def parseExpression(self,line):
+		return Expression(self.parseTerms(line)).simplify()
+	#
+	#		Parse a condition, an expression compared with a constant or variable.
+	#
+	def parseCondition(self,line):
+		pos = len(line)-2 if len(line) >= 2 and line[-2].isPunctuation("@") else len(line)-1
+		right = self.parseAtom(line,pos)
+		if pos < 2 or right is None or line[pos-1].getType() != "punctuation" or line[pos-1].getValue() not in "<=#":
+			raise AssemblerException("Structure syntax error")
+		operator,end = line[pos-1].getValue(),pos-1
+		if operator == "=" and line[pos-2].isPunctuation(">"):					# >= is two tokens
+			operator,end = ">=",pos-2
+		return Condition(self.parseTerms(line[:end]),operator,right[0]).simplify()
+	#
+	#		Convert an expression to a list of terms alternating with operators.
+	#
+	def parseTerms(self,line):
+		terms = []																# alternate terms and operators
+		pos = 0
+		while True:
+			term = self.parseTerm(line,pos)										# get a term
+			if term is None:
+				raise AssemblerException("Can't understand term")
+			terms.append(term[0])
+			pos = term[1]
+			if pos == len(line):												# reached the end.
+				break
+			if line[pos].getType() != "punctuation" or line[pos].getValue() not in self.operators:
+				raise AssemblerException("Bad expression form")
+			terms.append(line[pos].getValue())									# add operator
+			pos += 1
 		#
-		for i in range(1,len(line),2):											# do all the other pairs.
-			if line[i] == ">":													# assign, special case.
-				if line[i+1][0] == "":											# check first bit is identifier.
+		for i in range(1,len(terms),2):											# check all the other pairs.
+			if terms[i] == ">":													# assign, special case.
+				if terms[i+1][0]:												# check first bit is identifier.
 					raise AssemblerException("Cannot assign to a constant")
-				if len(line[i+1]) == 2:											# simple store term ?
-					self.codeGen.storeDirect(int(line[i+1][1]))
-				else:
-					self.codeGen.storeIndirect(line[i+1][2],int(line[i+1][1]),line[i+1][3] == "",int(line[i+1][4]))
+			elif len(terms[i+1]) != 2:											# can only read indirect first.
+				raise AssemblerException("Indirect term must be first")
+		return terms
+	#
+	#		Parse a term at line[pos]. Returns (term,next position) or None, where a term is
+	#		(isConstant,value) or (isConstant,value,[!?],isConstant,value)
+	#
+	def parseTerm(self,line,pos):
+		atom = self.parseAtom(line,pos)											# simple. var/int
+		if atom is None:
+			return None
+		pos = atom[1]
+		if pos < len(line) and (line[pos].isPunctuation("!") or line[pos].isPunctuation("?")):
+			offset = self.parseAtom(line,pos+1)									# complex. var/int[?!]var/int
+			if offset is None or atom[0][0]:
+				return None
+			return ((atom[0][0],atom[0][1],line[pos].getValue(),offset[0][0],offset[0][1]),offset[1])
+		return atom
+	#
+	#		Parse a constant, variable or @variable at line[pos]
+	#
+	def parseAtom(self,line,pos):
+		isAddress = pos < len(line) and line[pos].isPunctuation("@")			# @<identifier> is a constant
+		pos = pos + 1 if isAddress else pos
+		if pos >= len(line):
+			return None
+		if line[pos].getType() == "number" and not isAddress:					# integer constant
+			return ((True,line[pos].getValue()),pos+1)
+		if not self.isVariable(line,pos):										# must be a variable
+			return None
+		info = self.dictionary.find(line[pos].getValue())
+		return ((isAddress,info.getAddress()),pos+1)
+	#
+	#		Split a token list on commas.
+	#
+	def splitParameters(self,tokens):
+		params = [[]]
+		for t in tokens:
+			if t.isPunctuation(","):
+				params.append([])
 			else:
-				self.codeGen.binaryOperation(line[i],line[i+1][0] == "",int(line[i+1][1]))
-	#
-	#		Remove quoted strings - allocate them in data memory and replace them with the address.
-	#
-	def processQuotedString(self,source):
-		strx = re.compile("(\".*?\")")											# splits up quoted strings
-		for line in range(0,len(source)):										# work through all lines
-			if source[line].find('"') >= 0:										# if quoted string found
-				parts = strx.split(source[line])								# split line up.
-				for pn in range(0,len(parts)):									# look for quoted strings
-					if parts[pn].startswith('"'):
-						if parts[pn][-1] != '"' or len(parts[pn]) < 2:			# validate the string.
-							AssemblerException.LINE = line+1 	
-							raise AssemblerException("Bad quoted string")
-																				# replace with address of string
-						parts[pn] = str(self.codeGen.createStringConstant(parts[pn][1:-1]))
-				source[line] = "".join(parts)									# put it back together.
-		return source
-	#
-	#		Process hexadecimal constants
-	#
-	def processHexConstants(self,body):
-		parts = re.split("(0x[0-9a-f]+)",body)									# split them out.
-		for i in range(0,len(parts)):
-			if parts[i].startswith("0x"):
-				parts[i] = str(int(parts[i][2:],16))
-		return "".join(parts)
-	#
-	#		Process the identifiers, allocating if necessary. Can do globals only, or all.
-	#		Does not touch procedure invocation.
-	#
-	def processIdentifiers(self,source,globalsOnly):
-		idSplit = re.compile("("+self.rxIdentifier+"\(?)")						# splits out all ids.
-		parts = idSplit.split(source)											# split out all identifiers.
-		for i in range(0,len(parts)):											# scan all bits
-			if idSplit.match(parts[i]) and not parts[i].endswith("("):			# if identifier and not a call
-				if parts[i] not in self.keywords:								# and not a keywords
-					if not globalsOnly or parts[i].startswith("$"):				# doing globals only ?
-						info = self.dictionary.find(parts[i])					# look it up.
-						if info is None:										# is it new, if so make space.
-							info = VariableIdentifier(parts[i],self.codeGen.allocSpace(None,parts[i]))
-							self.dictionary.addIdentifier(info)
-						parts[i] = "@"+str(info.getValue())
-		return "".join(parts).replace("@@","")									# put it back together
+				params[-1].append(t)
+		return [] if params == [[]] else params
+	#
+	#		Check if tokens[i] is a variable reference, not keyword or procedure call.
+	#
+	def isVariable(self,tokens,i):
+		if tokens[i].getType() != "identifier" or tokens[i].getValue() in self.keywords:
+			return False
+		return i+1 >= len(tokens) or not tokens[i+1].isPunctuation("(")
+	#
+	#		Find a variable, allocating it if new.
+	#
+	def findVariable(self,name):
+		info = self.dictionary.find(name)										# look it up.
+		if info is None:														# is it new, if so make space.
+			info = self.createVariable(name)
+			self.dictionary.addIdentifier(info)
+		return info
+	#
+	#		Create a new variable. Globals are created the same way as locals here,
+	#		except locals may share storage with other procedures.
+	#
+	def createVariable(self,name):
+		return VariableIdentifier(name,self.allocateLocal(name) if not name.startswith("$") else self.codeGen.allocSpace(None,name))
+	#
+	#		Allocate storage for a local in the procedure being assembled
+	#
+	def allocateLocal(self,name):
+		if self.overlay is None:
+			return self.codeGen.allocSpace(None,name)
+		return self.overlay.allocate(self.procedureKey,lambda: self.codeGen.allocSpace(None,name))
+	#
+	#		Find a procedure being called.
+	#
+	def findProcedure(self,name,paramCount):
+		return self.dictionary.find(name)
 	#
 	#		Complete the assembly by writing the main procedure.
 	#
@@ -242,4 +644,5 @@ class Assembler(object):
 			self.codeGen.callSubroutine(boot)
 		here = self.codeGen.getAddress()
 		self.codeGen.jumpInstruction("",here)									# ending in an infinite loop.
+		self.codeGen.endProcedure()
 		return main
@@ -0,0 +1,152 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		objectmodule.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Relocatable object modules, and assembling source into them.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import json
+from errors import *
+from dictionary import *
+from z80codegen import *
+from nexthla import *
+
+# ***************************************************************************************
+#		Image that code generators write to when building an object module. Has the
+#		same interface as BootImage, code is assembled from ORIGIN upwards.
+# ***************************************************************************************
+
+class ObjectImage(object):
+	ORIGIN = 0x8000 															# clear of placeholder addresses
+	def __init__(self,dictionary):
+		self.dictionary = dictionary 											# library dictionary
+		self.code = []
+	def getCodePage(self):
+		return 0x20
+	def getCodeAddress(self):
+		return ObjectImage.ORIGIN + len(self.code)
+	def getDictionary(self):
+		return self.dictionary
+	def findWord(self,name):
+		return self.dictionary.get(name)
+	def read(self,page,address):
+		return self.code[address-ObjectImage.ORIGIN]
+	def write(self,page,address,data,dataType = 2):
+		assert data >= 0 and data < 256
+		self.code[address-ObjectImage.ORIGIN] = data
+	def cByte(self,data):
+		assert data >= 0 and data < 256
+		self.code.append(data)
+	def cWord(self,data):
+		self.code.append(data & 0xFF)
+		self.code.append(data >> 8)
+	def cBytes(self,data):
+		self.code += data
+	def writeBlock(self,page,address,data):
+		self.code[address-ObjectImage.ORIGIN:address-ObjectImage.ORIGIN+len(data)] = data
+
+# ***************************************************************************************
+#		An object module. This is the code, assembled at offset zero, and
+#
+#			symbols 		procedure name => { "offset":n,"parameters":n }
+#			globals 		$ global variable names used, allocated by the linker
+#			imports 		procedure name => parameter count, for procedures called
+#							which are not in this module
+#			relocations 	list of [offset,name,addend]. Word at offset becomes the
+#							address of name + addend, or the module base + addend if
+#							name is null.
+# ***************************************************************************************
+
+class ObjectModule(object):
+	def __init__(self,name,code,symbols,globalVariables,imports,relocations):
+		self.name = name
+		self.code = code
+		self.symbols = symbols
+		self.globals = globalVariables
+		self.imports = imports
+		self.relocations = relocations
+	def getName(self):
+		return self.name
+	def getCode(self):
+		return self.code
+	def getSymbols(self):
+		return self.symbols
+	def getGlobals(self):
+		return self.globals
+	def getImports(self):
+		return self.imports
+	def getRelocations(self):
+		return self.relocations
+	#
+	#		Write the module out
+	#
+	def save(self,fileName):
+		with open(fileName,"w") as h:
+			json.dump({ "name":self.name,"code":self.code,"symbols":self.symbols,"globals":self.globals,
+							"imports":self.imports,"relocations":self.relocations },h)
+#
+#		Read a module in
+#
+def loadObjectModule(fileName):
+	with open(fileName) as h:
+		m = json.load(h)
+	return ObjectModule(m["name"],m["code"],m["symbols"],m["globals"],m["imports"],m["relocations"])
+
+# ***************************************************************************************
+#		Assembler producing an object module. Globals and procedures from other modules
+#		are given placeholder addresses and left for the linker.
+# ***************************************************************************************
+
+class ModuleAssembler(Assembler):
+	def __init__(self,libraryDictionary,cache = None):
+		self.globals = [] 														# globals used, in order
+		self.imports = {} 														# procedures from elsewhere
+		self.image = ObjectImage(libraryDictionary)
+		Assembler.__init__(self,Z80CodeGenerator(self.image),cache)
+	#
+	#		Globals have no storage in the module.
+	#
+	def createVariable(self,name):
+		if not name.startswith("$"):
+			return Assembler.createVariable(self,name)
+		self.globals.append(name)
+		return VariableIdentifier(name,0)
+	#
+	#		Unknown global procedures are assumed to be in another module.
+	#
+	def findProcedure(self,name,paramCount):
+		info = self.dictionary.find(name)
+		if info is None and name.startswith("$"):
+			info = ProcedureIdentifier(name,0,paramCount)
+			self.dictionary.addIdentifier(info)
+			self.imports[name] = paramCount
+		return info
+	#
+	#		Create the object module from what has been assembled.
+	#
+	def createObject(self,name):
+		origin = ObjectImage.ORIGIN
+		code = list(self.image.code)
+		library = self.image.getDictionary()
+		relocations = []
+		for address,refName in self.codeGen.getReferences():
+			offset = address - origin
+			value = code[offset] + code[offset+1] * 256
+			if refName in self.imports or refName in self.globals:				# placeholder, by name
+				relocations.append([offset,refName,value])
+			elif refName in library:											# library word, by name
+				relocations.append([offset,refName,value-library[refName]["address"]])
+			elif value >= origin and value < origin+len(code):					# in this module
+				relocations.append([offset,None,value-origin])
+			else:
+				raise AssemblerException("Cannot relocate reference to "+str(refName))
+		symbols = {}
+		for info in self.dictionary.getIdentifiers():							# global procedures left
+			if isinstance(info,ProcedureIdentifier) and not isinstance(info,ExternalProcedureIdentifier) \
+													and info.getName() not in self.imports:
+				symbols[info.getName()] = { "offset":info.getValue()-origin,"parameters":info.getParameterCount() }
+		return ObjectModule(name,code,symbols,list(self.globals),dict(self.imports),relocations)
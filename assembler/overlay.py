@@ -0,0 +1,92 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		overlay.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Shares local variable storage between procedures which can never
+#					be running at the same time.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#		Locals (and parameters) are word slots. A procedure may use a slot already
+#		used by other procedures if none of them can be running while it is, which
+#		is if none of them are reached from it through the call graph. As procedures
+#		are defined before use, callees are always allocated first, and anything
+#		calling this one later does the same check against it.
+#
+#		Procedures which are recursive, have their address taken (so could be called
+#		from anywhere), or are reached from one whose address is taken, have their
+#		own slots which are never shared. So do procedures not in the call graph.
+# ***************************************************************************************
+
+class OverlayAllocator(object):
+	def __init__(self,calls,addressTaken):
+		self.calls = calls 														# procedure => procedures called
+		self.reached = {}
+		for procedure in calls.keys():
+			self.reached[procedure] = self.findReached(procedure)
+		self.distinct = set()
+		for procedure in calls.keys():
+			if any([procedure in self.reached[c] for c in calls[procedure]]):	# recursive
+				self.distinct.add(procedure)
+		for procedure in addressTaken:											# could be called anywhere
+			self.distinct.update(self.reached[procedure])
+		self.slots = [] 														# [address,set of owners]
+		self.localCount = 0 													# locals allocated
+		self.slotsCreated = 0 													# and the slots needed
+	#
+	#		Find the procedures reached from a procedure, itself included.
+	#
+	def findReached(self,procedure):
+		reached = set()
+		pending = [procedure]
+		while len(pending) > 0:
+			p = pending.pop()
+			if p not in reached:
+				reached.add(p)
+				pending += self.calls[p]
+		return reached
+	#
+	#		Check if a procedure has its own storage
+	#
+	def isDistinct(self,procedure):
+		return procedure is None or procedure not in self.calls or procedure in self.distinct
+	#
+	#		Get a slot for a local of a procedure, allocSpace is called to create a new one.
+	#
+	def allocate(self,procedure,allocSpace):
+		self.localCount += 1
+		if not self.isDistinct(procedure):
+			reached = self.reached[procedure]
+			for slot in self.slots:												# one nothing reached uses
+				if slot[1].isdisjoint(reached):
+					slot[1].add(procedure)
+					return slot[0]
+		self.slotsCreated += 1
+		address = allocSpace()
+		if not self.isDistinct(procedure):										# others may use it later
+			self.slots.append([address,set([procedure])])
+		return address
+	#
+	#		Add a slot a procedure already has, when it is copied from the cache.
+	#
+	def adopt(self,procedure,address):
+		self.localCount += 1
+		self.slotsCreated += 1
+		if not self.isDistinct(procedure):
+			self.slots.append([address,set([procedure])])
+	#
+	#		Get the number of locals allocated, and the bytes saved by sharing slots.
+	#
+	def getLocalCount(self):
+		return self.localCount
+	def getBytesSaved(self,wordSize = 2):
+		return (self.localCount - self.slotsCreated) * wordSize
+	#
+	#		Get the procedures which have their own storage.
+	#
+	def getDistinctProcedures(self):
+		return self.distinct
@@ -0,0 +1,115 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		peephole.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Table driven peephole optimiser for Z80 instruction lists.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#		Instructions are [opcodes,operand], opcodes a list of bytes and operand a 16 bit
+#		word following them, or None. A list is straight line code with no labels in
+#		it except at the start, so anything after an unconditional jump is never run.
+#
+#		Each pattern is a name, a list of opcode alternatives to match one for each
+#		instruction, and a function which is given the matching instructions and
+#		returns their replacement, or None if it does not apply.
+# ***************************************************************************************
+
+LD_HL_NN = [0x21]
+LD_HL_MEM = [0x2A]
+LD_MEM_HL = [0x22]
+LD_DE_NN = [0x11]
+LD_DE_MEM = [0xED,0x5B]
+LD_BC_NN = [0x01]
+LD_BC_MEM = [0xED,0x4B]
+CALL = [0xCD]
+JP = [0xC3]
+RET = [0xC9]
+JP_HL = [0xE9]
+EX_DE_HL = [0xEB]
+PUSH_HL = [0xE5]
+POP_HL = [0xE1]
+
+class PeepholeOptimiser(object):
+	def __init__(self):
+		self.patterns = [
+			#	name 					match 										replacement
+			( "store/reload",		[ [LD_MEM_HL],[LD_HL_MEM] ],				lambda c: c[:1] if c[0][1] == c[1][1] else None ),
+			( "store/store",		[ [LD_MEM_HL],[LD_MEM_HL] ],				lambda c: c[:1] if c[0][1] == c[1][1] else None ),
+			( "call/ret",			[ [CALL],[RET] ],							lambda c: [ [JP,c[0][1]] ] ),
+			( "ex de,hl pair",		[ [EX_DE_HL],[EX_DE_HL] ],					lambda c: [] ),
+			( "push/pop",			[ [PUSH_HL],[POP_HL] ],						lambda c: [] ),
+			( "unused hl load",		[ [LD_HL_NN,LD_HL_MEM],[LD_HL_NN,LD_HL_MEM] ],	lambda c: c[1:] ),
+			( "unused de load",		[ [LD_DE_NN,LD_DE_MEM],[LD_DE_NN,LD_DE_MEM] ],	lambda c: c[1:] ),
+			( "unused bc load",		[ [LD_BC_NN,LD_BC_MEM],[LD_BC_NN,LD_BC_MEM] ],	lambda c: c[1:] ),
+		]
+		self.unconditional = [ JP,RET,JP_HL ]
+		self.hits = {}
+		for p in self.patterns + [ ("dead code",),("jump threading",) ]:
+			self.hits[p[0]] = 0
+	#
+	#		Optimise a list of instructions, returns the new list.
+	#
+	def optimise(self,code):
+		code = list(code)
+		changed = True
+		while changed:
+			changed = self.removeDeadCode(code)
+			i = 0
+			while i < len(code):
+				for name,match,replace in self.patterns:
+					if self.matches(code,i,match):
+						replacement = replace(code[i:i+len(match)])
+						if replacement is not None:
+							code[i:i+len(match)] = replacement
+							self.hits[name] += 1
+							changed = True
+							i = max(i-len(match),-1)								# new code may match earlier
+							break
+				i += 1
+		return code
+	#
+	#		Check if the instructions at code[i] match a pattern
+	#
+	def matches(self,code,i,match):
+		if i + len(match) > len(code):
+			return False
+		for n in range(0,len(match)):
+			if code[i+n][0] not in match[n]:
+				return False
+		return True
+	#
+	#		Remove anything after an unconditional jump.
+	#
+	def removeDeadCode(self,code):
+		for i in range(0,len(code)-1):
+			if code[i][0] in self.unconditional:
+				self.hits["dead code"] += len(code)-1-i
+				del code[i+1:]
+				return True
+		return False
+	#
+	#		Retarget jumps to unconditional jumps. Sites are the addresses of operands of
+	#		jumps which can be changed, read and write access the code.
+	#
+	def threadJumps(self,sites,read,write):
+		for site in sites:
+			original = read(site) | (read(site+1) << 8)
+			target = original
+			hops = 0
+			while target+1 in sites and read(target) == JP[0] and hops < 8:
+				target = read(target+1) | (read(target+2) << 8)
+				hops += 1
+			if target != original:
+				write(site,target & 0xFF)
+				write(site+1,target >> 8)
+				self.hits["jump threading"] += 1
+	#
+	#		Get pattern name => number of times used.
+	#
+	def getStatistics(self):
+		return self.hits
@@ -0,0 +1,203 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		profiler.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Procedure level profiler, running boot images in the emulator.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from errors import *
+from dictionary import *
+from z80emulator import *
+
+# ***************************************************************************************
+#		Every address belongs to the procedure or library word with the highest start
+#		address at or below it. Code above $C000 is assumed to be in the code page.
+#
+#		Exact profiling steps every instruction, tracking CALL/RST and RET to count
+#		calls and inclusive time. Sampling profiling runs the emulator at full speed
+#		and looks at PC and the return addresses on the stack every so many T-states.
+# ***************************************************************************************
+
+class Profiler(object):
+	def __init__(self,emulator):
+		self.cpu = emulator
+		self.symbols = {} 														# address => name
+	#
+	#		Add procedures from a list of ProcedureIdentifiers.
+	#
+	def addProcedures(self,identifiers):
+		for ident in identifiers:
+			if isinstance(ident,ProcedureIdentifier):
+				self.symbols[ident.getValue()] = ident.getName()
+	#
+	#		Add a single symbol.
+	#
+	def addSymbol(self,name,address):
+		self.symbols[address] = name
+	#
+	#		Add library words from a BootImage's dictionary.
+	#
+	def addLibrary(self,image):
+		d = image.getDictionary()
+		for name in d.keys():
+			self.symbols[d[name]["address"]] = name
+	#
+	#		Build the address => procedure number table. Procedure zero is unknown code.
+	#
+	def createOwners(self):
+		self.names = [ "(unknown)" ]
+		self.owner = [0] * 0x10000
+		addresses = sorted(self.symbols.keys())
+		for i in range(0,len(addresses)):
+			end = addresses[i+1] if i+1 < len(addresses) else 0x10000
+			self.names.append(self.symbols[addresses[i]])
+			self.owner[addresses[i]:end] = [len(self.names)-1] * (end-addresses[i])
+		self.calls = [0] * len(self.names)
+		self.inclusive = [0] * len(self.names)
+		self.exclusive = [0] * len(self.names)
+		self.instructions = [0] * 0x10000 										# T-states per address
+		self.sampled = False
+	#
+	#		Profile exactly, from address (or current PC), until halted, maxCycles or
+	#		return from the top level. Returns T-states taken.
+	#
+	def profile(self,address = None,maxCycles = None):
+		self.createOwners()
+		cpu = self.cpu
+		if address is not None:
+			cpu.pc = address
+		mem = cpu.mem
+		table = cpu.mainTable
+		owner = self.owner
+		calls,inclusive,exclusive,instructions = self.calls,self.inclusive,self.exclusive,self.instructions
+		active = [0] * len(self.names) 											# frames per procedure, for recursion
+		frames = [] 															# (procedure,start cycles)
+		start = cpu.cycles
+		cycles = start
+		limit = start + maxCycles if maxCycles is not None else 1 << 62
+		cpu.halted = False
+		while cycles < limit:
+			pc = cpu.pc
+			op = mem[pc]
+			sp = cpu.sp
+			cpu.pc = (pc + 1) & 0xFFFF
+			t = table[op](cpu)
+			cycles += t
+			exclusive[owner[pc]] += t
+			instructions[pc] += t
+			if cpu.sp != sp:
+				if cpu.sp == ((sp - 2) & 0xFFFF) and (op == 0xCD or (op & 0xC7) == 0xC4 or (op & 0xC7) == 0xC7):
+					callee = owner[cpu.pc]											# CALL or RST taken
+					calls[callee] += 1
+					active[callee] += 1
+					frames.append((callee,cycles))
+				elif cpu.sp == ((sp + 2) & 0xFFFF) and (op == 0xC9 or (op & 0xC7) == 0xC0 or \
+										(op == 0xED and (mem[(pc+1) & 0xFFFF] & 0xC7) == 0x45)):
+					if len(frames) == 0:											# returned from top level
+						break
+					callee,entered = frames.pop()									# RET taken
+					active[callee] -= 1
+					if active[callee] == 0:
+						inclusive[callee] += cycles - entered
+			if cpu.pc == pc and cpu.isHalt(pc):
+				cpu.halted = True
+				break
+		for callee,entered in frames:											# still running
+			if active[callee] > 0:
+				inclusive[callee] += cycles - entered
+				active[callee] = 0
+		self.total = cycles - start
+		cpu.cycles = cycles
+		return self.total
+	#
+	#		Profile by sampling every interval T-states. Calls are not counted, and
+	#		inclusive times come from the return addresses found on the stack.
+	#
+	def sample(self,address = None,maxCycles = None,interval = 1000,stackTop = Z80Emulator.STACKTOP):
+		self.createOwners()
+		self.sampled = True
+		cpu = self.cpu
+		if address is not None:
+			cpu.pc = address
+		total = 0
+		while not cpu.halted and (maxCycles is None or total < maxCycles):
+			t = cpu.execute(interval)
+			total += t
+			self.exclusive[self.owner[cpu.pc]] += t
+			self.instructions[cpu.pc] += t
+			active = set([self.owner[cpu.pc]])
+			sp = cpu.sp
+			while sp < stackTop and sp < cpu.sp + 128:							# look for return addresses
+				caller = (cpu.readWord(sp) - 3) & 0xFFFF
+				if cpu.mem[caller] == 0xCD or (cpu.mem[caller] & 0xC7) == 0xC4:
+					active.add(self.owner[cpu.readWord(caller+1)])
+				sp += 2
+			for n in active:
+				self.inclusive[n] += t
+		self.total = total
+		return total
+	#
+	#		Get the results, list of dictionaries, most inclusive time first.
+	#
+	def getResults(self,hottest = 3):
+		results = []
+		for n in range(0,len(self.names)):
+			if self.exclusive[n] > 0 or self.inclusive[n] > 0:
+				results.append({ "name":self.names[n],"calls":self.calls[n],
+								 "inclusive":max(self.inclusive[n],self.exclusive[n]),"exclusive":self.exclusive[n],
+								 "hottest":self.getHottest(n,hottest) })
+		results.sort(key = lambda r:-r["inclusive"])
+		return results
+	#
+	#		Get the hottest instructions in a procedure, list of (address,T-states)
+	#
+	def getHottest(self,procedure,count):
+		hot = [(a,self.instructions[a]) for a in range(0,0x10000) if self.owner[a] == procedure and self.instructions[a] > 0]
+		hot.sort(key = lambda h:-h[1])
+		return hot[:count]
+	#
+	#		Print a report.
+	#
+	def report(self,hottest = 3):
+		total = max(self.total,1)
+		print("{0:<32} {1:>8} {2:>12} {3:>6} {4:>12} {5:>6}".format("Procedure","Calls","Inclusive","%","Exclusive","%"))
+		for r in self.getResults(hottest):
+			calls = "-" if self.sampled else str(r["calls"])
+			print("{0:<32} {1:>8} {2:>12} {3:>6.1f} {4:>12} {5:>6.1f}".format(r["name"],calls,
+						r["inclusive"],r["inclusive"]*100.0/total,r["exclusive"],r["exclusive"]*100.0/total))
+			for address,t in r["hottest"]:
+				code = " ".join(["{0:02x}".format(self.cpu.mem[(address+i) & 0xFFFF]) for i in range(0,3)])
+				print("    ${0:04x}  {1:<10} {2:>12} {3:>6.1f}".format(address,code,t,t*100.0/total))
+		print("Total {0} T-states".format(self.total))
+
+if __name__ == "__main__":
+	import sys
+	from imagelib import *
+	from z80codegen import *
+	from nexthla import *
+	image = BootImage("../libraries/standard.lib")
+	assembler = Assembler(Z80CodeGenerator(image))
+	with open(sys.argv[1]) as h:
+		assembler.assembleProgram([h.readlines()])
+	main = assembler.createMain()
+	image.setBootAddress(image.getCodePage(),main)
+	cpu = Z80Emulator()
+	cpu.loadImage(image)
+	profiler = Profiler(cpu)
+	profiler.addLibrary(image)
+	profiler.addProcedures(assembler.getProcedures())
+	profiler.addSymbol("(main)",main)
+	if len(sys.argv) > 2 and sys.argv[2] == "sample":
+		profiler.sample(0x8000)
+	else:
+		profiler.profile(0x8000)
+	profiler.report()
+	print("Peephole {0}".format(assembler.codeGen.getPeepholeStatistics()))
+	print("Loads skipped {0}".format(assembler.codeGen.getSkippedLoads()))
+	print("Tail calls {0}".format(assembler.getTailCallCount()))
+	print("Dropped {0} (about {1} bytes)".format(",".join(assembler.getDroppedProcedures()),assembler.getBytesSaved()))
+	print("Shared locals {0} bytes saved, own storage {1}".format(assembler.getLocalBytesSaved(),",".join(assembler.getDistinctProcedures())))
@@ -0,0 +1,157 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		test_bootloader.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Runs the boot loader snapshot in the emulator, with the esxDOS calls
+#					it makes done here. Run with pytest, or directly.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import os,io,random
+from imagelib import *
+from z80emulator import *
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))+os.sep+".."+os.sep
+LOADER = DIRECTORY+"bootloader"+os.sep+"bootloader.sna"
+LIBRARY = DIRECTORY+"libraries"+os.sep+"standard.lib"
+
+# ***************************************************************************************
+#		Emulator with the files the loader can open. RST $08 is an esxDOS call, the
+#		function number is the byte after it. Reads are kept as (address,page).
+# ***************************************************************************************
+
+class LoaderEmulator(Z80Emulator):
+	def __init__(self,files):
+		Z80Emulator.__init__(self)
+		self.files = files
+		self.reads = []
+		with open(LOADER,"rb") as h:
+			snapshot = h.read()
+		self.mem[0x4000:0x10000] = snapshot[27:]								# 48k after the header
+		self.start = self.readWord(snapshot[23] + snapshot[24] * 256) 			# RETN address on its stack
+	#
+	#		Run the loader until the code it loads halts.
+	#
+	def load(self,maxCycles = 10000000):
+		self.pc = self.start
+		cycles = 0
+		while True:
+			cycles += self.execute(maxCycles - cycles,0x0008)
+			if self.pc != 0x0008:
+				return cycles
+			self.esxDOS()
+	#
+	#		Do an esxDOS call and return after the function number.
+	#
+	def esxDOS(self):
+		address = self.readWord(self.sp)
+		self.sp = (self.sp + 2) & 0xFFFF
+		self.pc = (address + 1) & 0xFFFF
+		function = self.mem[address]
+		self.f = self.f & 0xFE 													# carry clear, no error
+		if function == 0x89: 													# default drive
+			self.a = ord("C")
+		elif function == 0x9A: 													# open file named at IX
+			name = self.mem[self.ix:self.mem.index(0,self.ix)].decode()
+			if name not in self.files: 											# not found, carry set
+				self.f = self.f | 0x01
+				self.a = 5
+				return
+			self.opened = name
+			self.file = self.files[name]
+			self.position = 0
+			self.a = 1
+		elif function == 0x9D: 													# read BC bytes to IX
+			size = (self.b << 8) | self.c
+			data = self.file[self.position:self.position+size]
+			self.position += len(data)
+			self.mem[self.ix:self.ix+len(data)] = data
+			self.reads.append((self.ix,self.mmu[6] if self.ix >= 0xC000 else None))
+			self.b,self.c = len(data) >> 8,len(data) & 0xFF
+		elif function != 0x9B: 													# close file
+			raise Exception("Unknown esxDOS function {0:02x}".format(function))
+
+# ***************************************************************************************
+#		Create an image with code up to a page, as the linker would save it.
+# ***************************************************************************************
+
+def createImage(lastPage,fileName):
+	image = BootImage(LIBRARY)
+	for page in range(0x20,lastPage+1,2):
+		image.write(page,0xC000,page)
+		image.write(page,0xFFFF,page+1)
+	image.save(fileName)
+	with open(fileName,"rb") as h:
+		return image,bytearray(h.read())
+
+#
+#		Load raw and compressed images, they should leave the same in memory.
+#
+def compareLoads(image,data):
+	h = io.BytesIO()
+	image.writeCompressed(h)
+	raw = LoaderEmulator({ "boot.img":data })
+	raw.load()
+	packed = LoaderEmulator({ "boot.img":data,"boot.imz":h.getvalue() })
+	packed.load()
+	assert raw.opened == "boot.img" and packed.opened == "boot.imz"
+	assert raw.halted and packed.halted and raw.pc == packed.pc
+	assert raw.mem[0x8000:0xC000] == packed.mem[0x8000:0xC000]
+	lastPage = image.read(0,image.getSysInfo()+6)
+	for page in range(0x20,lastPage):
+		for offset in range(0,0x2000,0x100):
+			assert [raw.readPhysical(page,offset+n) for n in range(0,0x100)] == \
+									[packed.readPhysical(page,offset+n) for n in range(0,0x100)]
+	return packed
+
+def test_loader_dummy_image():
+	with open(DIRECTORY+"bootloader"+os.sep+"boot.img","rb") as h:
+		cpu = LoaderEmulator({ "boot.img":h.read() })
+	cpu.load()
+	assert cpu.halted and cpu.breakpoints == 1 and cpu.pc == 0x8002
+	assert cpu.reads == [(0x8000,None)] 										# end page is $20
+
+def test_loader_end_page(tmp_path):
+	image,data = createImage(0x22,str(tmp_path/"boot.img"))
+	assert image.read(0,image.getSysInfo()+6) == 0x24
+	cpu = LoaderEmulator({ "boot.img":data })
+	cpu.load()
+	assert cpu.reads == [(0x8000,None),(0xC000,0x20),(0xC000,0x22)]
+	for page in [0x20,0x22]:
+		assert cpu.readPhysical(page,0) == page and cpu.readPhysical(page+1,0x1FFF) == page+1
+	assert cpu.halted and cpu.pc == cpu.readWord(image.getSysInfo()+12)		# kernel ran, start address
+
+def test_loader_end_page_unknown(tmp_path):
+	image,data = createImage(0x22,str(tmp_path/"boot.img"))
+	data[image.getSysInfo()-0x8000+6] = 0 										# saved before +6 was set
+	cpu = LoaderEmulator({ "boot.img":data })
+	cpu.load()
+	assert cpu.reads == [(0x8000,None)] + [(0xC000,page) for page in range(0x20,0x60,2)]
+	assert cpu.readPhysical(0x22,0) == 0x22
+
+def test_loader_compressed(tmp_path):
+	image,data = createImage(0x22,str(tmp_path/"boot.img"))
+	cpu = compareLoads(image,data)
+	assert (0x6000,None) in cpu.reads and cpu.readPhysical(0x23,0x1FFF) == 0x23 	# packed into the buffer
+
+def test_loader_compressed_raw_block(tmp_path):
+	image,data = createImage(0x20,str(tmp_path/"boot.img"))
+	generator = random.Random(42)
+	image.writeBlock(0x22,0xC000,[generator.randrange(0,256) for n in range(0,0x4000)])	# will not pack
+	image.save(str(tmp_path/"boot.img"))
+	with open(str(tmp_path/"boot.img"),"rb") as h:
+		data = bytearray(h.read())
+	cpu = compareLoads(image,data)
+	assert (0xC000,0x22) in cpu.reads
+
+if __name__ == "__main__":
+	import tempfile,pathlib
+	test_loader_dummy_image()
+	for test in [ test_loader_end_page,test_loader_end_page_unknown,test_loader_compressed,
+																	test_loader_compressed_raw_block ]:
+		with tempfile.TemporaryDirectory() as directory:
+			test(pathlib.Path(directory))
+	print("ok")
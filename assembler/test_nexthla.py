@@ -0,0 +1,95 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		test_nexthla.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Tests compiling programs with the Z80 code generator and running
+#					them in the emulator. Run with pytest, or directly.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import os
+from imagelib import *
+from z80codegen import *
+from nexthla import *
+from z80emulator import *
+
+LIBRARY = os.path.dirname(os.path.abspath(__file__))+os.sep+".."+os.sep+"libraries"+os.sep+"standard.lib"
+
+# ***************************************************************************************
+#		Global variables only last to the end of their module, so their addresses are
+#		kept as they are created.
+# ***************************************************************************************
+
+class ProgramAssembler(Assembler):
+	def __init__(self,codeGenerator):
+		self.globals = {}
+		Assembler.__init__(self,codeGenerator)
+	def createVariable(self,name):
+		variable = Assembler.createVariable(self,name)
+		if name.startswith("$"):
+			self.globals[name] = variable.getValue()
+		return variable
+
+# ***************************************************************************************
+#		Assemble a program, run it from boot and return a function getting the value
+#		of a global variable.
+# ***************************************************************************************
+
+def run(source,image = None):
+	image = BootImage(LIBRARY) if image is None else image
+	assembler = ProgramAssembler(Z80CodeGenerator(image))
+	assembler.assemble(source.split("\n"))
+	image.setBootAddress(image.getCodePage(),assembler.createMain())
+	cpu = Z80Emulator()
+	cpu.loadImage(image)
+	cpu.boot(1000000)
+	assert cpu.halted
+	return lambda name: cpu.readWord(assembler.globals[name])
+
+def test_condition_known_keeps_stores():
+	get = run("""
+proc $main.boot()
+	5>$a:0>$b:0>$c:if ($a>$b<0x8000):1>$c:endif
+	6>$a:0>$d:0>$e:if ($a>$d>=0x8000):1>$e:endif
+	0>$f:if (3<4):1>$f:endif:0>$g:while (2<1):1>$g:endwhile
+endproc""")
+	assert [get(v) for v in ["$b","$c","$d","$e","$f","$g"]] == [5,0,6,1,1,0]
+
+def test_condition_signed():
+	get = run("""
+proc $main.boot()
+	0>$r:0x8000>$a:1>$b:if ($a<$b):$r+1>$r:endif:if ($b>=$a):$r+2>$r:endif
+	if ($a<0):$r+4>$r:endif:0>$z:if ($a<$z):$r+8>$r:endif:if ($a<0xFFFF):$r+16>$r:endif
+endproc""")
+	assert get("$r") == 31
+
+def test_store_indirect_loads_base():
+	get = run("""
+proc $main.boot()
+	@$buf>$p:$p>$p!0:$p!0>$q
+	@$buf2>$r:7>$r!0:$r!0>$s:9>$r?1:$r?1>$t
+endproc""")
+	assert get("$q") == get("$p") and get("$p") != 0
+	assert [get("$s"),get("$t")] == [7,9]
+
+def test_store_indirect_parameters():
+	get = run("""
+proc put(a,b):b>a!0:a!0>$v:a>$w:b>$x:endproc
+proc $main.boot():@$buf>$p:put($p,42):endproc""")
+	assert [get("$v"),get("$w"),get("$x")] == [42,get("$p"),42]
+
+def test_library_words_from_table():
+	image = BootImage(LIBRARY)
+	get = run("proc $main.boot():console.info(@$d):endproc",image)
+	assert image.dictionary is None 											# found with the word table
+	assert get("$d") != 0 and image.findWord("console.info")["parameters"] == 1
+	assert image.findWord("console.inf") is None and image.findWord("nothing") is None
+
+if __name__ == "__main__":
+	for test in [ test_condition_known_keeps_stores,test_condition_signed,test_store_indirect_loads_base,
+														test_store_indirect_parameters ]:
+		test()
+	print("ok")
@@ -0,0 +1,78 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		test_z80emulator.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Opcode tests for the emulator, the instructions generated code
+#					relies on. Run with pytest, or directly.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from z80emulator import *
+
+# ***************************************************************************************
+#		Run a code fragment at $8000 as a subroutine, returns the processor and the
+#		T-states it took, less the final RET.
+# ***************************************************************************************
+
+def execute(code,**registers):
+	cpu = Z80Emulator()
+	cpu.sp = 0xFF00
+	for r in registers.keys():
+		setattr(cpu,r,registers[r])
+	cpu.mem[0x8000:0x8000+len(code)+1] = bytes(code+[0xC9])						# code ; RET
+	cycles = cpu.call(0x8000) - 10
+	return cpu,cycles
+
+def carry(cpu):
+	return cpu.f & 0x01
+
+def test_scf_ccf():
+	cpu,cycles = execute([0x37])												# SCF
+	assert carry(cpu) == 1
+	cpu,cycles = execute([0x37,0x3F])											# SCF ; CCF
+	assert carry(cpu) == 0 and (cpu.f & 0x10) != 0								# H is the old carry
+	cpu,cycles = execute([0x37,0x3F,0x3F])										# SCF ; CCF ; CCF
+	assert carry(cpu) == 1 and (cpu.f & 0x10) == 0
+	assert cycles == 12
+
+def test_sbc_hl():
+	for hl,de,c in [(5,3,0),(3,5,0),(0x8000,1,0),(0x7FFF,0xFFFF,0),(5,4,1),(0,0,1)]:
+		cpu,cycles = execute([0xED,0x52],h = hl >> 8,l = hl & 0xFF,d = de >> 8,e = de & 0xFF,f = c)
+		result = hl - de - c
+		hlNew = (cpu.h << 8) | cpu.l
+		assert hlNew == result & 0xFFFF
+		assert carry(cpu) == (1 if result < 0 else 0)
+		assert (cpu.f & 0x40 != 0) == (result & 0xFFFF == 0)					# Z
+		assert (cpu.f & 0x80 != 0) == (result & 0x8000 != 0)					# S
+		signed = (hl - (hl >> 15 << 16)) - (de - (de >> 15 << 16)) - c
+		assert (cpu.f & 0x04 != 0) == (signed < -0x8000 or signed > 0x7FFF)	# P/V overflow
+		assert cpu.f & 0x02 != 0												# N
+		assert cycles == 15
+
+def test_djnz():
+	cpu,cycles = execute([0x06,0x05,0x3C,0x10,0xFD],a = 0)						# LD B,5 ; INC A ; DJNZ $-1
+	assert cpu.a == 5 and cpu.b == 0
+	assert cycles == 7 + 5 * 4 + 4 * 13 + 8
+	cpu,cycles = execute([0x06,0x00,0x3C,0x10,0xFD],a = 0)						# B = 0 loops 256 times
+	assert cpu.a == 0 and cpu.b == 0
+
+def test_conditional_jumps():
+	tests = [ (0xC2,0x00,True),(0xC2,0x40,False),(0xCA,0x40,True),(0xCA,0x00,False),	# JP NZ/Z
+			  (0xD2,0x00,True),(0xD2,0x01,False),(0xDA,0x01,True),(0xDA,0x00,False),	# JP NC/C
+			  (0xF2,0x00,True),(0xF2,0x80,False),(0xFA,0x80,True),(0xFA,0x00,False) ]	# JP P/M
+	for opcode,flags,taken in tests:
+		cpu,cycles = execute([0x3E,0x00,opcode,0x06,0x80,0x3C],f = flags)		# LD A,0 ; JP cc,$8006 ; INC A
+		assert cpu.a == (0 if taken else 1)
+		assert cycles == 7 + 10 + (0 if taken else 4)
+	for opcode,flags,taken in [ (0x20,0x00,True),(0x28,0x00,False),(0x30,0x01,False),(0x38,0x01,True) ]:
+		cpu,cycles = execute([0x3E,0x00,opcode,0x01,0x3C],f = flags)			# LD A,0 ; JR cc,$+3 ; INC A
+		assert cpu.a == (0 if taken else 1)
+		assert cycles == 7 + (12 if taken else 7 + 4)
+
+if __name__ == "__main__":
+	for test in [ test_scf_ccf,test_sbc_hl,test_djnz,test_conditional_jumps ]:
+		test()
+	print("ok")
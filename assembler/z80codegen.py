@@ -9,30 +9,73 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+from errors import *
 from dictionary import *
+from peephole import *
+from listing import *
 
 # ***************************************************************************************
-#					This is a code generator for an idealised CPU
+#					This is a code generator for the Z80. The accumulator is HL
 #
+#		Instructions are buffered and peephole optimised before going in the image.
+#		Asking for the current address is a label, so it writes the buffer out.
+#
+#		What HL, DE and BC are known to hold is tracked, as a set of (isConstant,value)
+#		for each, so loads of values already there can be skipped. This is forgotten
+#		at labels, calls and indirect stores.
+#
+#		Code written is sent to a listing sink, which by default does nothing.
+#
+#		Parameters arrive in HL, DE and BC and stay there while nothing else needs the
+#		register. They are only stored in their variable if they are still to be read
+#		when the register is changed, or at a label, jump or call.
 # ***************************************************************************************
 
 class Z80CodeGenerator(object):
-	def __init__(self,image):
+	def __init__(self,image,listing = None):
 		self.image = image
+		self.listing = NullListing() if listing is None else listing
+		self.references = [] 													# (address,name) of address operands
+		self.paramRegisters = [ "hl","de","bc" ]								# registers for parameters.
+		self.tests = { "":0xC3,"z":0xCA,"nz":0xC2,"p":0xF2,"m":0xFA,"c":0xDA,"nc":0xD2,
+										"<":0xDA,">=":0xD2,"=":0xCA,"#":0xC2 }
+		self.buffer = [] 														# [opcodes,operand] not yet written
+		self.jumpSites = set() 													# operands of jumps in this procedure
+		self.peephole = PeepholeOptimiser()
+		self.skippedLoads = 0
+		self.maxInlineSize = 16 												# longest inline * / % in bytes
+		self.registerCodes = { "hl":(4,5),"de":(2,3),"bc":(0,1) } 				# for LD r,r
+		self.pending = {} 														# register => parameter only there
+		self.reads = {} 														# parameter => reads still to come
+		self.bcChanges = 0 														# times BC has been changed
+		self.forget()
 	#
-	#		Load Externals.
+	#		Load Externals. They are looked up in the image's word table when first used.
 	#
 	def loadExternals(self,dictionary):
-		d = self.image.getDictionary()
-		for name in d.keys():
-			xProc = ExternalProcedureIdentifier(name,d[name]["address"],d[name]["parameters"])
-			dictionary.addIdentifier(xProc)
+		dictionary.setExternals(self.findExternal)
+	#
+	#		Find an external word, None if there isn't one.
+	#
+	def findExternal(self,name):
+		word = self.image.findWord(name)
+		if word is None:
+			return None
+		return ExternalProcedureIdentifier(name,word["address"],word["parameters"])
 	#
 	#		Get current address
 	#
 	def getAddress(self):
+		self.spill()
+		self.flush()
+		self.forget()															# could be a label
 		return self.image.getCodeAddress()
 	#
+	#		Get the listing sink
+	#
+	def getListing(self):
+		return self.listing
+	#
 	#		Get word size
 	#
 	def getWordSize(self):
@@ -41,89 +84,457 @@ class Z80CodeGenerator(object):
 	#		Load a constant or variable into the accumulator.
 	#
 	def loadDirect(self,isConstant,value):
-		pass
+		self.loadRegister("hl",isConstant,value)
 	#
 	#		Do a binary operation on a constant or variable on the accumulator
 	#
 	def binaryOperation(self,operator,isConstant,value):
-		pass
+		self.known["hl"] = set()
+		if operator == "+" or operator == "!" or operator == "?":
+			self.loadRegister("de",isConstant,value)
+			self.spill(["hl"])
+			self.cCode([0x19])													# ADD HL,DE
+			if operator == "!":
+				self.cCodes([[0x7E],[0x23],[0x66],[0x6F]])						# LD A,(HL) ; INC HL ; LD H,(HL) ; LD L,A
+			if operator == "?":
+				self.cCodes([[0x6E],[0x26,0x00]])								# LD L,(HL) ; LD H,0
+		elif operator == "-":
+			self.loadRegister("de",isConstant,value)
+			self.spill(["hl"])
+			self.cCodes([[0xAF],[0xED,0x52]])									# XOR A ; SBC HL,DE
+		elif operator == "&" or operator == "|" or operator == "^":
+			self.loadRegister("bc",isConstant,value)
+			self.spill(["hl"])
+			op = { "&":0xA0,"|":0xB0,"^":0xA8 }[operator]						# AND/OR/XOR B
+			self.cCodes([[0x7C],[op],[0x67],[0x7D],[op+1],[0x6F]])				# LD A,H ; op B ; LD H,A ; LD A,L ; op C ; LD L,A
+		else:
+			code = self.strengthReduce(operator,value) if isConstant and not isinstance(value,Address) else None
+			if code is not None:												# inline shifts and adds
+				self.spill(["hl","de"])
+				for opcodes,operand in code:
+					self.cCode(opcodes,operand)
+				self.known["de"] = set()
+				return
+			self.loadRegister("bc",isConstant,value)
+			word = { "*":"sys.multiply","/":"sys.divide","%":"sys.modulus" }[operator]
+			self.callSubroutine(self.findLibraryWord(word))
+	#
+	#		Get inline code for HL * / % a constant, or None if the library call is better.
+	#		Powers of two are shifts or masks, other multipliers are shifts and adds.
+	#		Unsigned, like the library words.
+	#
+	def strengthReduce(self,operator,value):
+		value = value & 0xFFFF
+		shift = value.bit_length()-1 if value != 0 and (value & (value-1)) == 0 else None
+		if operator == "*":
+			if value == 0:
+				code = [ [[0x21],0] ]											# LD HL,0
+			elif shift is not None:
+				code = [ [[0x65],None],[[0x2E,0x00],None] ] if shift >= 8 else [] # LD H,L ; LD L,0
+				code += [ [[0x29],None] ] * (shift % 8 if shift >= 8 else shift)	# ADD HL,HL
+			else:
+				code = [ [[0x54],None],[[0x5D],None] ]							# LD D,H ; LD E,L
+				for bit in bin(value)[3:]:										# shift and add for each bit
+					code.append([[0x29],None])									# ADD HL,HL
+					if bit == "1":
+						code.append([[0x19],None])								# ADD HL,DE
+		elif shift is None:														# not a power of two
+			return None
+		elif operator == "/":
+			code = [ [[0x6C],None],[[0x26,0x00],None] ] if shift >= 8 else []	# LD L,H ; LD H,0
+			code += [ [[0xCB,0x3C],None],[[0xCB,0x1D],None] ] * (shift % 8 if shift >= 8 else shift)	# SRL H ; RR L
+		elif shift == 0:
+			code = [ [[0x21],0] ]												# LD HL,0
+		elif shift < 8:
+			code = [ [[0x26,0x00],None],[[0x7D],None],[[0xE6,value-1],None],[[0x6F],None] ]	# LD H,0 ; LD A,L ; AND n ; LD L,A
+		elif shift == 8:
+			code = [ [[0x26,0x00],None] ]										# LD H,0
+		else:
+			code = [ [[0x7C],None],[[0xE6,(value-1) >> 8],None],[[0x67],None] ]	# LD A,H ; AND n ; LD H,A
+		size = sum([len(opcodes) + (0 if operand is None else 2) for opcodes,operand in code])
+		return code if size <= self.maxInlineSize else None
 	#
 	#		Store direct
 	#
 	def storeDirect(self,value):
-		pass
-		print("${0:06x}  sta   (${1:04x})".format(self.pc,value))
-		self.pc += 1
+		self.overwritten(value)
+		self.cCode([0x22],value)												# LD (nnnn),HL
+		self.stored("hl",value)
 	#
 	#		Store A indirect to address [variable] + offset/[offset]
-	#		
+	#
 	def storeIndirect(self,dataSize,baseVariable,offsetIsConstant,offset):
-		pass
+		self.spill()
+		constants = set([k for k in self.known["hl"] if k[0]])					# variables may be overwritten
+		self.exchange()															# EX DE,HL
+		self.loadRegister("hl",False,baseVariable)
+		self.loadRegister("bc",offsetIsConstant,offset)
+		self.cCodes([[0x09],[0x73]])											# ADD HL,BC ; LD (HL),E
+		if dataSize == "!":
+			self.cCodes([[0x23],[0x72]])										# INC HL ; LD (HL),D
+		self.cCode([0xEB])														# EX DE,HL
+		self.known = { "hl":constants,"de":set(),"bc":set() }
+	#
+	#		Exchange DE and HL, and what is known about them.
+	#
+	def exchange(self):
+		self.cCode([0xEB])														# EX DE,HL
+		self.known["hl"],self.known["de"] = self.known["de"],self.known["hl"]
+		pending = {}
+		for register in self.pending.keys():
+			pending[{ "hl":"de","de":"hl" }.get(register,register)] = self.pending[register]
+		self.pending = pending
 	#
-	#		Generate for code.
+	#		Generate for code. The count is a constant, or None if it is in HL. Constant
+	#		counts up to 256 use DJNZ, with B saved round the body if it changes it. Other
+	#		loops count in IX if the body makes no calls, or on the stack. Returns what
+	#		the rest of the loop needs to know.
 	#
-	def forCode(self):
-		pass
+	def forCode(self,count = None,bodyCalls = True):
+		if count is not None and count >= 1 and count <= 256:
+			self.spill(["bc"])
+			self.cCode([0x06,count & 0xFF])										# LD B,n
+			loop = { "shape":"djnz","loop":self.getAddress() }
+			self.cCode([0xC5])													# PUSH BC, NOP if not needed
+			loop["bcChanges"] = self.bcChanges
+		elif not bodyCalls:
+			if count is not None:
+				self.cCode([0xDD,0x21],count)									# LD IX,nnnn
+			else:
+				self.cCodes([[0xE5],[0xDD,0xE1]])								# PUSH HL ; POP IX
+			loop = { "shape":"ix","loop":self.getAddress() }
+			self.cCode([0xDD,0x2B])												# DEC IX
+		else:
+			if count is not None:
+				self.loadRegister("hl",True,count)
+			loop = { "shape":"stack","loop":self.getAddress() }
+			self.spill(["hl"])
+			self.cCodes([[0x2B],[0xE5]])										# DEC HL ; PUSH HL
+			self.known["hl"] = set()
+		return loop
+	#
+	#		Store the loop index, which counts down to zero.
+	#
+	def forIndexCode(self,loop,address):
+		if loop["shape"] == "djnz":
+			self.cCodes([[0x68],[0x2D],[0x26,0x00]])							# LD L,B ; DEC L ; LD H,0
+			self.known["hl"] = set()
+			self.storeDirect(address)
+		elif loop["shape"] == "ix":
+			self.overwritten(address)
+			self.cCode([0xDD,0x22],address)										# LD (nnnn),IX
+			for r in self.known.keys():
+				self.known[r].discard((False,address))
+		else:
+			self.storeDirect(address)
 	#
 	#		Gemerate endfor code.
 	#
-	def endForCode(self,loopAddress):
-		pass
+	def endForCode(self,loop):
+		self.spill()
+		if loop["shape"] == "djnz":
+			target = loop["loop"]
+			if self.bcChanges == loop["bcChanges"]:								# B kept, so don't save it
+				self.flush()
+				self.image.write(self.image.getCodePage(),target,0x00)			# NOP, run once
+				target += 1
+			else:
+				self.cCode([0xC1])												# POP BC
+			offset = target - (self.getAddress() + 2)
+			if offset >= -128:
+				self.cData([0x10,offset & 0xFF])								# DJNZ
+			else:
+				self.cCode([0x05])												# DEC B ; JP NZ
+				self.cCode([0xC2],Address(target,None))
+			self.bcChanges += 1
+			self.known["bc"] = set()
+		elif loop["shape"] == "ix":
+			self.cCodes([[0xDD,0x7C],[0xDD,0xB5]])								# LD A,IXH ; OR IXL
+			self.cCode([0xC2],Address(loop["loop"],None))						# JP NZ
+		else:
+			self.cCodes([[0xE1],[0x7C],[0xB5]])									# POP HL ; LD A,H ; OR L
+			self.cCode([0xC2],Address(loop["loop"],None))						# JP NZ
+			self.known["hl"] = set()
+	#
+	#		Compare HL with a constant or variable for a jump on < >= = #, < and >= are
+	#		signed, done unsigned with the sign bits flipped.
 	#
-	#	Compile a loop instruction. Test are z, nz, p or "" (unconditional). The compilation
-	#	address can be overridden to patch forward jumps.
+	def compareCode(self,test,isConstant,value):
+		if test == "=" or test == "#":
+			self.loadRegister("de",isConstant,value)
+			self.spill(["hl"])
+			self.cCodes([[0xB7],[0xED,0x52]])									# OR A ; SBC HL,DE
+		else:																	# signed, flip the sign bits
+			biased = isConstant and not isinstance(value,Address)
+			self.loadRegister("de",isConstant,value ^ 0x8000 if biased else value)
+			self.spill(["hl","de"])
+			if not biased:
+				self.cCodes([[0x7A],[0xEE,0x80],[0x57]])						# LD A,D ; XOR $80 ; LD D,A
+				self.known["de"] = set()
+			self.cCodes([[0x7C],[0xEE,0x80],[0x67],[0xED,0x52]])				# LD A,H ; XOR $80 ; LD H,A ; SBC HL,DE
+		self.known["hl"] = set()
+	#
+	#	Compile a loop instruction. Test are z, nz, p, m on HL, < >= = # after compareCode
+	#	or "" (unconditional). Returns where the jump is, which can be given as the
+	#	override to patch forward jumps. Conditional tests on HL are preceded by two
+	#	bytes setting the flags.
 	#
 	def jumpInstruction(self,test,target,override = None):
-		pass
+		if override is not None:
+			self.image.write(self.image.getCodePage(),override,target & 0xFF)
+			self.image.write(self.image.getCodePage(),override+1,target >> 8)
+			return override
+		self.spill()
+		if test == "z" or test == "nz":
+			self.cCodes([[0x7C],[0xB5]])										# LD A,H ; OR L
+		if test == "p" or test == "m":
+			self.cCodes([[0x7C],[0xB7]])										# LD A,H ; OR A
+		self.cCode([self.tests[test]],Address(target,None))
+		self.flush()
+		return self.image.getCodeAddress() - 2									# the jump's operand
 	#
 	#		Allocate count bytes of meory, default is word size
 	#
 	def allocSpace(self,count = None,reason = None):
-		pass
+		addr = self.getAddress()
+		count = self.getWordSize() if count is None else count
+		self.cData([0x00] * count)
+		return addr
 	#
 	#		Load constant/variable to a temporary area
 	#
 	def loadParamRegister(self,regNumber,isConstant,value):
-		pass
+		if regNumber >= len(self.paramRegisters):
+			raise AssemblerException("Too many parameters")
+		self.loadRegister(self.paramRegisters[regNumber],isConstant,value)
 	#
 	#		Copy parameter to a temporary area
 	#
 	def storeParamRegister(self,regNumber,address):
-		pass
+		if regNumber >= len(self.paramRegisters):
+			raise AssemblerException("Too many parameters")
+		self.cCode({ "hl":[0x22],"de":[0xED,0x53],"bc":[0xED,0x43] }[self.paramRegisters[regNumber]],address)
+		self.stored(self.paramRegisters[regNumber],address)
+	#
+	#		A parameter arrives in a register, and is read reads times by the procedure.
+	#		It is left there until it has to be stored.
+	#
+	def receiveParamRegister(self,regNumber,address,reads):
+		if regNumber >= len(self.paramRegisters):
+			raise AssemblerException("Too many parameters")
+		register = self.paramRegisters[regNumber]
+		self.known[register] = set([(False,address)])
+		if reads > 0:
+			self.pending[register] = address
+			self.reads[address] = reads
+	#
+	#		Store parameters still to be read which are only in registers, all of them
+	#		or those in the registers given, as those registers are about to change.
+	#
+	def spill(self,registers = None):
+		for register in (registers if registers is not None else list(self.pending.keys())):
+			address = self.pending.pop(register,None)
+			if address is not None and self.reads.get(address,0) > 0:
+				del self.reads[address]
+				self.cCode({ "hl":[0x22],"de":[0xED,0x53],"bc":[0xED,0x43] }[register],address)
+	#
+	#		A variable is being written to, so any parameter in it is no longer pending.
+	#
+	def overwritten(self,address):
+		for register in [r for r in self.pending.keys() if self.pending[r] == address]:
+			del self.pending[register]
+		self.reads.pop(address,None)
+	#
+	#		Drop pending parameters, when they can't be read any more.
+	#
+	def dropPending(self):
+		self.pending = {}
+		self.reads = {}
 	#
 	#		Create a string constant (done outside procedures)
 	#
 	def createStringConstant(self,string):
-		pass
+		sAddr = self.getAddress()
+		self.cData([ord(c) & 0xFF for c in string] + [0x00])
+		return sAddr
 	#
 	#		Call a subroutine
 	#
 	def callSubroutine(self,address):
-		pass
+		self.spill()
+		self.bcChanges += 1
+		self.cCode([0xCD],address)												# CALL nnnn
+		self.forget()
+	#
+	#		Call a subroutine as the last thing done, so its return is ours.
+	#
+	def tailCallSubroutine(self,address):
+		self.spill()
+		self.bcChanges += 1
+		self.cCode([0xC3],address)												# JP nnnn
+		self.forget()
 	#
 	#		Return from subroutine.
 	#
 	def returnSubroutine(self):
-		self.image.cByte(0xC9)									# RET
+		self.dropPending()
+		self.cCode([0xC9])														# RET
+		self.forget()
+	#
+	#		Copy a previously generated block of code in.
+	#
+	def copyCode(self,code):
+		self.cData(code)
+	#
+	#		Read back code generated between two addresses
+	#
+	def readCode(self,start,end):
+		self.flush()
+		return [self.image.read(self.image.getCodePage(),a) for a in range(start,end)]
+	#
+	#		End of a procedure. Write the code out and thread its jumps.
+	#
+	def endProcedure(self):
+		self.dropPending()
+		self.flush()
+		page = self.image.getCodePage()
+		self.peephole.threadJumps(self.jumpSites,lambda a:self.image.read(page,a),lambda a,d:self.image.write(page,a,d))
+		self.jumpSites = set()
+	#
+	#		Optimise and write out the buffered instructions.
+	#
+	def flush(self):
+		if len(self.buffer) > 0:
+			buffer = self.peephole.optimise(self.buffer)
+			self.buffer = []
+			code = []
+			starts = [] 														# offset of each instruction
+			for opcodes,operand in buffer:
+				starts.append(len(code))
+				code += opcodes
+				if operand is not None:
+					address = self.image.getCodeAddress() + len(code)
+					if isinstance(operand,Address):								# literals are not recorded
+						self.references.append((address,operand.getName()))
+						if opcodes[0] in self.tests.values() and operand.getName() is None:
+							self.jumpSites.add(address)
+					code += [operand & 0xFF,operand >> 8]
+			if self.listing.enabled:
+				self.list(code,starts + [len(code)])
+			self.image.cBytes(code)
+	#
+	#		Get peephole pattern name => times used
+	#
+	def getPeepholeStatistics(self):
+		return self.peephole.getStatistics()
+	#
+	#		Get the list of (address,name) for every address operand compiled. The name is
+	#		None for addresses of code in the current procedure.
+	#
+	def getReferences(self):
+		return self.references
+	#
+	#		Get the library words the code refers to, for building a kernel with just those.
+	#
+	def getLibraryWords(self):
+		names = set([name for address,name in self.references if name is not None])
+		return sorted([name for name in names if self.image.findWord(name) is not None])
+	#
+	#		Load HL, DE or BC with a constant or variable
+	#
+	def loadRegister(self,register,isConstant,value):
+		if not isConstant and value in self.reads:								# a pending parameter read
+			self.reads[value] -= 1
+		if (isConstant,value) in self.known[register]:							# already there
+			self.skippedLoads += 1
+			return
+		self.spill([register])
+		if register == "bc":
+			self.bcChanges += 1
+		source = [r for r in self.pending.keys() if self.pending[r] == value] if not isConstant else []
+		self.known[register] = set([(isConstant,value)])
+		if len(source) > 0:														# only in another register
+			for n in range(0,2):												# LD r,r for each half
+				self.cCode([0x40+self.registerCodes[register][n]*8+self.registerCodes[source[0]][n]])
+		elif isConstant:
+			self.cCode([{ "hl":0x21,"de":0x11,"bc":0x01 }[register]],value)		# LD rr,nnnn
+		else:
+			self.cCode({ "hl":[0x2A],"de":[0xED,0x5B],"bc":[0xED,0x4B] }[register],value)	# LD rr,(nnnn)
+	#
+	#		Forget what is known about the registers
+	#
+	def forget(self):
+		self.known = { "hl":set(),"de":set(),"bc":set() }
+	#
+	#		A register has been stored in a variable, so it also holds that variable
+	#		and nothing else does.
+	#
+	def stored(self,register,address):
+		for r in self.known.keys():
+			self.known[r].discard((False,address))
+		self.known[register].add((False,address))
+	#
+	#		Get number of loads skipped as the register already had the value
+	#
+	def getSkippedLoads(self):
+		return self.skippedLoads
+	#
+	#		Buffer an instruction, opcode bytes and optional word operand
+	#
+	def cCode(self,opcodes,operand = None):
+		self.buffer.append([opcodes,operand])
+	#
+	#		Buffer several instructions without operands
+	#
+	def cCodes(self,instructions):
+		for opcodes in instructions:
+			self.cCode(opcodes)
+	#
+	#		Write data, or code that is not to be optimised, straight out.
+	#
+	def cData(self,data):
+		self.flush()
+		self.forget()
+		if self.listing.enabled:
+			self.list(data,[0,len(data)])
+		self.image.cBytes(data)
+	#
+	#		Send code about to be written to the listing, a line for each of the slices
+	#		between the offsets given.
+	#
+	def list(self,code,offsets):
+		page = self.image.getCodePage()
+		address = self.image.getCodeAddress()
+		for i in range(0,len(offsets)-1):
+			self.listing.code(page,address+offsets[i],code[offsets[i]:offsets[i+1]])
+	#
+	#		Find a library word
+	#
+	def findLibraryWord(self,name):
+		word = self.image.findWord(name)
+		if word is None:
+			raise AssemblerException("Library word "+name+" missing")
+		return Address(word["address"],name)
 
 if __name__ == "__main__":
-	cg = DemoCodeGenerator()
+	from imagelib import *
+	cg = Z80CodeGenerator(BootImage("../libraries/standard.lib"),ConsoleListing())
 	cg.loadDirect(True,42)
-	cg.loadDirect(False,42)	
+	cg.loadDirect(False,42)
 	print("------------------")
 	cg.binaryOperation("%",True,44)
-	cg.binaryOperation("&",False,44)	
+	cg.binaryOperation("&",False,44)
 	cg.binaryOperation("?",True,44)
 	cg.binaryOperation("!",False,44)
 	print("------------------")
 	cg.storeDirect(46)
 	print("------------------")
 	cg.allocSpace(4)
-	cg.allocSpace(1)	
+	cg.allocSpace(1)
 	print("------------------")
 	cg.createStringConstant("Hello world!")
 	print("------------------")
 	cg.callSubroutine(42)
 	cg.returnSubroutine()
+	cg.endProcedure()
 	print("------------------")
-
@@ -0,0 +1,638 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		z80emulator.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Headless Z80 + ZX Next extensions emulator, for running and timing
+#					boot images without CSpect.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		Each opcode is a small function f(cpu) returning the T-states it took. These
+#		are generated from templates when the module is loaded, one table per prefix,
+#		so executing an instruction is one fetch and one table lookup.
+#
+#		Memory is a flat 64k bytearray. The Next's MMU ($50-$57) maps 8k pages into it,
+#		paging copies the slot out to, and in from, the 2Mb physical memory. $0000-$3FFF
+#		is ROM and cannot be written. A page mapped into two slots at once is not kept
+#		in step. There are no interrupts.
+#
+# ***************************************************************************************
+
+SZXY = [(n & 0xA8) | (0x40 if n == 0 else 0) for n in range(0,256)]		# S Z 5 3 flags
+SZXYP = [SZXY[n] | (0x04 if bin(n).count("1") % 2 == 0 else 0) for n in range(0,256)]
+
+_REG8 = [ "b","c","d","e","h","l",None,"a" ]									# register encoding
+_CONDITIONS = [ "not (cpu.f & 0x40)","cpu.f & 0x40","not (cpu.f & 0x01)","cpu.f & 0x01",
+				"not (cpu.f & 0x04)","cpu.f & 0x04","not (cpu.f & 0x80)","cpu.f & 0x80" ]
+
+# ***************************************************************************************
+#								Code fragment generators
+# ***************************************************************************************
+
+def _write(address,value):														# write, unless ROM
+	return [ "if {0} > 0x3FFF: mem[{0}] = {1}".format(address,value) ]
+
+def _fetch8(var = "n"):															# fetch byte operand
+	return [ "{0} = mem[cpu.pc]".format(var),"cpu.pc = (cpu.pc + 1) & 0xFFFF" ]
+
+def _fetch16(var = "nn"):														# fetch word operand
+	return [ "pc = cpu.pc","{0} = mem[pc] | (mem[(pc + 1) & 0xFFFF] << 8)".format(var),"cpu.pc = (pc + 2) & 0xFFFF" ]
+
+def _read16(address,var):														# read word from memory
+	return [ "{0} = mem[{1}] | (mem[({1} + 1) & 0xFFFF] << 8)".format(var,address) ]
+
+def _write16(address,value):													# write word to memory
+	return _write(address,"{0} & 0xFF".format(value)) + [ "a1 = ({0} + 1) & 0xFFFF".format(address) ] + \
+						_write("a1","{0} >> 8".format(value))
+
+def _push(value):
+	return [ "sp = (cpu.sp - 2) & 0xFFFF","cpu.sp = sp" ] + _write16("sp",value)
+
+def _pop(var):
+	return [ "sp = cpu.sp" ] + _read16("sp",var) + [ "cpu.sp = (sp + 2) & 0xFFFF" ]
+
+def _displacement(index):														# (IX+d) address => addr
+	return _fetch8("d") + [ "addr = (cpu.{0} + (d - 256 if d > 127 else d)) & 0xFFFF".format(index) ]
+
+def _getPair(pair,index = None):												# read a register pair
+	if pair == "hl" and index is not None:
+		return "cpu."+index
+	if pair == "sp" or pair == "ix" or pair == "iy":
+		return "cpu."+pair
+	return "((cpu.{0} << 8) | cpu.{1})".format(pair[0],pair[1])
+
+def _setPair(pair,value,index = None):											# write a register pair, value is a variable
+	if pair == "hl" and index is not None:
+		return [ "cpu.{0} = {1}".format(index,value) ]
+	if pair == "sp" or pair == "ix" or pair == "iy":
+		return [ "cpu.{0} = {1}".format(pair,value) ]
+	return [ "cpu.{0} = {2} >> 8".format(pair[0],pair[1],value),"cpu.{1} = {2} & 0xFF".format(pair[0],pair[1],value) ]
+
+def _getReg(r,index = None):													# read 8 bit register, not (HL)
+	if index is not None and (r == 4 or r == 5):
+		return "(cpu.{0} >> 8)".format(index) if r == 4 else "(cpu.{0} & 0xFF)".format(index)
+	return "cpu."+_REG8[r]
+
+def _setReg(r,value,index = None):												# write 8 bit register, not (HL)
+	if index is not None and (r == 4 or r == 5):
+		if r == 4:
+			return [ "cpu.{0} = (cpu.{0} & 0xFF) | ({1} << 8)".format(index,value) ]
+		return [ "cpu.{0} = (cpu.{0} & 0xFF00) | {1}".format(index,value) ]
+	return [ "cpu.{0} = {1}".format(_REG8[r],value) ]
+
+def _alu(op):																	# A = A <op> v
+	if op == 0 or op == 1:														# ADD ADC
+		carry = " + (cpu.f & 1)" if op == 1 else ""
+		return [ "a = cpu.a","r = a + v"+carry,"cpu.a = r & 0xFF",
+				 "cpu.f = SZXY[r & 0xFF] | ((a ^ v ^ r) & 0x10) | (r >> 8) | (((a ^ ~v) & (a ^ r) & 0x80) >> 5)" ]
+	if op == 2 or op == 3 or op == 7:											# SUB SBC CP
+		carry = " - (cpu.f & 1)" if op == 3 else ""
+		code = [ "a = cpu.a","r = a - v"+carry ]
+		flags = "((a ^ v ^ r) & 0x10) | ((r >> 8) & 1) | 0x02 | (((a ^ v) & (a ^ r) & 0x80) >> 5)"
+		if op == 7:
+			return code + [ "cpu.f = (SZXY[r & 0xFF] & 0xD7) | (v & 0x28) | "+flags ]
+		return code + [ "cpu.a = r & 0xFF","cpu.f = SZXY[r & 0xFF] | "+flags ]
+	operator = { 4:"&",5:"^",6:"|" }[op]										# AND XOR OR
+	return [ "a = cpu.a {0} v".format(operator),"cpu.a = a","cpu.f = SZXYP[a]"+(" | 0x10" if op == 4 else "") ]
+
+def _inc(dec):																	# r = v+1 or v-1, keep C
+	if dec:
+		return [ "r = (v - 1) & 0xFF","cpu.f = (cpu.f & 1) | 0x02 | SZXY[r] | (0x10 if (r & 0x0F) == 0x0F else 0) | (0x04 if r == 0x7F else 0)" ]
+	return [ "r = (v + 1) & 0xFF","cpu.f = (cpu.f & 1) | SZXY[r] | (0x10 if (r & 0x0F) == 0 else 0) | (0x04 if r == 0x80 else 0)" ]
+
+def _rotate(op):																# CB rotates/shifts v => r
+	code = [ [ "c = v >> 7","r = ((v << 1) | c) & 0xFF" ],
+			 [ "c = v & 1","r = (v >> 1) | (c << 7)" ],
+			 [ "c = v >> 7","r = ((v << 1) | (cpu.f & 1)) & 0xFF" ],
+			 [ "c = v & 1","r = (v >> 1) | ((cpu.f & 1) << 7)" ],
+			 [ "c = v >> 7","r = (v << 1) & 0xFF" ],
+			 [ "c = v & 1","r = (v >> 1) | (v & 0x80)" ],
+			 [ "c = v >> 7","r = ((v << 1) | 1) & 0xFF" ],
+			 [ "c = v & 1","r = v >> 1" ] ][op]
+	return code + [ "cpu.f = SZXYP[r] | c" ]
+
+def _bit(bit):																	# BIT n,v
+	return [ "t = v & {0}".format(1 << bit),
+			 "cpu.f = (cpu.f & 1) | 0x10 | (v & 0x28) | (0x44 if t == 0 else 0) | (t & 0x80)" ]
+
+def _add16(target,source,index = None):											# ADD HL,rr
+	return [ "h = "+_getPair(target,index),"v = "+_getPair(source,index),"r = h + v",
+			 "cpu.f = (cpu.f & 0xC4) | (((h ^ v ^ r) >> 8) & 0x10) | (r >> 16) | ((r >> 8) & 0x28)",
+			 "r = r & 0xFFFF" ] + _setPair(target,"r",index)
+
+def _function(lines,name):														# compile lines into a function
+	source = "def {0}(cpu):\n\tmem = cpu.mem\n".format(name) + "".join(["\t"+l.replace("\n","\n\t")+"\n" for l in lines])
+	space = { "SZXY":SZXY,"SZXYP":SZXYP }
+	exec(source,space)
+	return space[name]
+
+# ***************************************************************************************
+#						Build the unprefixed table, or DD/FD tables
+# ***************************************************************************************
+
+def _mainOpcode(op,index):
+	x,y,z = op >> 6,(op >> 3) & 7,op & 7
+	p,q = y >> 1,y & 1
+	pairs = [ "bc","de","hl","sp" ]
+	hlRef = index is not None
+	if x == 1:																	# LD r,r' and HALT
+		if op == 0x76:
+			return [ "cpu.halted = True","cpu.pc = (cpu.pc - 1) & 0xFFFF","return 4" ]
+		if z == 6:																# LD r,(HL)
+			address = _displacement(index) if hlRef else [ "addr = (cpu.h << 8) | cpu.l" ]
+			return address + _setReg(y,"mem[addr]") + [ "return {0}".format(19 if hlRef else 7) ]
+		if y == 6:																# LD (HL),r
+			address = _displacement(index) if hlRef else [ "addr = (cpu.h << 8) | cpu.l" ]
+			return address + _write("addr",_getReg(z)) + [ "return {0}".format(19 if hlRef else 7) ]
+		if hlRef and y not in [4,5] and z not in [4,5]:
+			return None
+		return [ "v = "+_getReg(z,index) ] + _setReg(y,"v",index) + [ "return {0}".format(8 if hlRef else 4) ]
+	if x == 2:																	# ALU A,r
+		if z == 6:
+			address = _displacement(index) if hlRef else [ "addr = (cpu.h << 8) | cpu.l" ]
+			return address + [ "v = mem[addr]" ] + _alu(y) + [ "return {0}".format(19 if hlRef else 7) ]
+		if hlRef and z not in [4,5]:
+			return None
+		return [ "v = "+_getReg(z,index) ] + _alu(y) + [ "return {0}".format(8 if hlRef else 4) ]
+	if x == 0:
+		if z == 0:
+			if y == 0:															# NOP
+				return None if hlRef else [ "return 4" ]
+			if hlRef:
+				return None
+			if y == 1:															# EX AF,AF'
+				return [ "cpu.a,cpu.a_ = cpu.a_,cpu.a","cpu.f,cpu.f_ = cpu.f_,cpu.f","return 4" ]
+			jump = [ "d = mem[cpu.pc]","cpu.pc = (cpu.pc + 1 + (d - 256 if d > 127 else d)) & 0xFFFF" ]
+			if y == 2:															# DJNZ
+				return [ "b = (cpu.b - 1) & 0xFF","cpu.b = b","if b == 0:","\tcpu.pc = (cpu.pc + 1) & 0xFFFF","\treturn 8" ] + jump + [ "return 13" ]
+			if y == 3:															# JR
+				return jump + [ "return 12" ]
+			return [ "if not ("+_CONDITIONS[y-4]+"):","\tcpu.pc = (cpu.pc + 1) & 0xFFFF","\treturn 7" ] + jump + [ "return 12" ]
+		if z == 1:
+			if q == 0:															# LD rr,nn
+				if hlRef and p != 2:
+					return None
+				return _fetch16() + _setPair(pairs[p],"nn",index) + [ "return {0}".format(14 if hlRef else 10) ]
+			if hlRef and p == 3:
+				return None
+			return _add16("hl",pairs[p],index) + [ "return {0}".format(15 if hlRef else 11) ]
+		if z == 2:
+			if hlRef and p != 2:
+				return None
+			if p == 0 or p == 1:												# LD (BC/DE),A LD A,(BC/DE)
+				address = "addr = " + _getPair(pairs[p])
+				if q == 0:
+					return [ address ] + _write("addr","cpu.a") + [ "return 7" ]
+				return [ address,"cpu.a = mem[addr]","return 7" ]
+			if p == 2:															# LD (nn),HL LD HL,(nn)
+				if q == 0:
+					return _fetch16() + [ "v = "+_getPair("hl",index) ] + _write16("nn","v") + [ "return {0}".format(20 if hlRef else 16) ]
+				return _fetch16() + _read16("nn","v") + _setPair("hl","v",index) + [ "return {0}".format(20 if hlRef else 16) ]
+			if q == 0:															# LD (nn),A LD A,(nn)
+				return _fetch16() + _write("nn","cpu.a") + [ "return 13" ]
+			return _fetch16() + [ "cpu.a = mem[nn]","return 13" ]
+		if z == 3:																# INC rr DEC rr
+			if hlRef and p != 2:
+				return None
+			return [ "v = ("+_getPair(pairs[p],index)+(" - 1" if q else " + 1")+") & 0xFFFF" ] + \
+								_setPair(pairs[p],"v",index) + [ "return {0}".format(10 if hlRef else 6) ]
+		if z == 4 or z == 5:													# INC r DEC r
+			if y == 6:
+				address = _displacement(index) if hlRef else [ "addr = (cpu.h << 8) | cpu.l" ]
+				return address + [ "v = mem[addr]" ] + _inc(z == 5) + _write("addr","r") + [ "return {0}".format(23 if hlRef else 11) ]
+			if hlRef and y not in [4,5]:
+				return None
+			return [ "v = "+_getReg(y,index) ] + _inc(z == 5) + _setReg(y,"r",index) + [ "return {0}".format(8 if hlRef else 4) ]
+		if z == 6:																# LD r,n
+			if y == 6:
+				address = _displacement(index) if hlRef else [ "addr = (cpu.h << 8) | cpu.l" ]
+				return address + _fetch8() + _write("addr","n") + [ "return {0}".format(19 if hlRef else 10) ]
+			if hlRef and y not in [4,5]:
+				return None
+			return _fetch8() + _setReg(y,"n",index) + [ "return {0}".format(11 if hlRef else 7) ]
+		if hlRef:
+			return None
+		return [ [ "a = cpu.a","c = a >> 7","a = ((a << 1) | c) & 0xFF" ],					# RLCA
+				 [ "a = cpu.a","c = a & 1","a = (a >> 1) | (c << 7)" ],						# RRCA
+				 [ "a = cpu.a","c = a >> 7","a = ((a << 1) | (cpu.f & 1)) & 0xFF" ],		# RLA
+				 [ "a = cpu.a","c = a & 1","a = (a >> 1) | ((cpu.f & 1) << 7)" ],			# RRA
+				 [ "a = cpu.a","f = cpu.f","corr = 0","c = f & 1",							# DAA
+				   "if (f & 0x10) or (a & 0x0F) > 9: corr = 6",
+				   "if c or a > 0x99:","\tcorr = corr | 0x60","\tc = 1",
+				   "if f & 0x02:","\th = 0x10 if (f & 0x10) and (a & 0x0F) < 6 else 0","\tr = (a - corr) & 0xFF",
+				   "else:","\th = 0x10 if (a & 0x0F) > 9 else 0","\tr = (a + corr) & 0xFF",
+				   "cpu.a = r","cpu.f = SZXYP[r] | h | (f & 0x02) | c","return 4" ],
+				 [ "a = cpu.a ^ 0xFF","cpu.a = a","cpu.f = (cpu.f & 0xC5) | (a & 0x28) | 0x12","return 4" ],	# CPL
+				 [ "cpu.f = (cpu.f & 0xC4) | (cpu.a & 0x28) | 1","return 4" ],				# SCF
+				 [ "f = cpu.f","cpu.f = ((f & 0xC5) | (cpu.a & 0x28) | ((f & 1) << 4)) ^ 1","return 4" ] ][y] + \
+				 ([ "cpu.a = a","cpu.f = (cpu.f & 0xC4) | (a & 0x28) | c","return 4" ] if y < 4 else [])
+	#
+	#		x == 3
+	#
+	if z == 0:																	# RET cc
+		return None if hlRef else [ "if not ("+_CONDITIONS[y]+"):","\treturn 5" ] + _pop("v") + [ "cpu.pc = v","return 11" ]
+	if z == 1:
+		if q == 0:																# POP rr
+			if hlRef and p != 2:
+				return None
+			if p == 3:
+				return _pop("v") + [ "cpu.a = v >> 8","cpu.f = v & 0xFF","return 10" ]
+			return _pop("v") + _setPair(pairs[p],"v",index) + [ "return {0}".format(14 if hlRef else 10) ]
+		if p == 0:																# RET
+			return None if hlRef else _pop("v") + [ "cpu.pc = v","return 10" ]
+		if p == 1:																# EXX
+			return None if hlRef else [ "cpu.b,cpu.b_ = cpu.b_,cpu.b","cpu.c,cpu.c_ = cpu.c_,cpu.c",
+						"cpu.d,cpu.d_ = cpu.d_,cpu.d","cpu.e,cpu.e_ = cpu.e_,cpu.e",
+						"cpu.h,cpu.h_ = cpu.h_,cpu.h","cpu.l,cpu.l_ = cpu.l_,cpu.l","return 4" ]
+		if p == 2:																# JP (HL)
+			return [ "cpu.pc = "+_getPair("hl",index),"return {0}".format(8 if hlRef else 4) ]
+		return [ "cpu.sp = "+_getPair("hl",index),"return {0}".format(10 if hlRef else 6) ]	# LD SP,HL
+	if z == 2:																	# JP cc,nn
+		return None if hlRef else _fetch16() + [ "if "+_CONDITIONS[y]+":","\tcpu.pc = nn","return 10" ]
+	if z == 3:
+		if hlRef and y != 4:
+			return None
+		if y == 0:																# JP nn
+			return _fetch16() + [ "cpu.pc = nn","return 10" ]
+		if y == 1:																# CB prefix
+			return None
+		if y == 2:																# OUT (n),A
+			return _fetch8() + [ "cpu.portOut((cpu.a << 8) | n,cpu.a)","return 11" ]
+		if y == 3:																# IN A,(n)
+			return _fetch8() + [ "cpu.a = cpu.portIn((cpu.a << 8) | n)","return 11" ]
+		if y == 4:																# EX (SP),HL
+			return [ "sp = cpu.sp" ] + _read16("sp","v") + [ "h = "+_getPair("hl",index) ] + _write16("sp","h") + \
+								_setPair("hl","v",index) + [ "return {0}".format(23 if hlRef else 19) ]
+		if y == 5:																# EX DE,HL
+			return [ "cpu.d,cpu.h = cpu.h,cpu.d","cpu.e,cpu.l = cpu.l,cpu.e","return 4" ]
+		if y == 6:																# DI
+			return [ "cpu.iff = 0","return 4" ]
+		return [ "cpu.iff = 1","return 4" ]										# EI
+	if z == 4:																	# CALL cc,nn
+		return None if hlRef else _fetch16() + [ "if not ("+_CONDITIONS[y]+"):","\treturn 10","v = cpu.pc" ] + \
+								_push("v") + [ "cpu.pc = nn","return 17" ]
+	if z == 5:
+		if q == 0:																# PUSH rr
+			if hlRef and p != 2:
+				return None
+			value = "(cpu.a << 8) | cpu.f" if p == 3 else _getPair(pairs[p],index)
+			return [ "v = "+value ] + _push("v") + [ "return {0}".format(15 if hlRef else 11) ]
+		if p == 0 and not hlRef:												# CALL nn
+			return _fetch16() + [ "v = cpu.pc" ] + _push("v") + [ "cpu.pc = nn","return 17" ]
+		return None																# prefixes
+	if z == 6:																	# ALU A,n
+		return None if hlRef else _fetch8("v") + _alu(y) + [ "return 7" ]
+	return None if hlRef else [ "v = cpu.pc" ] + _push("v") + [ "cpu.pc = {0}".format(y * 8),"return 11" ]	# RST
+
+# ***************************************************************************************
+#					CB prefix, and DD CB / FD CB prefix (index is not None)
+# ***************************************************************************************
+
+def _cbOpcode(op,index):
+	x,y,z = op >> 6,(op >> 3) & 7,op & 7
+	if index is None and z != 6:												# register operand
+		code = [ "v = "+_getReg(z) ]
+		store = lambda value: _setReg(z,value)
+		timing = (8,8)
+	else:																		# memory operand
+		code = [ "addr = cpu.addr" if index is not None else "addr = (cpu.h << 8) | cpu.l","v = mem[addr]" ]
+		store = lambda value: _write("addr",value) + (_setReg(z,value) if z != 6 else [])
+		timing = (20,23) if index is not None else (12,15)
+	if x == 0:
+		return code + _rotate(y) + store("r") + [ "return {0}".format(timing[1]) ]
+	if x == 1:
+		return code + _bit(y) + [ "return {0}".format(timing[0]) ]
+	mask = "v & {0}".format(0xFF ^ (1 << y)) if x == 2 else "v | {0}".format(1 << y)
+	return code + [ "r = "+mask ] + store("r") + [ "return {0}".format(timing[1]) ]
+
+# ***************************************************************************************
+#									ED prefix
+# ***************************************************************************************
+
+def _edOpcode(op):
+	x,y,z = op >> 6,(op >> 3) & 7,op & 7
+	p,q = y >> 1,y & 1
+	pairs = [ "bc","de","hl","sp" ]
+	if x == 1:
+		if z == 0:																# IN r,(C)
+			code = [ "v = cpu.portIn((cpu.b << 8) | cpu.c)","cpu.f = (cpu.f & 1) | SZXYP[v]" ]
+			return code + (_setReg(y,"v") if y != 6 else []) + [ "return 12" ]
+		if z == 1:																# OUT (C),r
+			return [ "cpu.portOut((cpu.b << 8) | cpu.c,{0})".format(_getReg(y) if y != 6 else "0"),"return 12" ]
+		if z == 2:																# SBC HL,rr ADC HL,rr
+			carry = "+ (cpu.f & 1)" if q else "- (cpu.f & 1)"
+			code = [ "h = (cpu.h << 8) | cpu.l","v = "+_getPair(pairs[p]),"r = h "+("+" if q else "-")+" v "+carry ]
+			if q:
+				overflow = "(((h ^ ~v) & (h ^ r) & 0x8000) >> 13)"
+			else:
+				overflow = "(((h ^ v) & (h ^ r) & 0x8000) >> 13) | 0x02"
+			return code + [ "cpu.f = ((r >> 8) & 0xA8) | (0x40 if (r & 0xFFFF) == 0 else 0) | (((h ^ v ^ r) >> 8) & 0x10) | ((r >> 16) & 1) | "+overflow,
+							"r = r & 0xFFFF","cpu.h = r >> 8","cpu.l = r & 0xFF","return 15" ]
+		if z == 3:																# LD (nn),rr LD rr,(nn)
+			if q == 0:
+				return _fetch16() + [ "v = "+_getPair(pairs[p]) ] + _write16("nn","v") + [ "return 20" ]
+			return _fetch16() + _read16("nn","v") + _setPair(pairs[p],"v") + [ "return 20" ]
+		if z == 4:																# NEG
+			return [ "v = cpu.a","cpu.a = 0" ] + _alu(2) + [ "return 8" ]
+		if z == 5:																# RETN RETI
+			return _pop("v") + [ "cpu.pc = v","return 14" ]
+		if z == 6:																# IM n
+			return [ "cpu.im = {0}".format([0,0,1,2,0,0,1,2][y]),"return 8" ]
+		return [ [ "cpu.i = cpu.a","return 9" ],								# LD I,A
+				 [ "cpu.r = cpu.a","cpu.rBase = cpu.cycles","return 9" ],		# LD R,A
+				 [ "cpu.a = cpu.i","cpu.f = (cpu.f & 1) | SZXY[cpu.a] | (cpu.iff << 2)","return 9" ],
+				 [ "cpu.a = cpu.getR()","cpu.f = (cpu.f & 1) | SZXY[cpu.a] | (cpu.iff << 2)","return 9" ],
+				 [ "addr = (cpu.h << 8) | cpu.l","v = mem[addr]","a = cpu.a" ] + _write("addr","((a << 4) | (v >> 4)) & 0xFF") +	# RRD
+						[ "a = (a & 0xF0) | (v & 0x0F)","cpu.a = a","cpu.f = (cpu.f & 1) | SZXYP[a]","return 18" ],
+				 [ "addr = (cpu.h << 8) | cpu.l","v = mem[addr]","a = cpu.a" ] + _write("addr","((v << 4) | (a & 0x0F)) & 0xFF") +	# RLD
+						[ "a = (a & 0xF0) | (v >> 4)","cpu.a = a","cpu.f = (cpu.f & 1) | SZXYP[a]","return 18" ],
+				 [ "return 8" ],[ "return 8" ] ][y]
+	if x == 2 and z <= 3 and y >= 4:											# block instructions
+		step = "1" if (y & 1) == 0 else "-1"
+		repeat = y >= 6
+		if z == 0:																# LDI LDD LDIR LDDR
+			body = [ "hl = (cpu.h << 8) | cpu.l","de = (cpu.d << 8) | cpu.e","bc = (cpu.b << 8) | cpu.c","t = 0",
+					 "while True:","\tv = mem[hl]" ] + ["\t"+l for l in _write("de","v")] + \
+					[ "\thl = (hl + {0}) & 0xFFFF".format(step),"\tde = (de + {0}) & 0xFFFF".format(step),
+					  "\tbc = (bc - 1) & 0xFFFF","\tt = t + 21" if repeat else "\tt = t + 16",
+					  "\tif bc == 0 or not {0}: break".format(repeat) ] + \
+					[ "cpu.h = hl >> 8","cpu.l = hl & 0xFF","cpu.d = de >> 8","cpu.e = de & 0xFF","cpu.b = bc >> 8","cpu.c = bc & 0xFF",
+					  "n = (v + cpu.a) & 0xFF",
+					  "cpu.f = (cpu.f & 0xC1) | (0x04 if bc != 0 else 0) | (n & 0x08) | ((n << 4) & 0x20)",
+					  "return t - 5" if repeat else "return t" ]
+			return body
+		if z == 1:																# CPI CPD CPIR CPDR
+			return [ "hl = (cpu.h << 8) | cpu.l","bc = (cpu.b << 8) | cpu.c","a = cpu.a","t = 0",
+					 "while True:","\tv = mem[hl]","\tr = (a - v) & 0xFF",
+					 "\thl = (hl + {0}) & 0xFFFF".format(step),"\tbc = (bc - 1) & 0xFFFF","\tt = t + 21" if repeat else "\tt = t + 16",
+					 "\tif bc == 0 or r == 0 or not {0}: break".format(repeat),
+					 "cpu.h = hl >> 8","cpu.l = hl & 0xFF","cpu.b = bc >> 8","cpu.c = bc & 0xFF",
+					 "hc = (a ^ v ^ r) & 0x10","n = (r - (hc >> 4)) & 0xFF",
+					 "cpu.f = (cpu.f & 1) | 0x02 | (SZXY[r] & 0xC0) | hc | (0x04 if bc != 0 else 0) | (n & 0x08) | ((n << 4) & 0x20)",
+					 "return t - 5" if repeat else "return t" ]
+		if z == 2:																# INI IND INIR INDR
+			return [ "hl = (cpu.h << 8) | cpu.l","t = 0",
+					 "while True:","\tv = cpu.portIn((cpu.b << 8) | cpu.c)" ] + ["\t"+l for l in _write("hl","v")] + \
+				   [ "\thl = (hl + {0}) & 0xFFFF".format(step),"\tcpu.b = (cpu.b - 1) & 0xFF","\tt = t + 21" if repeat else "\tt = t + 16",
+					 "\tif cpu.b == 0 or not {0}: break".format(repeat),
+					 "cpu.h = hl >> 8","cpu.l = hl & 0xFF","cpu.f = (cpu.f & 1) | 0x02 | SZXY[cpu.b]",
+					 "return t - 5" if repeat else "return t" ]
+		return [ "hl = (cpu.h << 8) | cpu.l","t = 0",							# OUTI OUTD OTIR OTDR
+				 "while True:","\tcpu.b = (cpu.b - 1) & 0xFF","\tcpu.portOut((cpu.b << 8) | cpu.c,mem[hl])",
+				 "\thl = (hl + {0}) & 0xFFFF".format(step),"\tt = t + 21" if repeat else "\tt = t + 16",
+				 "\tif cpu.b == 0 or not {0}: break".format(repeat),
+				 "cpu.h = hl >> 8","cpu.l = hl & 0xFF","cpu.f = (cpu.f & 1) | 0x02 | SZXY[cpu.b]",
+				 "return t - 5" if repeat else "return t" ]
+	#
+	#		ZX Next extended opcodes
+	#
+	next = {
+		0x23:[ "a = cpu.a","cpu.a = ((a << 4) | (a >> 4)) & 0xFF","return 8" ],							# SWAPNIB
+		0x24:[ "cpu.a = int('{:08b}'.format(cpu.a)[::-1],2)","return 8" ],								# MIRROR A
+		0x27:_fetch8("v") + [ "r = cpu.a & v","cpu.f = SZXYP[r] | 0x10","return 11" ],					# TEST n
+		0x30:[ "r = cpu.d * cpu.e","cpu.d = r >> 8","cpu.e = r & 0xFF","return 8" ],					# MUL D,E
+		0x31:[ "r = (((cpu.h << 8) | cpu.l) + cpu.a) & 0xFFFF","cpu.h = r >> 8","cpu.l = r & 0xFF","return 8" ],
+		0x32:[ "r = (((cpu.d << 8) | cpu.e) + cpu.a) & 0xFFFF","cpu.d = r >> 8","cpu.e = r & 0xFF","return 8" ],
+		0x33:[ "r = (((cpu.b << 8) | cpu.c) + cpu.a) & 0xFFFF","cpu.b = r >> 8","cpu.c = r & 0xFF","return 8" ],
+		0x34:_fetch16() + [ "r = (((cpu.h << 8) | cpu.l) + nn) & 0xFFFF","cpu.h = r >> 8","cpu.l = r & 0xFF","return 16" ],
+		0x35:_fetch16() + [ "r = (((cpu.d << 8) | cpu.e) + nn) & 0xFFFF","cpu.d = r >> 8","cpu.e = r & 0xFF","return 16" ],
+		0x36:_fetch16() + [ "r = (((cpu.b << 8) | cpu.c) + nn) & 0xFFFF","cpu.b = r >> 8","cpu.c = r & 0xFF","return 16" ],
+		0x8A:_fetch16() + [ "v = ((nn & 0xFF) << 8) | (nn >> 8)" ] + _push("v") + [ "return 23" ],		# PUSH nn (big endian)
+		0x91:_fetch8("r") + _fetch8("v") + [ "cpu.writeNextRegister(r,v)","return 20" ],				# NEXTREG n,n
+		0x92:_fetch8("r") + [ "cpu.writeNextRegister(r,cpu.a)","return 17" ],							# NEXTREG n,A
+		0x98:[ "v = cpu.portIn((cpu.b << 8) | cpu.c)","cpu.pc = (cpu.pc & 0xC000) | (v << 6)","return 13" ],	# JP (C)
+	}
+	for code,step,repeat in [ (0xA4,1,False),(0xAC,-1,False),(0xB4,1,True),(0xBC,-1,True) ]:		# LDIX LDDX LDIRX LDDRX
+		next[code] = [ "hl = (cpu.h << 8) | cpu.l","de = (cpu.d << 8) | cpu.e","bc = (cpu.b << 8) | cpu.c","t = 0",
+					   "while True:","\tv = mem[hl]","\tif v != cpu.a and de > 0x3FFF: mem[de] = v",
+					   "\thl = (hl + {0}) & 0xFFFF".format(step),"\tde = (de + 1) & 0xFFFF","\tbc = (bc - 1) & 0xFFFF",
+					   "\tt = t + 21" if repeat else "\tt = t + 16","\tif bc == 0 or not {0}: break".format(repeat),
+					   "cpu.h = hl >> 8","cpu.l = hl & 0xFF","cpu.d = de >> 8","cpu.e = de & 0xFF","cpu.b = bc >> 8","cpu.c = bc & 0xFF",
+					   "return t - 5" if repeat else "return t" ]
+	return next[op] if op in next else [ "return 8" ]							# others are NOPs
+
+# ***************************************************************************************
+#								Build dispatch tables
+# ***************************************************************************************
+
+def _buildTables():
+	tables = {}
+	tables["cb"] = [_function(_cbOpcode(op,None),"cb{0:02x}".format(op)) for op in range(0,256)]
+	tables["xcb"] = [_function(_cbOpcode(op,"index"),"xcb{0:02x}".format(op)) for op in range(0,256)]
+	tables["ed"] = [_function(_edOpcode(op),"ed{0:02x}".format(op)) for op in range(0,256)]
+	main = []
+	for op in range(0,256):
+		code = _mainOpcode(op,None)
+		if op == 0xCB:
+			code = [ "op = mem[cpu.pc]","cpu.pc = (cpu.pc + 1) & 0xFFFF","return cpu.cbTable[op](cpu)" ]
+		if op == 0xED:
+			code = [ "op = mem[cpu.pc]","cpu.pc = (cpu.pc + 1) & 0xFFFF","return cpu.edTable[op](cpu)" ]
+		if op == 0xDD or op == 0xFD:
+			table = "ddTable" if op == 0xDD else "fdTable"
+			code = [ "op = mem[cpu.pc]","cpu.pc = (cpu.pc + 1) & 0xFFFF","return cpu.{0}[op](cpu)".format(table) ]
+		main.append(_function(code,"op{0:02x}".format(op)))
+	tables["main"] = main
+	for index,prefix in [ ("ix","dd"),("iy","fd") ]:
+		table = []
+		for op in range(0,256):
+			code = _mainOpcode(op,index)
+			if op == 0xCB:														# DD CB d op
+				code = _displacement(index) + [ "cpu.addr = addr","op = mem[cpu.pc]","cpu.pc = (cpu.pc + 1) & 0xFFFF",
+												"cpu.index = '"+index+"'","return cpu.xcbTable[op](cpu)" ]
+			if op == 0x01 and index == "ix":									# DD 01 is CSpect's breakpoint
+				code = [ "cpu.breakpoints = cpu.breakpoints + 1","return 8" ]
+			if code is None:													# prefix ignored
+				table.append(_prefixed(main[op]))
+			else:
+				table.append(_function(code,"{0}{1:02x}".format(prefix,op)))
+		tables[prefix] = table
+	return tables
+
+def _prefixed(function):
+	return lambda cpu: function(cpu) + 4
+
+_TABLES = _buildTables()
+
+# ***************************************************************************************
+#										Emulator
+# ***************************************************************************************
+
+class Z80Emulator(object):
+	STACKTOP = 0x5FFE 															# as kernel.asm
+	def __init__(self):
+		self.mem = bytearray(0x10000) 											# what the Z80 sees
+		self.physical = bytearray(0x100 * 0x2000) 								# 2Mb of 8k pages
+		self.mainTable = _TABLES["main"]
+		self.cbTable = _TABLES["cb"]
+		self.edTable = _TABLES["ed"]
+		self.ddTable = _TABLES["dd"]
+		self.fdTable = _TABLES["fd"]
+		self.xcbTable = _TABLES["xcb"]
+		self.reset()
+	#
+	#		Reset the processor and paging.
+	#
+	def reset(self):
+		self.a = self.f = self.b = self.c = self.d = self.e = self.h = self.l = 0
+		self.a_ = self.f_ = self.b_ = self.c_ = self.d_ = self.e_ = self.h_ = self.l_ = 0
+		self.ix = self.iy = 0
+		self.sp = 0xFFFF
+		self.pc = 0
+		self.i = self.r = self.rBase = self.im = self.iff = 0
+		self.addr = 0
+		self.cycles = 0
+		self.halted = False
+		self.breakpoints = 0
+		self.nextRegisters = [0] * 256
+		self.selectedRegister = 0
+		self.border = 0
+		self.layer2 = 0
+		self.mmu = [ 0xFF,0xFF,10,11,4,5,0,1 ] 									# standard Next mapping
+		for slot in range(2,8):
+			self.nextRegisters[0x50+slot] = self.mmu[slot]
+	#
+	#		Load a boot image. $8000-$BFFF goes in pages 4/5, the rest in pages $20 on.
+	#
+	def loadImage(self,image):
+		data = image.getBytes()
+		self.physical[4*0x2000:4*0x2000+min(len(data),0x4000)] = data[:0x4000]
+		if len(data) > 0x4000:
+			start = 0x20*0x2000
+			self.physical[start:start+len(data)-0x4000] = data[0x4000:]
+		for slot in range(0,8):													# refresh what is visible
+			self.mapSlot(slot,self.mmu[slot],False)
+		self.sysInfo = image.getSysInfo()
+	#
+	#		Get the start address and page from system information.
+	#
+	def getStartAddress(self):
+		return self.readWord(self.sysInfo+12),self.mem[self.sysInfo+14]
+	#
+	#		Run from the system information start address, as the kernel would after
+	#		initialising. Returns T-states taken.
+	#
+	def run(self,maxCycles = None):
+		address,page = self.getStartAddress()
+		self.sp = Z80Emulator.STACKTOP
+		self.writeNextRegister(0x56,page)
+		self.writeNextRegister(0x57,page+1)
+		self.a_ = page
+		self.pc = address
+		return self.execute(maxCycles)
+	#
+	#		Boot from $8000, running the kernel initialisation. Returns T-states taken.
+	#
+	def boot(self,maxCycles = None):
+		self.pc = 0x8000
+		return self.execute(maxCycles)
+	#
+	#		Call a routine, returning when it does. Returns T-states taken.
+	#
+	def call(self,address,maxCycles = None):
+		self.sp = (self.sp - 2) & 0xFFFF
+		self.writeWord(self.sp,0x0000) 											# return to $0000 (ROM)
+		self.pc = address
+		return self.execute(maxCycles,0x0000)
+	#
+	#		Execute until halted, maxCycles reached or PC reaches stopAddress. A jump
+	#		to itself (JR $ or JP $) or a HALT counts as halting.
+	#
+	def execute(self,maxCycles = None,stopAddress = -1):
+		mem = self.mem
+		table = self.mainTable
+		start = self.cycles
+		cycles = start
+		limit = start + maxCycles if maxCycles is not None else 1 << 62
+		self.halted = False
+		while cycles < limit:
+			pc = self.pc
+			if pc == stopAddress:
+				break
+			self.pc = (pc + 1) & 0xFFFF
+			cycles += table[mem[pc]](self)
+			if self.pc == pc and self.isHalt(pc):
+				self.halted = True
+				break
+		self.cycles = cycles
+		return cycles - start
+	#
+	#		Check if the instruction at pc is a halt or jump to itself
+	#
+	def isHalt(self,pc):
+		op = self.mem[pc]
+		return op == 0x76 or op == 0x18 or op == 0xC3
+	#
+	#		Read R. Approximated from the T-states run since it was set.
+	#
+	def getR(self):
+		return (self.r & 0x80) | ((self.r + (self.cycles - self.rBase) // 4) & 0x7F)
+	#
+	#		Memory access helpers
+	#
+	def readWord(self,address):
+		return self.mem[address] | (self.mem[(address+1) & 0xFFFF] << 8)
+	def writeWord(self,address,data):
+		self.mem[address] = data & 0xFF
+		self.mem[(address+1) & 0xFFFF] = data >> 8
+	#
+	#		Map 8k page into an 8k slot. The old page contents are saved first.
+	#
+	def mapSlot(self,slot,page,save = True):
+		base = slot * 0x2000
+		if save and self.mmu[slot] != 0xFF:										# save current unless ROM
+			old = self.mmu[slot] * 0x2000
+			self.physical[old:old+0x2000] = self.mem[base:base+0x2000]
+		self.mmu[slot] = page
+		if page == 0xFF:														# ROM, which is empty
+			self.mem[base:base+0x2000] = bytes(0x2000)
+		else:
+			self.mem[base:base+0x2000] = self.physical[page*0x2000:page*0x2000+0x2000]
+	#
+	#		Write to a Next register.
+	#
+	def writeNextRegister(self,register,value):
+		self.nextRegisters[register] = value
+		if register >= 0x50 and register <= 0x57:								# MMU paging.
+			self.mapSlot(register - 0x50,value)
+	#
+	#		I/O ports
+	#
+	def portIn(self,port):
+		if port == 0x253B:														# Next register read
+			return self.nextRegisters[self.selectedRegister]
+		if (port & 0xFF) == 0xFE:												# keyboard, nothing pressed.
+			return 0xFF
+		return 0xFF
+	def portOut(self,port,value):
+		if port == 0x243B:														# Next register select
+			self.selectedRegister = value
+		elif port == 0x253B:													# Next register write
+			self.writeNextRegister(self.selectedRegister,value)
+		elif port == 0x123B:													# Layer 2 control
+			self.layer2 = value
+		elif (port & 0xFF) == 0xFE:												# border
+			self.border = value & 7
+	#
+	#		Get a page's contents, whether mapped in or not.
+	#
+	def readPhysical(self,page,offset):
+		for slot in range(0,8):
+			if self.mmu[slot] == page:
+				return self.mem[slot*0x2000+offset]
+		return self.physical[page*0x2000+offset]
+
+if __name__ == "__main__":
+	import time
+	from imagelib import *
+	image = BootImage("../libraries/standard.lib")
+	cpu = Z80Emulator()
+	cpu.loadImage(image)
+	t = time.time()
+	cycles = cpu.boot()
+	t = time.time()-t
+	print("Booted in {0} T-states ({1:.2f}s), halted at ${2:04x}".format(cycles,t,cpu.pc))
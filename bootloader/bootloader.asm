@@ -6,12 +6,15 @@
 ;		Date : 		28th December 2018
 ;		Purpose :	Boot-Loads code by loading "boot.img" into memory
 ;					from $8000-$BFFF then banks 32-94 (2 per page) into $C000-$FFFF
+;					stopping at the end page in sys.info +6 if it is set.
+;					If there is a compressed "boot.imz" that is loaded instead.
 ;
 ; ***************************************************************************************
 ; ***************************************************************************************
 
 FirstPage = 32 												; these are the pages for an 
 LastPage = 95 												; unexpanded ZXNext.
+CompressBuffer = $6000 										; compressed blocks read here, to $7CFF
 
 		org 	$4000-27
 		db 		$3F
@@ -22,12 +25,19 @@ LastPage = 95 												; unexpanded ZXNext.
 		db 		7
 
 		org 	$5AFE
-		dw 		$7F00	
+		dw 		Start
 
-		org 	$7F00 							
+		org 	$7E00 							
 
 Start:	ld 		sp,Start-1 									; set up the stack.
 		;db 	$DD,$01
+		call 	FindDefaultDrive 							; compressed image if there is one
+		ld 		ix,CompressedImageName
+		call 	OpenFileRead
+		jr 		c,__StartRaw
+		call 	ReadCompressedMemory
+		jp 		$8000 										; run.
+__StartRaw:
 		ld 		ix,ImageName 								; read the image into memory
 		call 	ReadNextMemory
 		jp	 	$8000 										; run.
@@ -56,16 +66,28 @@ ReadNextMemory:
 		call 	OpenFileRead 								; open for reading
 		ld 		ix,$8000 									; read in 8000-BFFF
 		call 	Read16kBlock
+		ld 		hl,($8004) 									; get end page from sys.info +6
+		ld 		de,6
+		add 	hl,de
+		ld 		a,(hl)
+		or 		a 											; if zero, not known, read all.
+		jr 		nz,__ReadEndKnown
+		ld 		a,LastPage+1
+__ReadEndKnown:
+		ld 		c,a 										; C = end page
 		ld 		b,FirstPage 								; current page
 __ReadBlockLoop:
+		ld 		a,c 										; reached the end page ?
+		cp 		b
+		jr 		z,__ReadBlockExit
+		jr 		c,__ReadBlockExit
 		call 	SetPaging 									; access the pages
 		ld 		ix,$C000 									; read in C000-FFFF
 		call 	Read16kBlock 								; read it in
 		inc 	b 											; there are two 8k blocks
 		inc 	b 											; per page
-		ld 		a,b
-		cp 		LastPage+1 									; until read in pages 32-95
-		jr 		nz,__ReadBlockLoop
+		jr 		__ReadBlockLoop
+__ReadBlockExit:
 		call 	CloseFile 									; close file.
 		ret
 
@@ -90,8 +112,7 @@ SetPaging:
 ; ***************************************************************************************
 
 OpenFileRead:
-		push 	af
-		push 	bc
+		push 	bc 											; carry set on error
 		push 	ix
 		ld 		b,1
 __OpenFile:
@@ -101,7 +122,6 @@ __OpenFile:
 		ld 		(FileHandle),a 
 		pop 	ix
 		pop 	bc
-		pop 	af
 		ret
 
 ; ***************************************************************************************
@@ -111,11 +131,17 @@ __OpenFile:
 ; ***************************************************************************************
 
 Read16kBlock:
+		push 	bc
+		ld 		bc,$4000
+		call 	ReadBlock
+		pop 	bc
+		ret
+
+ReadBlock: 													; read BC bytes to IX
 		push 	af
 		push 	bc
 		push 	ix
 		ld 		a,(FileHandle)
-		ld 		bc,$4000
 		rst 	$08
 		db 		$9D
 		pop 	ix
@@ -123,6 +149,119 @@ Read16kBlock:
 		pop 	af
 		ret
 
+; ***************************************************************************************
+;
+;		Read compressed image, already open, $8000-$BFFF then pages from $C000-$FFFF
+;
+; ***************************************************************************************
+
+ReadCompressedMemory:
+		ld 		ix,$8000 									; read in 8000-BFFF
+		call 	ReadCompressedBlock
+		ld 		b,FirstPage 								; current page
+__RCMLoop:
+		call 	SetPaging 									; access the pages
+		ld 		ix,$C000 									; read in C000-FFFF
+		call 	ReadCompressedBlock
+		jr 		c,__RCMExit 								; until the end marker
+		inc 	b 											; there are two 8k blocks
+		inc 	b 											; per page
+		jr 		__RCMLoop
+__RCMExit:
+		call 	CloseFile 									; close file.
+		ret
+
+; ***************************************************************************************
+;
+;		Read a compressed block to IX. A length of $0000 is 16k raw, $FFFF the end,
+;		when carry is set.
+;
+; ***************************************************************************************
+
+ReadCompressedBlock:
+		push 	bc
+		push 	ix
+		ld 		ix,BlockLength 								; read the length
+		ld 		bc,2
+		call 	ReadBlock
+		pop 	ix
+		ld 		hl,(BlockLength)
+		ld 		a,h 										; $FFFF is the end
+		and 	l
+		inc 	a
+		scf
+		jr 		z,__RCBExit
+		ld 		a,h 										; $0000 is 16k raw
+		or 		l
+		jr 		nz,__RCBCompressed
+		call 	Read16kBlock
+		jr 		__RCBOkay
+__RCBCompressed:
+		push 	ix 											; read it into the buffer
+		ld 		ix,CompressBuffer
+		ld 		b,h
+		ld 		c,l
+		call 	ReadBlock
+		pop 	de 											; and decompress into place
+		ld 		hl,CompressBuffer
+		call 	Decompress
+__RCBOkay:
+		xor 	a 											; clear carry
+__RCBExit:
+		pop 	bc
+		ret
+
+; ***************************************************************************************
+;
+;		Decompress HL to DE. Tokens are $00 end, $01-$7F literals, $80-$BF run of
+;		(n & $3F)+2 bytes, $C0-$FF copy (n & $3F)+3 bytes from a distance back.
+;
+; ***************************************************************************************
+
+Decompress:
+		ld 		a,(hl) 										; get token
+		inc 	hl
+		or 		a 											; zero, end of block
+		ret 	z
+		cp 		$80
+		jr 		nc,__DCNotLiteral
+		ld 		c,a 										; copy literals
+		ld 		b,0
+		ldir
+		jr 		Decompress
+__DCNotLiteral:
+		cp 		$C0
+		jr 		nc,__DCCopy
+		and 	$3F 										; run of one byte
+		add 	a,2
+		ld 		b,a
+		ld 		a,(hl)
+		inc 	hl
+__DCRun:
+		ld 		(de),a
+		inc 	de
+		djnz 	__DCRun
+		jr 		Decompress
+__DCCopy:
+		and 	$3F 										; BC = count
+		add 	a,3
+		ld 		c,a
+		ld 		b,0
+		ld 		a,(hl) 										; HL = distance
+		inc 	hl
+		push 	hl
+		ld 		h,(hl)
+		ld 		l,a
+		ex 		de,hl 										; HL = DE - distance
+		push 	hl
+		or 		a
+		sbc 	hl,de
+		pop 	de
+		ldir 												; copy it
+		pop 	hl 											; skip distance
+		inc 	hl
+		jr 		Decompress
+
 ; ***************************************************************************************
 ;
 ;										Close open file
@@ -142,6 +281,12 @@ DefaultDrive:
 		db 		0
 FileHandle:
 		db 		0
+BlockLength:
+		dw 		0
+
+		org 	$7FE0
+CompressedImageName:
+		db 		"boot.imz",0
 
 		org 	$7FF0
 ImageName:
@@ -0,0 +1,71 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		loadbench.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th October 2026
+#		Purpose :	Compares boot load times of raw and compressed images.
+#
+#					loadbench.py <boot image> [<bytes per second read>]
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import sys,io
+sys.path.insert(0,"../assembler")
+sys.path.insert(0,"../scripts")
+from imagelib import *
+from compressor import *
+from z80emulator import *
+from labels import *
+
+# ***************************************************************************************
+#		Reading is timed from the number of bytes read from the SD card, decompression
+#		by running the boot loader's Decompress in the emulator at 3.5Mhz.
+# ***************************************************************************************
+
+class LoadBenchmark(object):
+	CLOCK = 3500000
+	def __init__(self,readRate = 200 * 1024):
+		self.readRate = readRate
+		self.cpu = Z80Emulator()
+		sna = open("bootloader.sna","rb").read()
+		self.cpu.mem[0x4000:0x10000] = sna[27:27+0xC000]						# 48k snapshot
+		labels = ZasmLabelExtractor("bootloader.lst").getLabels()
+		self.decompress = labels["decompress"]
+		self.buffer = labels["compressbuffer"]
+	#
+	#		Time to load a raw image in seconds, reads stop at the end of the file.
+	#
+	def raw(self,image):
+		return len(image.getBytes()) / self.readRate
+	#
+	#		Time to load a compressed image in seconds, and its size.
+	#
+	def compressed(self,image):
+		h = io.BytesIO()
+		image.writeCompressed(h)
+		data = h.getvalue()
+		cycles = 0
+		p = 0
+		while data[p] + data[p+1] * 256 != 0xFFFF:								# decompress each block
+			size = data[p] + data[p+1] * 256
+			p += 2
+			if size == 0:
+				p += 0x4000
+			else:
+				self.cpu.mem[self.buffer:self.buffer+size] = data[p:p+size]
+				self.cpu.h,self.cpu.l = self.buffer >> 8,self.buffer & 0xFF
+				self.cpu.d,self.cpu.e = 0xC0,0x00
+				self.cpu.sp = 0x5FFE
+				cycles += self.cpu.call(self.decompress)
+				p += size
+		return len(data) / self.readRate + cycles / LoadBenchmark.CLOCK,len(data)
+
+if __name__ == "__main__":
+	image = BootImage(sys.argv[1])
+	bench = LoadBenchmark(*[int(a) for a in sys.argv[2:3]])
+	raw = bench.raw(image)
+	packed,size = bench.compressed(image)
+	print("Raw        {0:8} bytes {1:8.3f}s".format(len(image.getBytes()),raw))
+	print("Compressed {0:8} bytes {1:8.3f}s".format(size,packed))
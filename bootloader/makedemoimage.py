@@ -4,12 +4,15 @@
 #		Name : 		makerandomimage.py
 #		Author :	Paul Robson (paul@robsons.org.uk)
 #		Date : 		7th December 2018
-#		Purpose :	Creates a dummy boot.img which has BRK at $8000
+#		Purpose :	Creates a dummy boot.img which has BRK at $8000, and a sys.info
+#					whose end page (+6) says there are no code pages to load.
 #
 # ***************************************************************************************
 # ***************************************************************************************
 
-memory = [0xDD,0x01]
+memory = [0xDD,0x01,0x18,0xFE]						# BRK ; JR $
+memory += [0x08,0x80,0x00,0x00] 					# $8004 address of sys.info
+memory += [0x00] * 6 + [0x20,0x00] 					# $8008 sys.info, end page +6 is $20
 h = open("boot.img","wb")							# write out the dummy boot image file
 h.write(bytes(memory))
 h.close()
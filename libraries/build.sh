@@ -1,5 +1,11 @@
 python makekernel.py core console
-zasm -buw library.asm -o standard.lib -l standard.lst
+status=$?
+if [ $status -eq 0 ]
+then
+	zasm -buw library.asm -o standard.lib -l standard.lst || exit 1
+elif [ $status -ne 3 ]
+then
+	exit $status
+fi
+python ../scripts/labels.py standard.lst || exit 1
 cp *.lib ../files
-
-
@@ -22,13 +22,17 @@ Here:												; +0 	Here
 HerePage: 											; +2	Here.Page
 		db 		FirstCodePage,0
 NextFreePage: 										; +4 	Next available code page (2 8k pages/page)
-		db 		FirstCodePage+2,0,0,0
+		db 		FirstCodePage+2,0
+ImageEndPage: 										; +6 	Code pages in image end here (0 if not known)
+		db 		0,0
 DisplayInfo: 										; +8 	Display information
 		dw 		DisplayInformation,0		
 StartAddress: 										; +12 	Start Address
 		dw 		__KernelHalt
 StartAddressPage: 									; +14 	Start Page
 		db 		FirstCodePage,0
+WordTableAddress: 									; +16 	Word table (0 if none)
+		dw 		WordTable,0
 
 ; ***************************************************************************************
 ;
@@ -37,5 +37,79 @@ Boot:	db 		$DD,$01
 __KernelHalt: 										; if boot address not set.
 		jr 		__KernelHalt
 
+; ***************************************************************************************
+;
+;		Find the word named by the ASCIIZ string at HL using the word table.
+;		Returns HL = code address, A = parameter count, carry clear if found,
+;		carry set if not found.
+;
+; ***************************************************************************************
+
+KernelFindWord:
+		push 	bc
+		push 	de
+		ex 		de,hl 								; DE = name
+		ld 		hl,WordTable 						; HL = seed
+		ld 		c,(hl) 								; C = hash, starts as seed
+		push 	de
+__KFWHash:
+		ld 		a,(de) 								; next character
+		or 		a
+		jr 		z,__KFWHashed
+		xor 	(hl) 								; B = character xor seed
+		ld 		b,a
+		ld 		a,c 								; hash rotated left 3, add B
+		rlca
+		rlca
+		rlca
+		add 	a,b
+		ld 		c,a
+		inc 	de
+		jr 		__KFWHash
+__KFWHashed:
+		pop 	de 									; DE = name again
+		inc 	hl 									; and hash with the mask
+		ld 		a,(hl)
+		and 	c
+		inc 	hl 									; HL = first slot
+		ld 		c,a 								; add slot number * 2
+		ld 		b,0
+		add 	hl,bc
+		add 	hl,bc
+		ld 		a,(hl) 								; HL = link record in slot
+		inc 	hl
+		ld 		h,(hl)
+		ld 		l,a
+		or 		h 									; empty slot, not found
+		jr 		z,__KFWFail
+		inc 	hl 									; skip link to the name
+		inc 	hl
+__KFWCompare:
+		ld 		a,(hl) 								; name ends with parameter count
+		cp 		32
+		jr 		c,__KFWEndName
+		ld 		b,a 								; compare characters
+		ld 		a,(de)
+		cp 		b
+		jr 		nz,__KFWFail
+		inc 	hl
+		inc 	de
+		jr 		__KFWCompare
+__KFWEndName:
+		ld 		b,a 								; B = parameter count
+		ld 		a,(de) 								; must be the end of the name too.
+		or 		a 									; (clears carry)
+		jr 		nz,__KFWFail
+		inc 	hl 									; HL = code address
+		ld 		a,b 								; A = parameter count
+		pop 	de
+		pop 	bc
+		ret
+__KFWFail:
+		scf
+		pop 	de
+		pop 	bc
+		ret
+
 AlternateFont:										; nicer font
 		include "font.inc" 							; can be $3D00 here to save memory
@@ -7,35 +7,283 @@
 #		Purpose :	Builds assembly language file from composite library parts
 #					Also has an internal linked list.
 #
+#					makekernel.py [-w <word file>] <library> <library> ...
+#
+#					If a word file (one word per line) is given only those words, and
+#					the code they need, are included.
+#
+#					The output is only rebuilt if something it is made from has changed.
+#					Exits with 0 if the library needs assembling, 3 (BuildManifest.UPTODATE)
+#					if it is up to date. Any other status is an error.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import sys,os,re,hashlib,json
+
+# ***************************************************************************************
+#		Library source is split into blocks, each starting at an @word or a label that
+#		does not start with an underscore. A block needs the blocks with labels it
+#		refers to, and the block after it if it can run into it.
+# ***************************************************************************************
+
+class LibraryBlock(object):
+	def __init__(self,fileName,word = None):
+		self.fileName = fileName
+		self.word = word 														# (name,parameter count) or None
+		self.comments = [] 														# lines before it, not part of it
+		self.lines = []
+		self.labels = []
+		self.next = None 														# block it may run into
+	#
+	#		Add a line of source
+	#
+	def addLine(self,line):
+		self.lines.append(line)
+		m = re.match("^([A-Za-z_][A-Za-z0-9_]*)\:",line)
+		if m is not None:
+			self.labels.append(m.group(1).lower())
+	#
+	#		Get identifiers used in the code, comments and strings removed.
+	#
+	def getReferences(self):
+		refs = set()
+		for l in self.lines:
+			code = re.sub("\".*?\"|\'.\'","",l.split(";")[0])
+			code = re.sub("^[A-Za-z_][A-Za-z0-9_]*\:","",code)
+			refs.update([r.lower() for r in re.findall("[A-Za-z_][A-Za-z0-9_]*",code)])
+		return refs
+	#
+	#		Get the instructions and directives, labels and comments removed.
+	#
+	def getCode(self):
+		code = [l.split(";")[0].strip().lower() for l in self.lines]
+		code = [re.sub("^[a-z0-9_]+\:","",c).strip() for c in code]
+		return [c for c in code if c != ""]
+	def hasCode(self):
+		return len(self.getCode()) > 0 or len(self.labels) > 0
+	#
+	#		Check if the last instruction can run on into the next block.
+	#
+	def fallsThrough(self):
+		code = self.getCode()
+		if len(code) == 0:
+			return True
+		last = re.split("\s+",code[-1])
+		if last[0] == "ret" and len(last) == 1:
+			return False
+		return not ((last[0] == "jp" or last[0] == "jr") and len(last) == 2 and last[1].find(",") < 0)
+
+# ***************************************************************************************
+#								Kernel source builder
+# ***************************************************************************************
+
+class KernelBuilder(object):
+	def __init__(self,libraries,sourceDirectory = "lib.source",commonDirectory = "common"):
+		self.blocks = []
+		for libs in libraries:													# work through all libs
+			print("\tImporting from library "+libs)
+			for root,dirs,files in os.walk(sourceDirectory+os.sep+libs):		# work through all files
+				for f in files:
+					print("\t\t\tImporting file "+f)
+					self.importFile(root+os.sep+f)
+		self.labels = {}
+		for b in self.blocks:
+			for l in b.labels:
+				self.labels[l] = b
+		self.commonReferences = set() 											# used by kernel and data
+		for f in os.listdir(commonDirectory):
+			if f.endswith(".asm"):
+				block = LibraryBlock(f)
+				for l in open(commonDirectory+os.sep+f).readlines():
+					block.addLine(l.rstrip())
+				self.commonReferences.update(block.getReferences())
+	#
+	#		Split a file into blocks
+	#
+	def importFile(self,fileName):
+		block = LibraryBlock(fileName)
+		for l in open(fileName).readlines():
+			l = l.rstrip()
+			m = None
+			if l.startswith("@word"):											# if found @word
+				m = re.match("\@word\s*(.*)\((.*)\)\s*$",l.lower())				# break it up
+				assert m is not None,"Bad line "+l
+				pc = len([x for x in m.group(2).split(",") if x != ""])			# work out # of params
+				m = LibraryBlock(fileName,(m.group(1),pc))
+			elif re.match("^[A-Za-z][A-Za-z0-9_]*\:",l):						# global label
+				m = LibraryBlock(fileName)
+			if m is not None:
+				if block.word is not None or block.hasCode():
+					self.blocks.append(block)
+					block.next = m
+				else:															# comments go with what follows
+					m.comments = block.comments + block.lines
+				block = m
+			if not l.startswith("@word"):
+				block.addLine(l)
+		self.blocks.append(block)
+	#
+	#		Get the words available
+	#
+	def getWords(self):
+		return [b.word[0] for b in self.blocks if b.word is not None]
+	#
+	#		Get the blocks needed for a list of words, None is all of them.
+	#
+	def selectBlocks(self,words = None):
+		if words is None:
+			return self.blocks
+		available = set(self.getWords())
+		for w in words:
+			if w not in available:
+				raise Exception("Library word "+w+" not found")
+		pending = [b for b in self.blocks if b.word is not None and b.word[0] in words]
+		pending += [self.labels[r] for r in self.commonReferences if r in self.labels]
+		needed = set()
+		while len(pending) > 0:
+			b = pending.pop()
+			if b not in needed:
+				needed.add(b)
+				pending += [self.labels[r] for r in b.getReferences() if r in self.labels]
+				if b.next is not None and b.fallsThrough():
+					pending.append(b.next)
+		return [b for b in self.blocks if b in needed]
+	#
+	#		Write the source for the blocks, with the dictionary linked list.
+	#
+	def write(self,fileName,blocks):
+		hOut = open(fileName,"w")												# output file
+		wordCount = 0															# used to name labels
+		for b in blocks:
+			for l in b.comments:
+				hOut.write(l+"\n")
+			if b.word is not None:
+				if wordCount == 0:
+					hOut.write("linkHeader:\n")
+				hOut.write("link{0}:\n".format(wordCount))						# put link to NEXT entry.
+				hOut.write("    dw link{0}-link{1}\n".format(wordCount+1,wordCount))
+				hOut.write(" 	db \"{0}\",{1}\n".format(b.word[0],b.word[1])) 	# that ends the string
+				wordCount += 1
+			for l in b.lines:
+				hOut.write(l+"\n")
+		if wordCount == 0:
+			hOut.write("linkHeader:\n")
+		hOut.write("link{0}:\n".format(wordCount))								# write the last null link.
+		hOut.write("    dw 0\n")
+		self.writeWordTable(hOut,[b.word[0] for b in blocks if b.word is not None])
+		hOut.close()
+		return wordCount
+	#
+	#		Write a perfect hash table of the words. This is the seed, the mask (slots-1)
+	#		and the address of each word's link record, or 0 for an empty slot.
+	#
+	def writeWordTable(self,hOut,words):
+		seed,slots = self.createWordTable(words)
+		table = ["0"] * slots
+		for i in range(0,len(words)):
+			table[hashWord(seed,words[i]) & (slots-1)] = "link{0}".format(i)
+		hOut.write("WordTable:\n")
+		hOut.write("    db {0},{1}\n".format(seed,slots-1))
+		for i in range(0,slots,8):
+			hOut.write("    dw {0}\n".format(",".join(table[i:i+8])))
+	#
+	#		Find a seed and number of slots (a power of 2) where no words collide.
+	#
+	def createWordTable(self,words):
+		slots = 1
+		while slots < len(words):
+			slots = slots * 2
+		while slots <= 256:
+			for seed in range(0,256):
+				if len(set([hashWord(seed,w) & (slots-1) for w in words])) == len(words):
+					return seed,slots
+			slots = slots * 2
+		raise Exception("Cannot create word table")
+
 # ***************************************************************************************
+#		Hash of a word name, must be the same as KernelFindWord and BootImage.findWord
 # ***************************************************************************************
 
-import sys,os,re
-
-assert len(sys.argv) >= 2,"Insufficient components"
-print("Creating composite assembler file")
-hOut = open("temp"+os.sep+"__source.asm","w")									# output file
-wordCount = 0																	# used to name labels
-for libs in sys.argv[1:]:														# work through all libs
-	print("\tImporting from library "+libs)										
-	for root,dirs,files in os.walk("lib.source"+os.sep+libs):					# work through all files
-		for f in files:
-			print("\t\t\tImporting file "+f)
-			src = open(root+os.sep+f).readlines()
-			for l in src:
-				if l.startswith("@word"):										# if found @word
-					m = re.match("\@word\s*(.*)\((.*)\)\s*$",l.lower())			# break it up
-					assert m is not None,"Bad line "+l
-					if wordCount == 0:
-						hOut.write("linkHeader:\n")
-					hOut.write("link{0}:\n".format(wordCount))					# put link to NEXT entry.
-					hOut.write("    dw link{0}-link{1}\n".format(wordCount+1,wordCount))	
-					pc = len([x for x in m.group(2).split(",") if x != ""])		# work out # of params
-					hOut.write(" 	db \"{0}\",{1}\n".format(m.group(1),pc)) 	# that ends the string
-					wordCount += 1								
-				else:
-					hOut.write(l.rstrip()+"\n")
-hOut.write("link{0}:\n".format(wordCount))										# write the last null link.
-hOut.write("    dw 0\n")					
-hOut.close()
-print("Loaded {0} words".format(wordCount))
\ No newline at end of file
+def hashWord(seed,name):
+	hash = seed
+	for c in name:
+		hash = (((hash << 3) | (hash >> 5)) + (ord(c) ^ seed)) & 0xFF 		# rotate left 3, add char xor seed
+	return hash
+
+# ***************************************************************************************
+#		Manifest of the SHA-1 of everything the kernel is built from, and the output.
+# ***************************************************************************************
+
+class BuildManifest(object):
+	UPTODATE = 3 																# exit status, 1 and 2 are Python's errors
+	def __init__(self,fileName):
+		self.fileName = fileName
+		self.inputs = {}
+	#
+	#		Add a file, or every file in a directory, as an input.
+	#
+	def addInput(self,path):
+		if os.path.isdir(path):
+			for root,dirs,files in os.walk(path):
+				for f in files:
+					self.addInput(root+os.sep+f)
+		else:
+			self.inputs[path] = self.hashFile(path)
+	#
+	#		Add something other than a file, e.g. arguments.
+	#
+	def addValue(self,name,value):
+		self.inputs[name] = hashlib.sha1(repr(value).encode()).hexdigest()
+	#
+	#		Check if the output was built from the current inputs.
+	#
+	def isUpToDate(self,output):
+		if not os.path.exists(self.fileName) or not os.path.exists(output):
+			return False
+		with open(self.fileName) as h:
+			manifest = json.load(h)
+		return manifest["inputs"] == self.inputs and manifest["output"] == self.hashFile(output)
+	#
+	#		Record the output as built from the current inputs.
+	#
+	def save(self,output):
+		with open(self.fileName,"w") as h:
+			json.dump({ "inputs":self.inputs,"output":self.hashFile(output) },h,indent = 1,sort_keys = True)
+	#
+	#		Check a file is at least as new as the manifest
+	#
+	def isNewer(self,fileName):
+		return os.path.exists(fileName) and os.path.getmtime(fileName) >= os.path.getmtime(self.fileName)
+	#
+	def hashFile(self,fileName):
+		with open(fileName,"rb") as h:
+			return hashlib.sha1(h.read()).hexdigest()
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	words = None
+	output = "temp"+os.sep+"__source.asm"
+	manifest = BuildManifest("temp"+os.sep+"__manifest.json")
+	if len(args) >= 2 and args[0] == "-w":										# only the words in a file
+		manifest.addInput(args[1])
+		words = [w.strip().lower() for w in open(args[1]).readlines() if w.strip() != ""]
+		args = args[2:]
+	assert len(args) >= 1,"Insufficient components"
+	manifest.addValue("(arguments)",[words is not None]+args)
+	manifest.addInput(sys.argv[0])												# this, and everything used
+	manifest.addInput("library.asm")
+	manifest.addInput("common")
+	for libs in args:
+		manifest.addInput("lib.source"+os.sep+libs)
+	if manifest.isUpToDate(output):
+		print("Composite assembler file is up to date")
+	else:
+		print("Creating composite assembler file")
+		builder = KernelBuilder(args)
+		blocks = builder.selectBlocks(words)
+		wordCount = builder.write(output,blocks)
+		print("Loaded {0} words".format(wordCount))
+		manifest.save(output)
+	if manifest.isNewer("standard.lib"):										# assemble if older
+		sys.exit(BuildManifest.UPTODATE)
@@ -311,152 +311,6 @@ __ZXWCExit:
 ; *********************************************************************************
 ; *********************************************************************************
 ;
-;		File:		graphics.asm
-;		Purpose:	General screen I/O routines
-;		Date : 		28th December 2018
-;		Author:		paul@robsons.org.uk
-;
-; *********************************************************************************
-; *********************************************************************************
-
-link6:
-    dw link7-link6
- 	db "console.setmode",1
-		jp 		GFXMode
-
-link7:
-    dw link8-link7
- 	db "console.write",2
-		jp 		GFXWriteCharacter
-
-link8:
-    dw link9-link8
- 	db "console.writehex",2
-		jp 		GFXWriteHexWord
-
-link9:
-    dw link10-link9
- 	db "console.info",1
-		ld 		de,DisplayInformation
-		ld 		(hl),e
-		inc 	hl
-		ld 		(hl),d
-		ret
-
-; *********************************************************************************
-;
-;								Set Graphics Mode to L
-;
-; *********************************************************************************
-
-GFXMode:
-		push 	bc
-		push 	de
-		push 	hl
-		dec 	l 									; L = 1 mode layer2
-		jr 		z,__GFXLayer2
-		dec 	l
-		jr 		z,__GFXLowRes 						; L = 2 mode lowres
-
-		call 	GFXInitialise48k					; L = 0 or anything else, 48k mode.
-		jr 		__GFXConfigure
-
-__GFXLayer2:
-		call 	GFXInitialiseLayer2
-		jr 		__GFXConfigure
-
-__GFXLowRes:
-		call 	GFXInitialiseLowRes
-
-__GFXConfigure:
-		ld 		a,l 								; save screen size
-		ld 		(SIScreenWidth),a
-		ld 		a,h
-		ld 		(SIScreenHeight),a
-		ex 		de,hl 								; save driver
-		ld 		(SIScreenDriver),hl
-
-		ld 		l,d 								; put sizes in HL DE
-		ld 		h,0
-		ld 		d,0
-		call 	MULTMultiply16 						; multiply to get size and store.
-		ld 		(SIScreenSize),hl
-
-		pop 	hl
-		pop 	de
-		pop 	bc
-		ret
-
-; *********************************************************************************
-;
-;		Write character D (colour) E (character) to position HL.
-;
-; *********************************************************************************
-
-GFXWriteCharacter:
-		push 	af
-		push 	bc
-		push 	de
-		push 	hl
-		ld 		bc,__GFXWCExit
-		push 	bc
-		ld 		bc,(SIScreenDriver)
-		push 	bc
-		ret
-__GFXWCExit:
-		pop 	hl
-		pop 	de
-		pop 	bc
-		pop 	af
-		ret
-
-; *********************************************************************************
-;
-;						Write hex word DE at position HL
-;
-; *********************************************************************************
-
-GFXWriteHexWord:
-		ld 		a,5
-GFXWriteHexWordA:
-		push 	bc
-		push 	de
-		push 	hl
-		ld 		c,a
-		ld 		a,d
-		push 	de
-		call 	__GFXWHByte
-		pop 	de
-		ld 		a,e
-		call	__GFXWHByte
-		pop 	hl
-		pop 	de
-		pop 	bc
-		ret
-
-__GFXWHByte:
-		push 	af
-		rrc 	a
-		rrc		a
-		rrc 	a
-		rrc 	a
-		call 	__GFXWHNibble
-		pop 	af
-__GFXWHNibble:
-		ld 		d,c
-		and 	15
-		cp 		10
-		jr 		c,__GFXWHDigit
-		add		a,7
-__GFXWHDigit:
-		add 	a,48
-		ld 		e,a
-		call 	GFXWriteCharacter
-		inc 	hl
-		ret
-; *********************************************************************************
-; *********************************************************************************
-;
 ;		File:		screen_layer2.asm
 ;		Purpose:	Layer 2 console interface, sprites enabled, no shadow.
 ;		Date : 		28th December 2018
@@ -777,8 +631,8 @@ __LPExit:
 ; *********************************************************************************
 ; *********************************************************************************
 
-link10:
-    dw link11-link10
+link6:
+    dw link7-link6
  	db "console.inkey",1
 		call 	IOScanKeyboard 						; read keyboard
 		ld 		(hl),a 								; copy into variable
@@ -885,5 +739,155 @@ __kr_symbol_shift_table:
 		db 		3,  0,  0  ,'<','>',			16,17,18,19,20
 		db 		8, ')',23,  22, 21,				'"',';', 0, ']','['
 		db 		27, '=','+','-','^',			' ', 0, '.',',','*'
+; *********************************************************************************
+; *********************************************************************************
+;
+;		File:		graphics.asm
+;		Purpose:	General screen I/O routines
+;		Date : 		28th December 2018
+;		Author:		paul@robsons.org.uk
+;
+; *********************************************************************************
+; *********************************************************************************
+
+link7:
+    dw link8-link7
+ 	db "console.setmode",1
+		jp 		GFXMode
+
+link8:
+    dw link9-link8
+ 	db "console.write",2
+		jp 		GFXWriteCharacter
+
+link9:
+    dw link10-link9
+ 	db "console.writehex",2
+		jp 		GFXWriteHexWord
+
+link10:
+    dw link11-link10
+ 	db "console.info",1
+		ld 		de,DisplayInformation
+		ld 		(hl),e
+		inc 	hl
+		ld 		(hl),d
+		ret
+
+; *********************************************************************************
+;
+;								Set Graphics Mode to L
+;
+; *********************************************************************************
+
+GFXMode:
+		push 	bc
+		push 	de
+		push 	hl
+		dec 	l 									; L = 1 mode layer2
+		jr 		z,__GFXLayer2
+		dec 	l
+		jr 		z,__GFXLowRes 						; L = 2 mode lowres
+
+		call 	GFXInitialise48k					; L = 0 or anything else, 48k mode.
+		jr 		__GFXConfigure
+
+__GFXLayer2:
+		call 	GFXInitialiseLayer2
+		jr 		__GFXConfigure
+
+__GFXLowRes:
+		call 	GFXInitialiseLowRes
+
+__GFXConfigure:
+		ld 		a,l 								; save screen size
+		ld 		(SIScreenWidth),a
+		ld 		a,h
+		ld 		(SIScreenHeight),a
+		ex 		de,hl 								; save driver
+		ld 		(SIScreenDriver),hl
+
+		ld 		l,d 								; put sizes in HL DE
+		ld 		h,0
+		ld 		d,0
+		call 	MULTMultiply16 						; multiply to get size and store.
+		ld 		(SIScreenSize),hl
+
+		pop 	hl
+		pop 	de
+		pop 	bc
+		ret
+
+; *********************************************************************************
+;
+;		Write character D (colour) E (character) to position HL.
+;
+; *********************************************************************************
+
+GFXWriteCharacter:
+		push 	af
+		push 	bc
+		push 	de
+		push 	hl
+		ld 		bc,__GFXWCExit
+		push 	bc
+		ld 		bc,(SIScreenDriver)
+		push 	bc
+		ret
+__GFXWCExit:
+		pop 	hl
+		pop 	de
+		pop 	bc
+		pop 	af
+		ret
+
+; *********************************************************************************
+;
+;						Write hex word DE at position HL
+;
+; *********************************************************************************
+
+GFXWriteHexWord:
+		ld 		a,5
+GFXWriteHexWordA:
+		push 	bc
+		push 	de
+		push 	hl
+		ld 		c,a
+		ld 		a,d
+		push 	de
+		call 	__GFXWHByte
+		pop 	de
+		ld 		a,e
+		call	__GFXWHByte
+		pop 	hl
+		pop 	de
+		pop 	bc
+		ret
+
+__GFXWHByte:
+		push 	af
+		rrc 	a
+		rrc		a
+		rrc 	a
+		rrc 	a
+		call 	__GFXWHNibble
+		pop 	af
+__GFXWHNibble:
+		ld 		d,c
+		and 	15
+		cp 		10
+		jr 		c,__GFXWHDigit
+		add		a,7
+__GFXWHDigit:
+		add 	a,48
+		ld 		e,a
+		call 	GFXWriteCharacter
+		inc 	hl
+		ret
 link11:
     dw 0
+WordTable:
+    db 4,15
+    dw link4,link0,link2,link8,0,link3,link1,0
+    dw link9,0,link10,link7,link5,0,0,link6
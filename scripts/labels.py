@@ -9,7 +9,7 @@
 # *********************************************************************************
 # *********************************************************************************
 
-import re,sys
+import re,sys,os,hashlib,json
 
 class ZasmLabelExtractor(object):
 	def __init__(self,listFile):
@@ -42,4 +42,30 @@ class SnasmLabelExtractor(object):
 		return self.labels
 
 class LabelExtractor(SnasmLabelExtractor):
-	pass
\ No newline at end of file
+	pass
+
+# *********************************************************************************
+#
+#		Get the labels from a list file. These are kept in a .labels file with the
+#		SHA-1 of the list file, and only extracted again if the list file changes.
+#
+# *********************************************************************************
+
+def getLabels(listFile,extractor = LabelExtractor):
+	with open(listFile,"rb") as h:
+		hash = hashlib.sha1(h.read()).hexdigest()
+	cacheFile = listFile+".labels"
+	key = extractor.__name__+":"+hash
+	if os.path.exists(cacheFile):
+		with open(cacheFile) as h:
+			cache = json.load(h)
+		if cache["key"] == key:
+			return cache["labels"]
+	labels = extractor(listFile).getLabels()
+	with open(cacheFile,"w") as h:
+		json.dump({ "key":key,"labels":labels },h)
+	return labels
+
+if __name__ == "__main__":
+	labels = getLabels(sys.argv[1],ZasmLabelExtractor)
+	print("{0} labels in {1}".format(len(labels),sys.argv[1]))